@@ -0,0 +1,200 @@
+# benchmarks/bench_db.py
+# db.py 공개 함수 전부를 데이터셋 크기별로 실행 시간을 재고 JSON 보고서를 남깁니다.
+#   python benchmarks/bench_db.py --users 1000,10000,100000 --days 90 --json bench_db.json
+# 크기마다 gen_dataset.generate 로 임시 DB 를 새로 만들고, 함수마다 --repeat 번 실행해 min/median(ms)을 잽니다.
+# 보고서의 scaling 은 크기가 커질 때 median 이 늘어난 비율의 지수 (log(t2/t1) / log(n2/n1)) 입니다.
+#   0 근처 = 크기와 무관(인덱스 조회), 1 근처 = 선형(전체 스캔), 그 이상 = 선형보다 나쁨.
+# 쓰기 함수도 그대로 실행하므로(매번 다른 사용자) 데이터가 조금씩 바뀌지만 측정에는 영향이 거의 없습니다.
+import argparse
+import inspect
+import json
+import math
+import os
+import platform
+import random
+import sqlite3
+import statistics
+import sys
+import tempfile
+import time
+from datetime import date, datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+_tmp = tempfile.TemporaryDirectory()
+# db 는 import 시 DB 를 초기화하므로 trainer.db 대신 임시 파일을 쓰게 합니다.
+os.environ["TRAINER_DB"] = os.path.join(_tmp.name, "import.db")
+import db  # noqa: E402
+from gen_dataset import generate  # noqa: E402
+
+# 측정하지 않는 공개 함수 (연결/버퍼 관리 등 조회·갱신 경로가 아닌 것)
+SKIPPED = {
+    "close_all": "연결 관리",
+    "set_cursor_factory": "계측 설정",
+    "init_db": "스키마 생성 (데이터셋 생성에 포함)",
+    "migrate": "스키마 마이그레이션 (데이터셋 생성에 포함)",
+    "schema_version": "스키마 마이그레이션",
+    "pending_migrations": "스키마 마이그레이션",
+    "enable_write_buffer": "버퍼 설정",
+    "disable_write_buffer": "버퍼 설정",
+    "flush_writes": "버퍼 설정",
+    "write_buffer_stats": "버퍼 설정",
+    "default_prompt_minute": "DB 접근 없음",
+}
+
+
+class Ctx:
+    """벤치마크 인자를 만드는 데 쓰는 데이터셋 정보."""
+
+    def __init__(self, n_users: int, last_day: str, seed: int = 0):
+        self.rnd = random.Random(seed)
+        self.n_users = n_users
+        last = date.fromisoformat(last_day)
+        self.today = last.strftime("%Y-%m-%d")
+        monday = last - timedelta(days=last.weekday())
+        self.week_start = monday.strftime("%Y-%m-%d")
+        self.week_end = (monday + timedelta(days=6)).strftime("%Y-%m-%d")
+        self.prev_week = (monday - timedelta(days=7)).strftime("%Y-%m-%d")
+        self.prev_month = (monday.replace(day=1) - timedelta(days=1)).strftime("%Y-%m")
+        self.counter = 0
+
+    def uid(self) -> str:
+        return str(10**17 + self.rnd.randrange(self.n_users))
+
+    def uids(self, k: int) -> list:
+        return [str(10**17 + i) for i in self.rnd.sample(range(self.n_users), min(k, self.n_users))]
+
+    def next_id(self) -> int:
+        self.counter += 1
+        return self.counter
+
+
+# 함수 이름 → ctx 로 (args, kwargs) 를 만드는 함수
+CASES = {
+    "set_weight_goal": lambda c: ((c.uid(), "n", c.today, c.week_end, 60.0, 70.0), {}),
+    "set_freq_goal": lambda c: ((c.uid(), "n", "freq_exercise", 3, c.today), {}),
+    "delete_goal": lambda c: ((c.uid(), "freq_diet"), {}),
+    "get_active_goals": lambda c: ((c.uid(),), {}),
+    "get_goal_last_modified": lambda c: ((c.uid(), "freq_exercise"), {}),
+    "get_goal_history": lambda c: ((c.uid(),), {}),
+    "update_current_weight": lambda c: ((c.uid(), 65.0), {}),
+    "increment_exercise_log": lambda c: ((c.uid(), c.today), {}),
+    "increment_diet_log": lambda c: ((c.uid(), c.today), {"event_id": f"bench{c.next_id()}"}),
+    "get_week_progress": lambda c: ((c.uid(), c.week_start, c.week_end), {}),
+    "get_week_progress_many": lambda c: ((c.uids(100), c.week_start, c.week_end), {}),
+    "get_muscle_ranking_top5": lambda c: ((), {}),
+    "get_exercise_ranking_top5": lambda c: ((c.week_start, c.week_end), {}),
+    "get_diet_ranking_top5": lambda c: ((c.week_start, c.week_end), {}),
+    "award_weekly_badges": lambda c: ((c.prev_week,), {}),
+    "award_monthly_trophy": lambda c: ((c.prev_month,), {}),
+    "get_job_watermark": lambda c: ((db.WEEKLY_JOB,), {}),
+    "run_job": lambda c: ((db.WEEKLY_JOB, c.prev_week), {}),            # 이미 끝낸 기간 → 워터마크 확인만
+    "run_due_jobs": lambda c: ((datetime.fromisoformat(c.today + "T12:00"),), {}),
+    "load_user_state": lambda c: ((c.uid(), c.week_start, c.week_end), {}),
+    "record_weight": lambda c: ((c.uid(), 66.0, 40), {}),
+    "get_weight_prompt_targets": lambda c: ((), {}),
+    "set_prompt_schedule": lambda c: ((c.uid(), "n", "Asia/Seoul", 6, 21 * 60), {}),
+    "get_prompt_schedule": lambda c: ((c.uid(),), {}),
+    "claim_weight_prompts": lambda c: ((), {}),
+    "release_weight_prompts": lambda c: ((c.uids(100),), {}),
+    "get_ranking_scores": lambda c: ((c.week_start,), {}),
+    "load_dm_contexts": lambda c: (("weight_setup",), {}),
+    "save_dm_context": lambda c: (("weight_setup", c.uid(), {"stage": 1}), {}),
+    "delete_dm_context": lambda c: (("weight_setup", c.uid()), {}),
+    "get_dm_channels": lambda c: ((c.uids(100),), {}),
+    "update_dm_channels": lambda c: (({uid: 10**18 + i for i, uid in enumerate(c.uids(100))},), {}),
+    "load_voice_sessions": lambda c: ((), {}),
+    "open_voice_session": lambda c: ((c.uid(), 1, datetime.fromisoformat(c.today + "T09:00")), {}),
+    "close_voice_session": lambda c: ((c.uid(), datetime.fromisoformat(c.today + "T10:00")), {}),
+    "get_bot_state": lambda c: (("forum_watermark",), {}),
+    "set_bot_state": lambda c: (("bench", c.next_id()), {}),
+    "advance_bot_state": lambda c: (("bench_watermark", c.next_id()), {}),
+    "apply_missed_diet_posts": lambda c: (([(f"bench-post{c.next_id()}", uid, c.today) for uid in c.uids(50)],
+                                           "bench_forum", c.counter), {}),
+    "save_snapshot": lambda c: ((c.next_id(), c.today, {"users": {}}), {}),
+    "get_latest_snapshot": lambda c: ((), {}),
+    "get_journal_head": lambda c: ((), {}),
+    "iter_events": lambda c: ((), {}),
+}
+
+
+def public_functions() -> list:
+    return sorted(name for name, obj in vars(db).items()
+                  if inspect.isfunction(obj) and obj.__module__ == db.__name__ and not name.startswith("_"))
+
+
+def bench_size(n_users: int, days: int, repeat: int, path: str, seed: int) -> dict:
+    info = generate(path, n_users, days, seed)
+    ctx = Ctx(n_users, info["last_day"], seed)
+    results = {}
+    for name in public_functions():
+        if name in SKIPPED or name not in CASES:
+            continue
+        func = getattr(db, name)
+        runs = []
+        for _ in range(repeat):
+            args, kwargs = CASES[name](ctx)
+            t0 = time.perf_counter()
+            out = func(*args, **kwargs)
+            if inspect.isgenerator(out):
+                out = sum(1 for _ in out)
+            runs.append((time.perf_counter() - t0) * 1000)
+        results[name] = {"runs_ms": [round(t, 3) for t in runs],
+                         "min_ms": round(min(runs), 3), "median_ms": round(statistics.median(runs), 3)}
+    db.close_all()
+    return {"users": n_users, "days": days, "dataset": info, "functions": results}
+
+
+def scaling(sizes: list) -> dict:
+    """함수별로 인접한 크기 쌍의 지수와, 가장 작은 크기 대비 가장 큰 크기의 지수."""
+    out = {}
+    for name in sizes[0]["functions"]:
+        points = [(s["users"], s["functions"][name]["median_ms"]) for s in sizes if name in s["functions"]]
+        exps = []
+        for (n1, t1), (n2, t2) in zip(points, points[1:]):
+            exps.append(round(math.log(max(t2, 1e-3) / max(t1, 1e-3)) / math.log(n2 / n1), 2) if n2 != n1 else None)
+        out[name] = {"pairwise": exps, "worst": max((e for e in exps if e is not None), default=None)}
+    return out
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--users", default="1000,10000,100000", help="쉼표로 구분한 사용자 수 목록")
+    parser.add_argument("--days", type=int, default=90)
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--json", default="bench_db.json", help="보고서 파일")
+    args = parser.parse_args()
+
+    missing = [name for name in public_functions() if name not in CASES and name not in SKIPPED]
+    if missing:
+        print("⚠️ 측정 케이스가 없는 공개 함수: " + ", ".join(missing))
+
+    sizes = []
+    for n in (int(s) for s in args.users.split(",")):
+        t0 = time.perf_counter()
+        result = bench_size(n, args.days, args.repeat, os.path.join(_tmp.name, f"bench_{n}.db"), args.seed)
+        sizes.append(result)
+        d = result["dataset"]
+        print(f"{n:>9,} users / {args.days} days — exercise_log {d['exercise_log']:,}, diet_log {d['diet_log']:,}, "
+              f"weekly_status {d['weekly_status']:,} (generate {d['seconds']}s, total {time.perf_counter() - t0:.1f}s)")
+    report = {
+        "meta": {"created_at": datetime.now().isoformat(), "python": platform.python_version(),
+                 "sqlite": sqlite3.sqlite_version, "repeat": args.repeat, "days": args.days,
+                 "skipped": SKIPPED, "missing": missing},
+        "sizes": sizes,
+        "scaling": scaling(sizes),
+    }
+    with open(args.json, "w") as f:
+        json.dump(report, f, indent=2, ensure_ascii=False)
+
+    header = "".join(f"{s['users']:>12,}" for s in sizes)
+    print(f"\n{'function (median ms)':<28}{header}   scaling")
+    for name, sc in sorted(report["scaling"].items(), key=lambda kv: -(kv[1]["worst"] or 0)):
+        cells = "".join(f"{s['functions'][name]['median_ms']:>12.3f}" for s in sizes)
+        print(f"{name:<28}{cells}   {sc['worst'] if sc['worst'] is not None else '-'}")
+    print(f"\n보고서: {args.json}")
+
+
+if __name__ == "__main__":
+    main()
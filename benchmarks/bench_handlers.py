@@ -0,0 +1,272 @@
+# benchmarks/bench_handlers.py
+# Discord 접속 없이 main.py 이벤트 핸들러를 가짜 이벤트로 돌려 처리량을 잽니다.
+#   python benchmarks/bench_handlers.py --members 1000,10000,100000 --events 20000
+# 가짜 Member / VoiceState / Thread / Message / Interaction 을 만들어
+#   on_voice_state_update(입장·퇴장), on_thread_create(식단 인증), on_message(체중 목표 DM 3단계),
+#   MainMenuView 버튼(목표설정·기록확인·근육랭킹) 을 설정한 비율로 호출합니다.
+# 시각은 가상 시계(get_kst_now 대체)로 흐르므로 음성 15분 인정, 주 경계 등이 실제 시간 없이 재현됩니다.
+# 회원 수마다 별도 프로세스·임시 DB 에서 실행하고 events/s, 핸들러별 p50/p99 지연(ms), 최대 RSS 를 출력합니다.
+import argparse
+import asyncio
+import heapq
+import json
+import os
+import random
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+from types import SimpleNamespace
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+VOICE_CHANNEL_ID = 1
+# 가상 시계 1초당 이벤트 비율 (상대값). --mix voice=5,thread=2,... 로 바꿀 수 있음
+DEFAULT_MIX = {"voice": 4.0, "thread": 3.0, "dm": 0.5, "button": 2.5}
+BUTTONS = ("on_goal_settings", "on_view_progress", "on_muscle_ranking")
+
+
+def populate(db, n_members: int, monday: str, seed: int = 0):
+    """회원과 목표를 한 트랜잭션으로 적재합니다. (80% 운동, 70% 식단, 30% 체중 목표)"""
+    rnd = random.Random(seed)
+    now = datetime.now().isoformat()
+    monday = db._day(monday)
+    users, goals = [], []
+    for i in range(n_members):
+        uid = str(10**17 + i)
+        users.append((uid, f"member{i}"))
+        if rnd.random() < 0.8:
+            goals.append((uid, "freq_exercise", monday, None, None, None, rnd.randint(1, 7), now, None))
+        if rnd.random() < 0.7:
+            goals.append((uid, "freq_diet", monday, None, None, None, rnd.randint(1, 7), now, None))
+        if rnd.random() < 0.3:
+            goals.append((uid, "weight", monday, None, 60.0, 70.0, None, now, 72.0))
+    with db._writer() as cur:
+        cur.executemany("INSERT INTO users (user_id, nickname) VALUES (?, ?)", users)
+        cur.executemany("""
+            INSERT INTO goals (user_id, type, start_date, end_date, target_weight, current_weight, freq_per_week,
+                               last_modified, start_weight)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)""", goals)
+
+
+# -----------------------------------------------------------------------------
+# 가짜 Discord 객체
+# -----------------------------------------------------------------------------
+class FakeDM:
+    """send 만 하는 DM 채널. main.on_message 의 isinstance(discord.DMChannel) 검사를 통과하도록 서브클래스로 만듦."""
+
+    def __init__(self):
+        self.sent = 0
+
+    async def send(self, content=None, **kwargs):
+        self.sent += 1
+
+
+class FakeMember:
+    __slots__ = ("id", "display_name", "bot", "display_avatar", "dm")
+
+    def __init__(self, uid: int, dm_cls):
+        self.id = uid
+        self.display_name = f"member{uid % 10**6}"
+        self.bot = False
+        self.display_avatar = SimpleNamespace(url="https://cdn.example/avatar.png")
+        self.dm = dm_cls.__new__(dm_cls)
+        FakeDM.__init__(self.dm)
+
+    async def create_dm(self):
+        return self.dm
+
+
+class FakeResponse:
+    async def edit_message(self, **kwargs):
+        pass
+
+    async def send_message(self, *args, **kwargs):
+        pass
+
+
+class FakeGuild:
+    def __init__(self, members: dict):
+        self._members = members
+
+    def get_member(self, uid: int):
+        return self._members.get(uid)
+
+
+def voice_state(channel_id):
+    return SimpleNamespace(channel=SimpleNamespace(id=channel_id) if channel_id is not None else None)
+
+
+def interaction(member, guild):
+    return SimpleNamespace(user=member, guild=guild, response=FakeResponse(), followup=member.dm)
+
+
+# -----------------------------------------------------------------------------
+# 시뮬레이션
+# -----------------------------------------------------------------------------
+class SimClock:
+    def __init__(self, start: datetime):
+        self.now = start
+
+    def __call__(self) -> datetime:
+        return self.now
+
+
+def percentile(sorted_values: list, q: float) -> float:
+    if not sorted_values:
+        return 0.0
+    return sorted_values[min(len(sorted_values) - 1, int(q * len(sorted_values)))]
+
+
+async def simulate(n_members: int, n_events: int, rate: float, mix: dict, seed: int) -> dict:
+    import discord
+    import db
+    import main
+
+    tz = main.timezone("Asia/Seoul")
+    start = tz.localize(datetime(2026, 3, 2, 9, 0))   # 월요일 09:00
+    clock = SimClock(start)
+    main.get_kst_now = clock                          # user_goals.today_fn 은 이 이름을 호출
+    main.voice_tracker.now_fn = clock
+    main.voice_tracker.channel_ids = {VOICE_CHANNEL_ID}
+    main.bot._connection.user = SimpleNamespace(avatar=SimpleNamespace(url="https://cdn.example/bot.png"))
+
+    t0 = time.perf_counter()
+    populate(db, n_members, start.strftime("%Y-%m-%d"), seed)
+    populate_s = time.perf_counter() - t0
+    await main.load_rankings()
+
+    class DMChannel(discord.DMChannel):
+        send = FakeDM.send
+
+    rnd = random.Random(seed)
+    members = {10**17 + i: FakeMember(10**17 + i, DMChannel) for i in range(n_members)}
+    ids = list(members)
+    guild = FakeGuild(members)
+    forum = SimpleNamespace(type=discord.ChannelType.forum, id=main.FORUM_CHANNEL_ID)
+    view = main.MainMenuView()
+    kinds = list(mix)
+    weights = [mix[k] for k in kinds]
+
+    # (가상 시각, 순번, 핸들러 이름, 인자) 우선순위 큐. 음성 퇴장·DM 다음 단계는 나중 시각으로 예약됨
+    queue: list = []
+    seq = 0
+
+    def schedule(at: datetime, name: str, args: tuple):
+        nonlocal seq
+        seq += 1
+        heapq.heappush(queue, (at, seq, name, args))
+
+    at = start
+    for _ in range(n_events):
+        at += timedelta(seconds=rnd.expovariate(rate))
+        kind = rnd.choices(kinds, weights)[0]
+        member = members[rnd.choice(ids)]
+        if kind == "voice":
+            schedule(at, "voice_join", (member,))
+            schedule(at + timedelta(minutes=rnd.uniform(3, 60)), "voice_leave", (member,))
+        elif kind == "thread":
+            schedule(at, "thread", (member, int(at.timestamp() * 1000) + seq))
+        elif kind == "dm":
+            schedule(at, "on_weight_loss_goal", (member,))
+            for step, text in enumerate((str(rnd.randint(4, 12)), "72.5", "65")):
+                schedule(at + timedelta(seconds=20 * (step + 1)), "dm_message", (member, text))
+        else:
+            schedule(at, rnd.choice(BUTTONS), (member,))
+
+    latencies: dict[str, list] = {}
+    handled = 0
+    started = time.perf_counter()
+    while queue:
+        at, _, name, args = heapq.heappop(queue)
+        clock.now = at
+        member = args[0]
+        t = time.perf_counter()
+        if name == "voice_join":
+            await main.on_voice_state_update(member, voice_state(None), voice_state(VOICE_CHANNEL_ID))
+        elif name == "voice_leave":
+            await main.on_voice_state_update(member, voice_state(VOICE_CHANNEL_ID), voice_state(None))
+        elif name == "thread":
+            await main.on_thread_create(SimpleNamespace(id=args[1], owner_id=member.id, parent=forum))
+        elif name == "dm_message":
+            await main.on_message(SimpleNamespace(author=member, channel=member.dm, content=args[1]))
+        elif name == "on_weight_loss_goal":
+            await main.ExerciseGoalView.on_weight_loss_goal(None, interaction(member, guild), None)
+        else:
+            await getattr(main.MainMenuView, name)(view, interaction(member, guild), None)
+        latencies.setdefault(name, []).append(time.perf_counter() - t)
+        handled += 1
+    elapsed = time.perf_counter() - started
+
+    handlers = {}
+    for name, values in sorted(latencies.items()):
+        values.sort()
+        handlers[name] = {"count": len(values),
+                          "p50_ms": round(percentile(values, 0.50) * 1000, 3),
+                          "p99_ms": round(percentile(values, 0.99) * 1000, 3)}
+    return {
+        "members": n_members,
+        "events": handled,
+        "populate_s": round(populate_s, 2),
+        "elapsed_s": round(elapsed, 2),
+        "events_per_s": round(handled / elapsed, 1) if elapsed else 0.0,
+        "simulated_hours": round((clock.now - start).total_seconds() / 3600, 1),
+        "max_rss_mib": round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1),
+        "user_cache": {"size": len(main.user_goals), "hits": main.user_goals.hits, "misses": main.user_goals.misses},
+        "handlers": handlers,
+    }
+
+
+def run_child(args):
+    # main → db 가 import 시 DB 를 초기화하므로 import 전에 임시 DB 경로를 지정
+    with tempfile.TemporaryDirectory() as tmp:
+        os.environ["TRAINER_DB"] = os.path.join(tmp, "bench.db")
+        mix = dict(DEFAULT_MIX)
+        for item in filter(None, args.mix.split(",")):
+            key, value = item.split("=")
+            mix[key] = float(value)
+        result = asyncio.run(simulate(int(args.members), args.events, args.rate, mix, args.seed))
+        import db_async
+        db_async.shutdown()
+    print(json.dumps(result))
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--members", default="1000,10000,100000", help="쉼표로 구분한 회원 수 목록")
+    parser.add_argument("--events", type=int, default=20000, help="회원 수마다 만들 이벤트 수 (음성 퇴장, DM 단계 제외)")
+    parser.add_argument("--rate", type=float, default=2.0, help="가상 시계 기준 초당 이벤트 수")
+    parser.add_argument("--mix", default="", help="이벤트 비율 덮어쓰기, 예) voice=5,thread=1,dm=0,button=2")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--json", help="결과를 JSON 파일로도 저장")
+    parser.add_argument("--child", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        run_child(args)
+        return
+
+    results = []
+    for n in (int(s) for s in args.members.split(",")):
+        out = subprocess.run(
+            [sys.executable, os.path.abspath(__file__), "--child", "--members", str(n), "--events", str(args.events),
+             "--rate", str(args.rate), "--mix", args.mix, "--seed", str(args.seed)],
+            check=True, stdout=subprocess.PIPE, text=True,
+        )
+        result = json.loads(out.stdout.strip().splitlines()[-1])
+        results.append(result)
+        print(f"{n:>9,} members  {result['events']:,} events  {result['events_per_s']:>8,.0f} ev/s  "
+              f"max RSS {result['max_rss_mib']:.0f} MiB  (populate {result['populate_s']}s, "
+              f"simulated {result['simulated_hours']}h)")
+        for name, h in result["handlers"].items():
+            print(f"    {name:<20} n={h['count']:<7,} p50 {h['p50_ms']:7.2f}ms  p99 {h['p99_ms']:7.2f}ms")
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,128 @@
+# benchmarks/bench_user_state_memory.py
+# user_goals 캐시 항목의 메모리 사용량 비교: 예전 중첩 dict 형태 vs store.UserState(__slots__ + 요일 비트마스크).
+#   python benchmarks/bench_user_state_memory.py --sizes 100000,1000000
+# 같은 가짜 load_user_state 결과로 두 형태를 만들고 tracemalloc 으로 할당량을 잽니다.
+import argparse
+import gc
+import os
+import random
+import sys
+import tempfile
+import time
+import tracemalloc
+from datetime import date, datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+# store → db_async → db 가 import 시 DB 를 초기화하므로 trainer.db 대신 임시 파일을 쓰게 합니다.
+_tmp = tempfile.TemporaryDirectory()
+os.environ["TRAINER_DB"] = os.path.join(_tmp.name, "bench.db")
+from store import WEEKDAY_NAMES, _build_state, _week_key, week_bounds  # noqa: E402
+
+
+def fake_raw(rnd: random.Random, days: list[str]) -> dict:
+    """db.load_user_state 가 돌려주는 형태의 가짜 사용자 상태."""
+    daily = {d: {"exercise": int(rnd.random() < 0.5), "diet": rnd.choice((0, 0, 1, 2))} for d in days}
+    goals = {}
+    if rnd.random() < 0.8:
+        goals["freq_exercise"] = {"freq_per_week": rnd.randint(1, 7)}
+    if rnd.random() < 0.7:
+        goals["freq_diet"] = {"freq_per_week": rnd.randint(1, 7)}
+    if rnd.random() < 0.3:
+        goals["weight"] = {"start_date": days[0], "end_date": days[-1], "target_weight": 60.0,
+                           "current_weight": 70.0, "start_weight": 72.5,
+                           "progress_pct": rnd.randint(0, 100), "achieved": 0}
+    records = {}
+    for kind, goal in (("exercise", "freq_exercise"), ("diet", "freq_diet")):
+        if goal in goals:
+            streak = rnd.randint(1, 10)
+            records[kind] = {"current_streak": streak, "longest_streak": streak + rnd.randint(0, 20),
+                             "last_day": days[rnd.randrange(len(days))], "best_week": rnd.randint(1, 7),
+                             "best_week_start": days[0], "total": rnd.randint(streak, 300),
+                             "last_week_count": rnd.randint(1, 7)}
+    return {
+        "nickname": None,
+        "badges": {"weekly": rnd.randint(0, 20), "monthly": rnd.randint(0, 3), "bikini": rnd.randint(0, 1)},
+        "goals": goals,
+        "records": records,
+        "progress": {
+            "daily": daily,
+            "exercise_done": sum(c["exercise"] for c in daily.values()),
+            "diet_done": sum(c["diet"] for c in daily.values()),
+        },
+    }
+
+
+def legacy_state(raw: dict, week_start: str) -> dict:
+    """예전 store._build_state 가 만들던 중첩 dict 형태."""
+    progress = raw["progress"]
+    state = {
+        "week_start": week_start,
+        "nickname": raw["nickname"],
+        "badges": {
+            "weekly_badges": raw["badges"]["weekly"],
+            "bikinis": raw["badges"]["bikini"],
+            "monthly_trophies": raw["badges"]["monthly"],
+        },
+        # 예전에는 load_user_state 결과의 daily 를 그대로 물고 있었으므로 사용자마다 복사본을 둡니다.
+        "daily": {d: dict(c) for d, c in progress["daily"].items()},
+    }
+    goals = raw["goals"]
+    if "weight" in goals:
+        g = goals["weight"]
+        weeks = (datetime.strptime(g["end_date"], "%Y-%m-%d") - datetime.strptime(g["start_date"], "%Y-%m-%d")).days // 7
+        state["weight_goal"] = {"weeks": weeks, "start_weight": g["start_weight"], "target_weight": g["target_weight"],
+                                "achieved": g["achieved"], "progress_pct": g["progress_pct"]}
+    if "freq_exercise" in goals:
+        state["frequency_goal"] = {"per_week": goals["freq_exercise"]["freq_per_week"],
+                                   "achieved_this_week": progress["exercise_done"]}
+    if "freq_diet" in goals:
+        state["diet_goal"] = {"per_week": goals["freq_diet"]["freq_per_week"],
+                              "achieved_this_week": progress["diet_done"]}
+    days = list(state["daily"].items())[:5]
+    state["weekly_log"] = {name: bool(c["exercise"] or c["diet"]) for name, (_, c) in zip(WEEKDAY_NAMES, days)}
+    return state
+
+
+def measure(build, n: int, seed: int = 0) -> tuple[int, float]:
+    """n 명분 {user_id: 상태} 를 만들 때 늘어난 메모리(bytes)와 걸린 시간."""
+    today = date.today()
+    week_start, _ = week_bounds(today)
+    monday = today - timedelta(days=today.weekday())
+    days = [(monday + timedelta(days=i)).strftime("%Y-%m-%d") for i in range(7)]
+    rnd = random.Random(seed)
+    gc.collect()
+    tracemalloc.start()
+    t0 = time.perf_counter()
+    cache = {}
+    for i in range(n):
+        raw = fake_raw(rnd, days)
+        cache[str(10**17 + i)] = build(raw, today, week_start)
+        del raw
+    elapsed = time.perf_counter() - t0
+    current, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del cache
+    gc.collect()
+    return current, elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--sizes", default="100000,1000000",
+                        help="쉼표로 구분한 사용자 수 목록 (기본 100000,1000000)")
+    args = parser.parse_args()
+
+    shapes = {
+        "nested dict": lambda raw, today, week_start: legacy_state(raw, week_start),
+        "UserState": lambda raw, today, week_start: _build_state(raw, _week_key(today)),
+    }
+    for n in (int(s) for s in args.sizes.split(",")):
+        results = {name: measure(build, n) for name, build in shapes.items()}
+        base = results["nested dict"][0]
+        for name, (size, elapsed) in results.items():
+            print(f"{n:>9,} users  {name:<12} {size / 2**20:8.1f} MiB  "
+                  f"{size / n:6.0f} B/user  ({size / base:5.1%})  build {elapsed:.1f}s")
+
+
+if __name__ == "__main__":
+    main()
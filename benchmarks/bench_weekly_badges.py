@@ -0,0 +1,81 @@
+# benchmarks/bench_weekly_badges.py
+# 주간 배지 일괄 지급(award_weekly_badges) 실행 시간 측정.
+#   python benchmarks/bench_weekly_badges.py --users 100000
+# 임시 디렉터리에 별도 DB 를 만들어 실행하므로 trainer.db 는 건드리지 않습니다.
+import argparse
+import os
+import random
+import sys
+import tempfile
+import time
+from datetime import date, datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import db  # noqa: E402
+
+
+def populate(n_users: int, sunday: date, seed: int = 0):
+    """n_users 명의 사용자/목표와 이번 주 운동·식단 로그를 한 트랜잭션으로 적재합니다."""
+    rnd = random.Random(seed)
+    monday = sunday - timedelta(days=6)
+    days = [db._day(monday + timedelta(days=i)) for i in range(7)]   # 로그·목표 날짜는 에포크 일수
+    now = datetime.now().isoformat()
+    users, goals, ex_logs, dt_logs = [], [], [], []
+    for i in range(n_users):
+        uid = str(10**17 + i)
+        users.append((uid, f"user{i}"))
+        if rnd.random() < 0.8:
+            goals.append((uid, "freq_exercise", days[0], None, None, None, rnd.randint(1, 7), now))
+        if rnd.random() < 0.7:
+            goals.append((uid, "freq_diet", days[0], None, None, None, rnd.randint(1, 7), now))
+        if rnd.random() < 0.3:
+            goals.append((uid, "weight", days[0], None, 60.0, rnd.uniform(55, 70), None, now))
+        for d in days:
+            if rnd.random() < 0.5:
+                ex_logs.append((uid, d))
+            if rnd.random() < 0.5:
+                dt_logs.append((uid, d, rnd.randint(1, 3)))
+    with db._writer() as cur:
+        cur.executemany("INSERT INTO users (user_id, nickname) VALUES (?, ?)", users)
+        cur.executemany("""
+            INSERT INTO goals (user_id, type, start_date, end_date, target_weight, current_weight, freq_per_week, last_modified)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?)""", goals)
+        cur.executemany("INSERT INTO exercise_log (user_id, date, count) VALUES (?, ?, 1)", ex_logs)
+        cur.executemany("INSERT INTO diet_log (user_id, date, count) VALUES (?, ?, ?)", dt_logs)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--users", type=int, default=100_000)
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    today = date.today()
+    sunday = today + timedelta(days=6 - today.weekday())
+    monday = (sunday - timedelta(days=6)).strftime("%Y-%m-%d")
+    with tempfile.TemporaryDirectory() as tmp:
+        db.init_db(os.path.join(tmp, "bench.db"))
+        t0 = time.perf_counter()
+        populate(args.users, sunday)
+        print(f"populate: {args.users:,} users in {time.perf_counter() - t0:.2f}s")
+
+        timings = []
+        for _ in range(args.repeat):
+            t0 = time.perf_counter()
+            db.award_weekly_badges(monday)
+            timings.append(time.perf_counter() - t0)
+        with db._reader() as cur:
+            cur.execute("SELECT COUNT(*), SUM(achieved_exercise AND achieved_diet) FROM weekly_status")
+            rows, winners = cur.fetchone()
+        db.close_all()
+
+    print(f"weekly_status rows: {rows:,}  weekly badge winners: {winners or 0:,}")
+    if not winners:
+        # 적재한 데이터가 스윕 조건과 맞지 않으면(날짜 인코딩 등) 아무것도 지급하지 않는 실행을 재게 됨
+        sys.exit("⚠️ 주간 배지 수상자가 0명입니다. populate 데이터가 award_weekly_badges 와 맞지 않습니다.")
+    print("award_weekly_badges: " + ", ".join(f"{t * 1000:.0f}ms" for t in timings)
+          + f"  (best {min(timings) * 1000:.0f}ms)")
+
+
+if __name__ == "__main__":
+    main()
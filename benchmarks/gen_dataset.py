@@ -0,0 +1,158 @@
+# benchmarks/gen_dataset.py
+# 벤치마크용 가짜 trainer.db 생성기.
+#   python benchmarks/gen_dataset.py --out /tmp/scratch.db --users 100000 --days 90
+# 사용자마다 활동 성향을 베타 분포로 뽑고(열심인 사람은 소수), 주말엔 덜 하고, 일부는 중간에 그만두는 식으로
+# exercise_log / diet_log 를 만들고, 목표·weekly_status·주간 롤업·연속 기록·배지·정기 작업 워터마크까지 채웁니다.
+# 모든 행은 executemany 로 한 트랜잭션에 넣습니다. (행 목록을 만들지 않고 제너레이터로 흘려 넣음)
+import argparse
+import os
+import random
+import sys
+import time
+from datetime import date, datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+FREQ_CHOICES = (1, 2, 3, 4, 5, 6, 7)
+FREQ_WEIGHTS = (5, 15, 25, 25, 15, 10, 5)
+WEEKEND_FACTOR = 0.7
+CHURN_RATE = 0.15
+
+
+class _User:
+    __slots__ = ("uid", "joined", "left", "p_ex", "p_dt", "ex_goal", "dt_goal", "weight")
+
+    def __init__(self, rnd: random.Random, i: int, first: date, days: int):
+        self.uid = str(10**17 + i)
+        self.joined = first + timedelta(days=int(rnd.random() ** 2 * days * 0.6))   # 초반 가입이 많음
+        self.left = (self.joined + timedelta(days=rnd.randint(7, days))) if rnd.random() < CHURN_RATE else None
+        self.p_ex = rnd.betavariate(2, 3)
+        self.p_dt = rnd.betavariate(2, 2)
+        self.ex_goal = rnd.choices(FREQ_CHOICES, FREQ_WEIGHTS)[0] if rnd.random() < 0.85 else None
+        self.dt_goal = rnd.choices(FREQ_CHOICES, FREQ_WEIGHTS)[0] if rnd.random() < 0.7 else None
+        self.weight = rnd.uniform(55, 95) if rnd.random() < 0.3 else None
+
+    def active_on(self, d: date) -> bool:
+        return self.joined <= d and (self.left is None or d < self.left)
+
+
+def _logs(users, first: date, days: int, rnd: random.Random):
+    """(user_id, 에포크 일수, 운동 횟수, 식단 횟수) 를 날짜순으로 생성."""
+    import db
+
+    for offset in range(days):
+        d = first + timedelta(days=offset)
+        factor = WEEKEND_FACTOR if d.weekday() >= 5 else 1.0
+        day = db._day(d)
+        for u in users:
+            if not u.active_on(d):
+                continue
+            ex = int(u.ex_goal is not None and rnd.random() < u.p_ex * factor)
+            dt = rnd.choices((1, 2, 3), (70, 25, 5))[0] if u.dt_goal is not None and rnd.random() < u.p_dt * factor else 0
+            if ex or dt:
+                yield u.uid, day, ex, dt
+
+
+def generate(path: str, users: int, days: int, seed: int = 0, end: date = None) -> dict:
+    """path 에 users 명, end(기본: 어제)까지 days 일치 데이터를 만듭니다. 이미 있으면 지우고 새로 만듭니다."""
+    import db
+
+    db.close_all()
+    for suffix in ("", "-wal", "-shm"):
+        if os.path.exists(path + suffix):
+            os.remove(path + suffix)
+    db.init_db(path)
+    rnd = random.Random(seed)
+    end = end or date.today() - timedelta(days=1)
+    first = end - timedelta(days=days - 1)
+    people = [_User(rnd, i, first, days) for i in range(users)]
+    now = datetime.now().isoformat()
+    counts = {}
+    t0 = time.perf_counter()
+
+    with db._writer() as cur:
+        cur.executemany("INSERT INTO users (user_id, nickname) VALUES (?, ?)",
+                        ((u.uid, f"user{i}") for i, u in enumerate(people)))
+
+        def goal_rows():
+            for u in people:
+                start = db._day(u.joined)
+                if u.ex_goal is not None:
+                    yield u.uid, "freq_exercise", start, None, None, None, u.ex_goal, now, None, 0
+                if u.dt_goal is not None:
+                    yield u.uid, "freq_diet", start, None, None, None, u.dt_goal, now, None, 0
+                if u.weight is not None:
+                    target = round(u.weight * rnd.uniform(0.85, 0.97), 1)
+                    current = round(u.weight - rnd.uniform(-1, u.weight - target + 1), 1)
+                    end_date = db._day(u.joined + timedelta(weeks=rnd.randint(4, 24)))
+                    yield (u.uid, "weight", start, end_date, target, current, None, now, round(u.weight, 1),
+                           int(current <= target))
+        cur.executemany("""
+            INSERT INTO goals (user_id, type, start_date, end_date, target_weight, current_weight, freq_per_week,
+                               last_modified, start_weight, achieved)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)""", goal_rows())
+
+        # 로그는 한 번 생성해 두 테이블로 나눠 넣음 (생성량이 커서 임시 테이블을 거침)
+        cur.execute("CREATE TEMP TABLE gen_log (user_id TEXT, date INTEGER, ex INTEGER, dt INTEGER)")
+        cur.executemany("INSERT INTO gen_log VALUES (?, ?, ?, ?)", _logs(people, first, days, rnd))
+        cur.execute("INSERT INTO exercise_log (user_id, date, count) SELECT user_id, date, ex FROM gen_log WHERE ex > 0")
+        cur.execute("INSERT INTO diet_log (user_id, date, count) SELECT user_id, date, dt FROM gen_log WHERE dt > 0")
+        cur.execute("DROP TABLE temp.gen_log")
+        for table, log_table in (("exercise_weekly", "exercise_log"), ("diet_weekly", "diet_log")):
+            cur.execute(f"""
+                INSERT INTO {table} (user_id, week_start, count)
+                SELECT user_id, date - (date + 3) % 7 AS ws, SUM(count)
+                  FROM {log_table} GROUP BY user_id, ws
+            """)
+        db._backfill_records(cur)
+
+        # 끝난 주의 weekly_status 와 주간 배지, 정기 작업 워터마크
+        last_week = end - timedelta(days=end.weekday() + (0 if end.weekday() == 6 else 7))
+        cur.execute("""
+            INSERT INTO weekly_status (user_id, week_start, achieved_exercise, achieved_diet, weight_updated, achieved_weight)
+            SELECT u.user_id, w.week_start,
+                   COALESCE(ew.count, 0) >= COALESCE(ge.freq_per_week, 99),
+                   COALESCE(dw.count, 0) >= COALESCE(gd.freq_per_week, 99), 1, 0
+              FROM users u
+              JOIN (SELECT DISTINCT week_start FROM exercise_weekly WHERE week_start BETWEEN ? AND ?) w
+              LEFT JOIN goals ge ON ge.user_id = u.user_id AND ge.type = 'freq_exercise' AND ge.start_date <= w.week_start
+              LEFT JOIN goals gd ON gd.user_id = u.user_id AND gd.type = 'freq_diet' AND gd.start_date <= w.week_start
+              LEFT JOIN exercise_weekly ew ON ew.user_id = u.user_id AND ew.week_start = w.week_start
+              LEFT JOIN diet_weekly dw ON dw.user_id = u.user_id AND dw.week_start = w.week_start
+             WHERE ge.user_id IS NOT NULL OR gd.user_id IS NOT NULL
+        """, (db._day(first), db._day(last_week)))
+        cur.execute("""
+            UPDATE users SET badge_weekly = (SELECT COUNT(*) FROM weekly_status ws
+                                              WHERE ws.user_id = users.user_id AND ws.achieved_exercise AND ws.achieved_diet),
+                             badge_bikini = (SELECT COUNT(*) FROM goals g
+                                              WHERE g.user_id = users.user_id AND g.type = 'weight' AND g.achieved = 1)
+        """)
+        cur.execute("""
+            INSERT INTO job_runs (job, last_period, completed_at, duration_ms) VALUES (?, ?, ?, 0)
+        """, (db.WEEKLY_JOB, last_week.strftime("%Y-%m-%d"), now))
+
+        for table in ("users", "goals", "exercise_log", "diet_log", "weekly_status"):
+            cur.execute(f"SELECT COUNT(*) FROM {table}")
+            counts[table] = cur.fetchone()[0]
+    with db._writer() as cur:
+        cur.execute("ANALYZE")
+    counts["seconds"] = round(time.perf_counter() - t0, 2)
+    counts["first_day"] = first.strftime("%Y-%m-%d")
+    counts["last_day"] = end.strftime("%Y-%m-%d")
+    return counts
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--out", required=True, help="만들 DB 파일 (있으면 덮어씀)")
+    parser.add_argument("--users", type=int, default=10_000)
+    parser.add_argument("--days", type=int, default=90)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+    # db 는 import 시 TRAINER_DB 를 초기화하므로 대상 파일을 먼저 지정
+    os.environ["TRAINER_DB"] = args.out
+    print(generate(args.out, args.users, args.days, args.seed))
+
+
+if __name__ == "__main__":
+    main()
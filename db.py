@@ -1,300 +1,1815 @@
 # db.py
+import atexit
+import json
+import logging
+import os
 import sqlite3
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
 from datetime import datetime, date, timedelta
+from typing import Optional
 
-conn = sqlite3.connect("trainer.db", check_same_thread=False)
-cursor = conn.cursor()
-
-# 사용자
-cursor.execute("""
-CREATE TABLE IF NOT EXISTS users (
-    user_id TEXT PRIMARY KEY,
-    nickname TEXT,
-    badge_weekly INTEGER DEFAULT 0,
-    badge_monthly INTEGER DEFAULT 0,
-    badge_bikini INTEGER DEFAULT 0
-)
-""")
-
-# 목표(최대 3개, type: weight, freq_exercise, freq_diet, last_modified 추가)
-cursor.execute("""
-CREATE TABLE IF NOT EXISTS goals (
-    id INTEGER PRIMARY KEY AUTOINCREMENT,
-    user_id TEXT,
-    type TEXT,
-    start_date TEXT,
-    end_date TEXT,
-    target_weight REAL,
-    current_weight REAL,
-    freq_per_week INTEGER,
-    last_modified TEXT,
-    active INTEGER DEFAULT 1,
-    UNIQUE(user_id, type)
-)
-""")
-
-# 운동/식단 인증 로그
-cursor.execute("""
-CREATE TABLE IF NOT EXISTS exercise_log (
-    user_id TEXT,
-    date TEXT,
-    count INTEGER DEFAULT 0,
-    PRIMARY KEY(user_id, date)
+import pytz
+
+log = logging.getLogger("trainer.db")
+
+# -----------------------------------------------------------------------------
+# 연결 관리: 스레드별 연결 + WAL 저널링
+#   - 쓰기: 스레드별 쓰기 연결, 프로세스 전체에서 _write_lock 으로 한 번에 하나만 커밋
+#   - 읽기: 스레드별 읽기 전용 연결 (WAL 덕분에 쓰기 트랜잭션을 기다리지 않음)
+# -----------------------------------------------------------------------------
+DB_PATH = os.getenv("TRAINER_DB", "trainer.db")
+
+PRAGMAS = (
+    "PRAGMA journal_mode = WAL",
+    "PRAGMA synchronous = NORMAL",      # WAL 에서는 NORMAL 로도 손상 없음 (마지막 커밋만 유실 가능)
+    "PRAGMA cache_size = -16000",       # 약 16MB 페이지 캐시
+    "PRAGMA mmap_size = 268435456",     # 256MB 메모리 맵 읽기
+    "PRAGMA temp_store = MEMORY",
+    "PRAGMA busy_timeout = 5000",
 )
-""")
-cursor.execute("""
-CREATE TABLE IF NOT EXISTS diet_log (
-    user_id TEXT,
-    date TEXT,
-    count INTEGER DEFAULT 0,
-    PRIMARY KEY(user_id, date)
+
+_local = threading.local()
+_write_lock = threading.Lock()
+_all_conns: list[sqlite3.Connection] = []
+_all_conns_lock = threading.Lock()
+_cursor_factory = sqlite3.Cursor
+
+
+def _connect(readonly: bool) -> sqlite3.Connection:
+    conn = sqlite3.connect(DB_PATH, timeout=5, check_same_thread=False)
+    for pragma in PRAGMAS:
+        conn.execute(pragma)
+    if readonly:
+        conn.execute("PRAGMA query_only = 1")
+    with _all_conns_lock:
+        _all_conns.append(conn)
+    return conn
+
+
+def _get_conn(kind: str) -> sqlite3.Connection:
+    conn = getattr(_local, kind, None)
+    if conn is None:
+        conn = _connect(readonly=(kind == "reader"))
+        setattr(_local, kind, conn)
+    return conn
+
+
+@contextmanager
+def _writer():
+    """쓰기 트랜잭션용 커서. 블록이 끝나면 커밋, 예외 시 롤백합니다."""
+    with _write_lock:
+        conn = _get_conn("writer")
+        cur = conn.cursor(_cursor_factory)
+        try:
+            yield cur
+            conn.commit()
+        except BaseException:
+            conn.rollback()
+            raise
+        finally:
+            cur.close()
+
+
+@contextmanager
+def _reader():
+    """읽기 전용 커서. 쓰기 잠금을 잡지 않습니다."""
+    cur = _get_conn("reader").cursor(_cursor_factory)
+    try:
+        yield cur
+    finally:
+        cur.close()
+
+
+def set_cursor_factory(factory=None):
+    """_writer/_reader 가 만들 커서 클래스를 바꿉니다. (SQL 계측용, None 이면 기본 커서)"""
+    global _cursor_factory
+    _cursor_factory = factory or sqlite3.Cursor
+
+
+def close_all():
+    """열려 있는 모든 스레드의 연결을 닫습니다. (봇 종료/경로 변경 시)"""
+    with _all_conns_lock:
+        for conn in _all_conns:
+            try:
+                conn.close()
+            except sqlite3.ProgrammingError:
+                pass  # 다른 스레드에서 이미 닫힘
+        _all_conns.clear()
+    _local.__dict__.clear()
+
+
+# -----------------------------------------------------------------------------
+# 날짜 인코딩: exercise_log/diet_log 의 date, weekly_status 와 주간 롤업의 week_start, goals 의 start/end_date 는
+# 1970-01-01 부터의 일수(INTEGER, "에포크 일수")로 저장합니다. (스키마 버전 1 부터, 아래 '스키마 마이그레이션' 참고)
+# 공개 함수의 인자와 반환값은 그대로 'YYYY-MM-DD' 문자열이며 변환은 이 모듈 안에서만 합니다.
+# 1970-01-01 은 목요일이므로 월요일 = day - (day + 3) % 7 입니다.
+# -----------------------------------------------------------------------------
+_EPOCH_ORDINAL = date(1970, 1, 1).toordinal()
+
+def _day(d):
+    """'YYYY-MM-DD'(또는 그 뒤에 시각이 붙은 문자열)·date → 에포크 일수. None 은 None."""
+    if d is None:
+        return None
+    if isinstance(d, str):
+        d = date.fromisoformat(d[:10])
+    return d.toordinal() - _EPOCH_ORDINAL
+
+def _iso(day):
+    """에포크 일수 → 'YYYY-MM-DD'. None 은 None."""
+    return None if day is None else date.fromordinal(day + _EPOCH_ORDINAL).isoformat()
+
+def _monday(day):
+    return day - (day + 3) % 7
+
+
+def init_db(path: Optional[str] = None):
+    """스키마를 생성하고 밀린 마이그레이션을 적용합니다. path 를 주면 해당 파일로 DB 를 전환합니다. (벤치마크/테스트용)
+    아래 CREATE 문은 버전 0 스키마이며, 새 DB 도 MIGRATIONS 를 거쳐 최신 스키마가 됩니다."""
+    global DB_PATH, _local
+    if path is not None and path != DB_PATH:
+        close_all()
+        DB_PATH = path
+        _local = threading.local()
+    with _writer() as cursor:
+        version = _user_version(cursor)
+        # 사용자
+        cursor.execute("""
+        CREATE TABLE IF NOT EXISTS users (
+            user_id TEXT PRIMARY KEY,
+            nickname TEXT,
+            badge_weekly INTEGER DEFAULT 0,
+            badge_monthly INTEGER DEFAULT 0,
+            badge_bikini INTEGER DEFAULT 0
+        )
+        """)
+
+        # 목표(최대 3개, type: weight, freq_exercise, freq_diet, last_modified 추가)
+        cursor.execute("""
+        CREATE TABLE IF NOT EXISTS goals (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id TEXT,
+            type TEXT,
+            start_date TEXT,
+            end_date TEXT,
+            target_weight REAL,
+            current_weight REAL,
+            freq_per_week INTEGER,
+            last_modified TEXT,
+            active INTEGER DEFAULT 1,
+            UNIQUE(user_id, type)
+        )
+        """)
+
+        # 운동/식단 인증 로그
+        cursor.execute("""
+        CREATE TABLE IF NOT EXISTS exercise_log (
+            user_id TEXT,
+            date TEXT,
+            count INTEGER DEFAULT 0,
+            PRIMARY KEY(user_id, date)
+        )
+        """)
+        cursor.execute("""
+        CREATE TABLE IF NOT EXISTS diet_log (
+            user_id TEXT,
+            date TEXT,
+            count INTEGER DEFAULT 0,
+            PRIMARY KEY(user_id, date)
+        )
+        """)
+
+        # 주간/월간 상태
+        cursor.execute("""
+        CREATE TABLE IF NOT EXISTS weekly_status (
+            user_id TEXT,
+            week_start TEXT,
+            achieved_exercise INTEGER DEFAULT 0,
+            achieved_diet INTEGER DEFAULT 0,
+            weight_updated INTEGER DEFAULT 0,
+            achieved_weight INTEGER DEFAULT 0,
+            PRIMARY KEY(user_id, week_start)
+        )
+        """)
+        cursor.execute("""
+        CREATE TABLE IF NOT EXISTS monthly_trophy (
+            user_id TEXT,
+            year_month TEXT,
+            won_trophy INTEGER DEFAULT 0,
+            PRIMARY KEY(user_id, year_month)
+        )
+        """)
+
+        # 음성 채널 운동 인증: 열린 세션(재시작에도 유지)과 사용자·날짜별 누적 시간(분)
+        cursor.execute("""
+        CREATE TABLE IF NOT EXISTS voice_sessions (
+            user_id TEXT PRIMARY KEY,
+            channel_id INTEGER,
+            started_at TEXT
+        )
+        """)
+        cursor.execute("""
+        CREATE TABLE IF NOT EXISTS voice_minutes (
+            user_id TEXT,
+            date TEXT,
+            minutes REAL DEFAULT 0,
+            PRIMARY KEY(user_id, date)
+        )
+        """)
+
+        # 활동 이벤트 수집 기록: 같은 원천 이벤트(포럼 스레드, 음성 세션)는 한 번만 반영
+        cursor.execute("""
+        CREATE TABLE IF NOT EXISTS ingested_events (
+            source TEXT,
+            event_id TEXT,
+            user_id TEXT,
+            date TEXT,
+            ingested_at TEXT,
+            PRIMARY KEY(source, event_id)
+        ) WITHOUT ROWID
+        """)
+
+        # 봇 상태 key-value (last_seen: 마지막 생존 시각, forum_watermark: 마지막으로 처리한 포럼 스레드 ID)
+        cursor.execute("""
+        CREATE TABLE IF NOT EXISTS bot_state (
+            key TEXT PRIMARY KEY,
+            value TEXT
+        )
+        """)
+
+        # 정기 작업 워터마크 (job 별 마지막으로 끝낸 기간)
+        cursor.execute("""
+        CREATE TABLE IF NOT EXISTS job_runs (
+            job TEXT PRIMARY KEY,
+            last_period TEXT,
+            completed_at TEXT,
+            duration_ms INTEGER
+        )
+        """)
+
+        # 주간 누적 카운터 (랭킹용 롤업, 로그 증가 시 함께 갱신)
+        for table, log_table in (("exercise_weekly", "exercise_log"), ("diet_weekly", "diet_log")):
+            cursor.execute(f"""
+            CREATE TABLE IF NOT EXISTS {table} (
+                user_id TEXT,
+                week_start TEXT,
+                count INTEGER DEFAULT 0,
+                PRIMARY KEY(user_id, week_start)
+            )
+            """)
+            cursor.execute(f"CREATE INDEX IF NOT EXISTS idx_{table}_rank ON {table} (week_start, count DESC, user_id)")
+            # 롤업 도입 전 DB 라면 기존 로그로 한 번 채웁니다. (날짜가 문자열인 버전 0 스키마에서만)
+            cursor.execute(f"SELECT EXISTS(SELECT 1 FROM {table})")
+            if version == 0 and not cursor.fetchone()[0]:
+                cursor.execute(f"""
+                INSERT INTO {table} (user_id, week_start, count)
+                SELECT user_id, date(date, '-' || ((CAST(strftime('%w', date) AS INTEGER) + 6) % 7) || ' days') AS ws, SUM(count)
+                  FROM {log_table}
+                 GROUP BY user_id, ws
+                """)
+
+        # 체중 목표 진행 상태 (시작 체중, 진행률, 비키니 배지 지급 여부)
+        _ensure_columns(cursor, "goals", (
+            ("start_weight", "REAL"),
+            ("progress_pct", "INTEGER DEFAULT 0"),
+            ("achieved", "INTEGER DEFAULT 0"),
+        ))
+
+        # DM 채널 ID 캐시 (주간 DM 때 fetch_user/create_dm 호출을 건너뛰기 위함)
+        # 주간 체중 DM 예약 (시간대, 현지 요일/시각, 마지막으로 DM 을 받은 주) — 아래 '주간 체중 DM 예약' 참고
+        _ensure_columns(cursor, "users", (
+            ("dm_channel_id", "INTEGER"),
+            ("timezone", "TEXT"),
+            ("prompt_weekday", "INTEGER"),
+            ("prompt_minute", "INTEGER"),
+            ("last_prompted_week", "TEXT"),
+        ))
+
+        # DM 대화 진행 상태 (flow: weight_setup = 체중 목표 설정, weekly_weight = 주간 체중 입력)
+        cursor.execute("""
+        CREATE TABLE IF NOT EXISTS dm_context (
+            user_id TEXT,
+            flow TEXT,
+            data TEXT,
+            updated_at TEXT,
+            PRIMARY KEY(user_id, flow)
+        )
+        """)
+
+        # 활동 이벤트 저널 (추가만 함) 과 파생 집계 스냅샷 — 아래 '활동 이벤트 저널' 참고
+        cursor.execute("""
+        CREATE TABLE IF NOT EXISTS events (
+            seq INTEGER PRIMARY KEY,
+            kind TEXT NOT NULL,
+            user_id TEXT NOT NULL,
+            day TEXT NOT NULL,
+            data TEXT
+        )
+        """)
+        cursor.execute("""
+        CREATE TABLE IF NOT EXISTS snapshots (
+            last_seq INTEGER PRIMARY KEY,
+            as_of TEXT,
+            created_at TEXT,
+            state TEXT
+        )
+        """)
+    if AUTO_MIGRATE:
+        migrate()
+    with _writer() as cursor:
+        # 저널 시드는 최신 스키마에서만 (migrate.py 가 자동 적용을 끄고 옛 DB 를 열 때는 건너뜀)
+        cursor.execute("SELECT 1 FROM bot_state WHERE key = 'journal_seeded'")
+        if cursor.fetchone() is None and _user_version(cursor) == MIGRATIONS[-1][0]:
+            _seed_journal(cursor)
+            cursor.execute("INSERT INTO bot_state (key, value) VALUES ('journal_seeded', ?)", (datetime.now().isoformat(),))
+
+
+def _ensure_columns(cursor, table, columns):
+    """기존 DB 에 없는 컬럼만 ALTER TABLE 로 추가합니다."""
+    cursor.execute(f"PRAGMA table_info({table})")
+    existing = {row[1] for row in cursor.fetchall()}
+    for name, decl in columns:
+        if name not in existing:
+            cursor.execute(f"ALTER TABLE {table} ADD COLUMN {name} {decl}")
+
+
+def _seed_journal(cursor):
+    """저널 도입 전 DB 라면 기존 기록으로 저널과 시작 스냅샷을 한 번 채웁니다.
+    - 운동/식단 로그, 현재 목표(시작일 기준)를 날짜순 이벤트로 옮기고, 이미 지난 주/달에는 마감 표시를 넣습니다.
+      (삭제된 예전 목표와 체중 입력 이력은 남아 있지 않으므로 처음부터 재생하면 실제 배지와 다를 수 있습니다.)
+    - 시작 스냅샷은 지금의 배지·목표·열린 주 횟수를 그대로 담아, 이후 재생이 라이브 값과 맞도록 합니다."""
+    cursor.execute("SELECT MIN(date) FROM (SELECT MIN(date) AS date FROM exercise_log UNION ALL SELECT MIN(date) FROM diet_log)")
+    first_day = _iso(cursor.fetchone()[0])
+    cursor.execute("SELECT last_period FROM job_runs WHERE job = 'weekly_badges'")
+    row = cursor.fetchone()
+    today = date.today()
+    if row is not None:
+        open_from = date.fromisoformat(row[0]) + timedelta(days=7)
+    else:
+        open_from = today - timedelta(days=today.weekday() + 7)   # 정기 작업이 처음 실행할 주
+    cursor.execute("""
+        CREATE TEMP TABLE seed (sort_day TEXT, ord INTEGER, kind TEXT, user_id TEXT, day TEXT, data TEXT)
+    """)
+    cursor.execute("""
+        INSERT INTO seed
+        SELECT COALESCE(date(start_date + 2440587.5), ''), 0, 'goal', user_id, COALESCE(date(start_date + 2440587.5), ''),
+               CASE WHEN type = 'weight'
+                    THEN json_object('type', type, 'reached', json(CASE WHEN current_weight <= target_weight THEN 'true' ELSE 'false' END))
+                    ELSE json_object('type', type, 'per_week', freq_per_week) END
+          FROM goals WHERE active = 1
+    """)
+    for kind, table in (("exercise", "exercise_log"), ("diet", "diet_log")):
+        cursor.execute(f"""
+            INSERT INTO seed
+            SELECT date(date + 2440587.5), 1, ?, user_id, date(date + 2440587.5),
+                   CASE WHEN count != 1 THEN json_object('n', count) END
+              FROM {table} WHERE count > 0
+        """, (kind,))
+    # 마감 표시: 주는 다음 월요일 맨 앞에, 달은 마지막 월요일 주의 마감 바로 뒤에
+    if first_day is not None:
+        markers = []
+        week = date.fromisoformat(first_day)
+        week -= timedelta(days=week.weekday())
+        while week < open_from:
+            closed = week + timedelta(days=7)
+            markers.append((closed.isoformat(), -2, "week_closed", week.isoformat()))
+            if closed.month != week.month:
+                markers.append((closed.isoformat(), -1, "month_closed", week.strftime("%Y-%m")))
+            week = closed
+        cursor.executemany("INSERT INTO seed VALUES (?, ?, ?, '', ?, NULL)", markers)
+    cursor.execute("""
+        INSERT INTO events (kind, user_id, day, data)
+        SELECT kind, user_id, day, data FROM seed ORDER BY sort_day, ord, user_id
+    """)
+    cursor.execute("DROP TABLE temp.seed")
+    cursor.execute("SELECT MAX(seq) FROM events")
+    last_seq = cursor.fetchone()[0]
+    if last_seq is not None:
+        _save_snapshot(cursor, last_seq, today.isoformat(), _live_state(cursor, open_from))
+
+def _live_state(cursor, open_from):
+    """라이브 테이블로 만든 스냅샷 상태. (형식은 replay.Replay.state() 참고)"""
+    users = {}
+    def user(uid):
+        if uid not in users:
+            users[uid] = {"badges": {}, "goals": {}, "weight_achieved": False, "weeks": {}, "achieved": []}
+        return users[uid]
+    cursor.execute("SELECT user_id, badge_weekly, badge_monthly, badge_bikini FROM users")
+    for uid, weekly, monthly, bikini in cursor.fetchall():
+        user(uid)["badges"] = {"weekly": weekly or 0, "monthly": monthly or 0, "bikini": bikini or 0}
+    cursor.execute("SELECT user_id, type, freq_per_week, COALESCE(achieved, 0) FROM goals WHERE active = 1")
+    for uid, gtype, per_week, achieved in cursor.fetchall():
+        u = user(uid)
+        u["goals"][gtype] = per_week or 0
+        if gtype == "weight":
+            u["weight_achieved"] = bool(achieved)
+    for i, table in enumerate(("exercise_weekly", "diet_weekly")):
+        cursor.execute(f"SELECT user_id, week_start, count FROM {table} WHERE week_start >= ?", (_day(open_from),))
+        for uid, week, count in cursor.fetchall():
+            user(uid)["weeks"].setdefault(_iso(week), [0, 0])[i] = count
+    # 월간 트로피 판정에 필요한 최근 달성 주
+    since = (open_from.replace(day=1) - timedelta(days=1)).replace(day=1)
+    cursor.execute("""
+        SELECT user_id, week_start FROM weekly_status
+         WHERE week_start >= ? AND achieved_exercise != 0 AND achieved_diet != 0
+    """, (_day(since),))
+    for uid, week in cursor.fetchall():
+        user(uid)["achieved"].append(_iso(week))
+    return {"last_closed": (open_from - timedelta(days=7)).isoformat(), "users": users}
+
+# -----------------------------------------------------------------------------
+# 활동 이벤트 저널: 운동/식단 인증, 목표 설정·삭제, 체중 입력, 주/달 마감을 발생 순서(seq)대로 추가만 합니다.
+#   kind        user_id  day            data
+#   exercise    사용자   인정된 날짜     {"n": 횟수} (1 이면 NULL)
+#   diet        사용자   인증 날짜       {"n": 횟수} (1 이면 NULL)
+#   goal        사용자   시작일          {"type", "per_week"} / 체중: {"type": "weight", "reached"}
+#   goal_end    사용자   삭제한 날짜     {"type"}
+#   weight      사용자   입력한 날짜     {"reached": 목표 체중 이하 여부}  ※ 체중 값 자체는 남기지 않습니다.
+#   week_closed ''       주 월요일       주간 배지 정산 시점
+#   month_closed ''      'YYYY-MM'       월간 트로피 정산 시점
+# 배지·주간 횟수·랭킹은 이 저널을 재생해 다시 만들 수 있습니다. (replay.py)
+# 스냅샷은 seq 까지 재생한 집계 상태(JSON)이며, 재생은 가장 최근 스냅샷 + 그 뒤 이벤트로 끝납니다.
+# -----------------------------------------------------------------------------
+SNAPSHOT_KEEP = 8
+
+def _journal(cursor, kind, user_id, day=None, data=None):
+    cursor.execute("INSERT INTO events (kind, user_id, day, data) VALUES (?, ?, ?, ?)",
+                   (kind, user_id, day or datetime.now().strftime("%Y-%m-%d"),
+                    json.dumps(data, separators=(",", ":")) if data else None))
+
+def _save_snapshot(cursor, last_seq, as_of, state):
+    cursor.execute("""
+        INSERT OR REPLACE INTO snapshots (last_seq, as_of, created_at, state) VALUES (?, ?, ?, ?)
+    """, (last_seq, as_of, datetime.now().isoformat(), json.dumps(state, separators=(",", ":"))))
+    # 오래된 스냅샷은 최근 SNAPSHOT_KEEP 개만 남김 (저널은 지우지 않으므로 언제든 처음부터 재생 가능)
+    cursor.execute("""
+        DELETE FROM snapshots WHERE last_seq NOT IN (SELECT last_seq FROM snapshots ORDER BY last_seq DESC LIMIT ?)
+    """, (SNAPSHOT_KEEP,))
+
+def save_snapshot(last_seq, as_of, state):
+    with _writer() as cursor:
+        _save_snapshot(cursor, last_seq, as_of, state)
+
+def get_latest_snapshot(max_seq=None):
+    """max_seq 이하의 가장 최근 스냅샷 (last_seq, as_of, state). 없으면 None."""
+    with _reader() as cursor:
+        cursor.execute("""
+            SELECT last_seq, as_of, state FROM snapshots WHERE last_seq <= COALESCE(?, last_seq)
+             ORDER BY last_seq DESC LIMIT 1
+        """, (max_seq,))
+        row = cursor.fetchone()
+    return (row[0], row[1], json.loads(row[2])) if row else None
+
+def get_journal_head():
+    """마지막 이벤트의 seq. (저널이 비어 있으면 0)"""
+    _flush_pending()
+    with _reader() as cursor:
+        cursor.execute("SELECT COALESCE(MAX(seq), 0) FROM events")
+        return cursor.fetchone()[0]
+
+def iter_events(after_seq=0, until_seq=None, batch=10000):
+    """after_seq 초과 until_seq 이하의 이벤트 (seq, kind, user_id, day, data) 를 seq 순으로 돌려줍니다.
+    batch 개씩 나눠 읽으므로 저널이 커도 메모리를 많이 쓰지 않습니다."""
+    while True:
+        with _reader() as cursor:
+            cursor.execute("""
+                SELECT seq, kind, user_id, day, data FROM events
+                 WHERE seq > ? AND seq <= COALESCE(?, seq) ORDER BY seq LIMIT ?
+            """, (after_seq, until_seq, batch))
+            rows = cursor.fetchall()
+        yield from rows
+        if len(rows) < batch:
+            return
+        after_seq = rows[-1][0]
+
+# -----------------------------------------------------------------------------
+# 스키마 마이그레이션: 버전은 PRAGMA user_version 에 두고, init_db 가 밀린 MIGRATIONS 를 순서대로 적용합니다.
+# 테이블을 새 스키마로 옮길 때는 봇을 멈추지 않도록
+#   1) 새 테이블과, 옛 테이블의 INSERT/UPDATE/DELETE 를 새 테이블에 그대로 옮겨 적는 트리거를 만들고
+#   2) 옛 행을 rowid 순으로 batch 개씩 복사합니다. 배치마다 커밋해 쓰기 잠금을 놓아 주므로 그 사이 봇의 쓰기가
+#      끼어들 수 있고, 진행 위치를 bot_state('migrate:버전:테이블')에 남겨 중간에 멈춰도 이어서 복사합니다.
+#   3) 마지막으로 한 트랜잭션 안에서 트리거와 옛 테이블을 지우고, 새 테이블 이름을 바꾸고, 인덱스를 만들고, 버전을 올립니다.
+# 큰 DB 는 기존 봇을 띄워 둔 채 `python migrate.py --prepare` 로 1)~2) 를 먼저 끝내 두면 (그 뒤 변경은 트리거가 따라감)
+# 새 버전으로 재시작할 때 init_db 는 3) 만 하므로 멈춤은 재시작 시간 정도입니다.
+# -----------------------------------------------------------------------------
+AUTO_MIGRATE = os.getenv("TRAINER_AUTO_MIGRATE", "1") != "0"   # migrate.py 가 복사만 따로 할 때 끔
+MIGRATION_BATCH = 5000
+
+def _days_sql(column):
+    """옛 행의 'YYYY-MM-DD' 컬럼을 에포크 일수로 바꾸는 SQL 식. ({r} 은 NEW/OLD/테이블 이름)"""
+    return f"CAST(julianday({{r}}.{column}) - 2440587.5 AS INTEGER)"
+
+
+class _Rebuild:
+    """테이블 하나를 새 스키마로 옮기는 방법. (옛 테이블은 rowid 테이블이어야 함)
+    ddl: {name} 자리에 새 테이블 이름이 들어가는 CREATE 문
+    columns: 새 컬럼 → 옛 행({r})에서 값을 만드는 SQL 식
+    key: 새 테이블에서 행 하나를 찾는 컬럼들, indexes: 교체 후 만들 인덱스"""
+
+    def __init__(self, table, ddl, columns, key, indexes=()):
+        self.table = table
+        self.ddl = ddl
+        self.columns = {col: expr or f"{{r}}.{col}" for col, expr in columns.items()}
+        self.key = key
+        self.indexes = indexes
+
+    def values(self, r):
+        return ", ".join(expr.format(r=r) for expr in self.columns.values())
+
+    def match(self, r):
+        return " AND ".join(f"{col} = {self.columns[col].format(r=r)}" for col in self.key)
+
+
+def _log_rebuild(table):
+    return _Rebuild(table, """
+        CREATE TABLE IF NOT EXISTS {name} (
+            user_id TEXT,
+            date INTEGER,
+            count INTEGER DEFAULT 0,
+            PRIMARY KEY(user_id, date)
+        ) WITHOUT ROWID
+    """, {"user_id": None, "date": _days_sql("date"), "count": None}, ("user_id", "date"),
+        # 날짜 구간 집계(주간 배지, 임의 구간 랭킹)는 인덱스만 읽고 끝남
+        (f"CREATE INDEX IF NOT EXISTS idx_{table}_date ON {table} (date, user_id, count)",))
+
+def _rollup_rebuild(table):
+    return _Rebuild(table, """
+        CREATE TABLE IF NOT EXISTS {name} (
+            user_id TEXT,
+            week_start INTEGER,
+            count INTEGER DEFAULT 0,
+            PRIMARY KEY(user_id, week_start)
+        ) WITHOUT ROWID
+    """, {"user_id": None, "week_start": _days_sql("week_start"), "count": None}, ("user_id", "week_start"),
+        (f"CREATE INDEX IF NOT EXISTS idx_{table}_rank ON {table} (week_start, count DESC, user_id)",))
+
+_EPOCH_DAY_REBUILDS = (
+    _log_rebuild("exercise_log"),
+    _log_rebuild("diet_log"),
+    _rollup_rebuild("exercise_weekly"),
+    _rollup_rebuild("diet_weekly"),
+    _Rebuild("weekly_status", """
+        CREATE TABLE IF NOT EXISTS {name} (
+            user_id TEXT,
+            week_start INTEGER,
+            achieved_exercise INTEGER DEFAULT 0,
+            achieved_diet INTEGER DEFAULT 0,
+            weight_updated INTEGER DEFAULT 0,
+            achieved_weight INTEGER DEFAULT 0,
+            PRIMARY KEY(user_id, week_start)
+        ) WITHOUT ROWID
+    """, {"user_id": None, "week_start": _days_sql("week_start"), "achieved_exercise": None,
+          "achieved_diet": None, "weight_updated": None, "achieved_weight": None}, ("user_id", "week_start"),
+        # 월간 트로피: 주 구간 + 달성 여부만 인덱스에서 읽음
+        ("CREATE INDEX IF NOT EXISTS idx_weekly_status_week"
+         " ON weekly_status (week_start, user_id, achieved_exercise, achieved_diet)",)),
+    _Rebuild("goals", """
+        CREATE TABLE IF NOT EXISTS {name} (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id TEXT,
+            type TEXT,
+            start_date INTEGER,
+            end_date INTEGER,
+            target_weight REAL,
+            current_weight REAL,
+            freq_per_week INTEGER,
+            last_modified TEXT,
+            active INTEGER DEFAULT 1,
+            start_weight REAL,
+            progress_pct INTEGER DEFAULT 0,
+            achieved INTEGER DEFAULT 0,
+            UNIQUE(user_id, type)
+        )
+    """, {"id": None, "user_id": None, "type": None, "start_date": _days_sql("start_date"),
+          "end_date": _days_sql("end_date"), "target_weight": None, "current_weight": None, "freq_per_week": None,
+          "last_modified": None, "active": None, "start_weight": None, "progress_pct": None, "achieved": None},
+        ("id",),
+        ("CREATE INDEX IF NOT EXISTS idx_goals_user_active ON goals (user_id, active, type)",)),
 )
-""")
-
-# 주간/월간 상태
-cursor.execute("""
-CREATE TABLE IF NOT EXISTS weekly_status (
-    user_id TEXT,
-    week_start TEXT,
-    achieved_exercise INTEGER DEFAULT 0,
-    achieved_diet INTEGER DEFAULT 0,
-    weight_updated INTEGER DEFAULT 0,
-    achieved_weight INTEGER DEFAULT 0,
-    PRIMARY KEY(user_id, week_start)
+
+# 버전 2: 목표 변경 이력. UNIQUE(user_id, type) 를 없애고 지난 목표는 active = 0 인 행(version, ended_at)으로 남깁니다.
+# 활성 목표의 유일성은 부분 인덱스(active = 1 인 행만)로 보장하고, 활성 목표 조회는 이 인덱스 하나로 끝납니다.
+_GOAL_HISTORY_REBUILDS = (
+    _Rebuild("goals", """
+        CREATE TABLE IF NOT EXISTS {name} (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id TEXT,
+            type TEXT,
+            start_date INTEGER,
+            end_date INTEGER,
+            target_weight REAL,
+            current_weight REAL,
+            freq_per_week INTEGER,
+            last_modified TEXT,
+            active INTEGER DEFAULT 1,
+            start_weight REAL,
+            progress_pct INTEGER DEFAULT 0,
+            achieved INTEGER DEFAULT 0,
+            version INTEGER DEFAULT 1,
+            ended_at TEXT
+        )
+    """, {"id": None, "user_id": None, "type": None, "start_date": None, "end_date": None, "target_weight": None,
+          "current_weight": None, "freq_per_week": None, "last_modified": None, "active": None, "start_weight": None,
+          "progress_pct": None, "achieved": None, "version": "1",
+          # 버전 0 의 delete_goal 은 active 만 내렸으므로 이미 끝난 목표는 마지막 수정 시각을 종료 시각으로
+          "ended_at": "CASE WHEN {r}.active = 1 THEN NULL ELSE {r}.last_modified END"},
+        ("id",),
+        ("CREATE UNIQUE INDEX IF NOT EXISTS idx_goals_active ON goals (user_id, type) WHERE active = 1",
+         # 사용자별 목표(활성 → 이력 순) 조회와 다음 버전 번호 계산
+         "CREATE INDEX IF NOT EXISTS idx_goals_user ON goals (user_id, active, type, version)")),
 )
-""")
-cursor.execute("""
-CREATE TABLE IF NOT EXISTS monthly_trophy (
-    user_id TEXT,
-    year_month TEXT,
-    won_trophy INTEGER DEFAULT 0,
-    PRIMARY KEY(user_id, year_month)
+
+# 버전 3: 사용자별 연속 기록·개인 기록(user_records). 로그가 늘 때 행 하나만 고치고(_bump_record),
+# 기존 로그는 교체 트랜잭션 안에서 윈도 함수로 한 번에 채웁니다. (_backfill_records)
+#   kind: 'exercise' | 'diet', last_day: 마지막 인증일(에포크 일수), current_streak: last_day 에서 끝나는 연속 일수
+#   best_week/best_week_start: 가장 많이 인증한 주의 횟수와 그 월요일 (동점이면 먼저 달성한 주), total: 누적 횟수
+_RECORD_TABLES = {"exercise": ("exercise_log", "exercise_weekly"), "diet": ("diet_log", "diet_weekly")}
+
+def _backfill_records(cursor, user_id=None, kinds=("exercise", "diet")):
+    """로그에서 user_records 를 다시 계산합니다. user_id 가 없으면 전체.
+    연속 구간은 date - ROW_NUMBER() 가 같은 날짜끼리 묶고(gaps and islands), 가장 최근 구간이 현재 연속 기록입니다."""
+    only = "AND user_id = ?" if user_id is not None else ""
+    for kind in kinds:
+        log_table, weekly_table = _RECORD_TABLES[kind]
+        cursor.execute(f"""
+            INSERT OR REPLACE INTO user_records
+                   (user_id, kind, current_streak, longest_streak, last_day, best_week, best_week_start, total)
+            WITH days AS (
+                SELECT user_id, date, count,
+                       date - ROW_NUMBER() OVER (PARTITION BY user_id ORDER BY date) AS run
+                  FROM {log_table} WHERE count > 0 {only}
+            ), runs AS (
+                SELECT user_id, COUNT(*) AS len, MAX(date) AS last, SUM(count) AS total
+                  FROM days GROUP BY user_id, run
+            ), ranked AS (
+                SELECT user_id, len, last,
+                       MAX(len) OVER u AS longest, SUM(total) OVER u AS total,
+                       ROW_NUMBER() OVER (PARTITION BY user_id ORDER BY last DESC) AS recent
+                  FROM runs WINDOW u AS (PARTITION BY user_id)
+            ), weeks AS (
+                SELECT user_id, week_start, count,
+                       ROW_NUMBER() OVER (PARTITION BY user_id ORDER BY count DESC, week_start) AS rank
+                  FROM {weekly_table} WHERE count > 0 {only}
+            )
+            SELECT r.user_id, ?, r.len, r.longest, r.last, COALESCE(w.count, 0), w.week_start, r.total
+              FROM ranked r LEFT JOIN weeks w ON w.user_id = r.user_id AND w.rank = 1
+             WHERE r.recent = 1
+        """, ((user_id, user_id) if user_id is not None else ()) + (kind,))
+
+def _create_user_records(cursor):
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS user_records (
+            user_id TEXT,
+            kind TEXT,
+            current_streak INTEGER DEFAULT 0,
+            longest_streak INTEGER DEFAULT 0,
+            last_day INTEGER,
+            best_week INTEGER DEFAULT 0,
+            best_week_start INTEGER,
+            total INTEGER DEFAULT 0,
+            PRIMARY KEY(user_id, kind)
+        ) WITHOUT ROWID
+    """)
+    _backfill_records(cursor)
+
+# (버전, 설명, 옮길 테이블, 교체 트랜잭션 안에서 마지막으로 실행할 함수)
+MIGRATIONS = (
+    (1, "날짜 컬럼을 에포크 일수(INTEGER)로, 날짜·활성 목표 인덱스", _EPOCH_DAY_REBUILDS, None),
+    (2, "목표 변경 이력 (활성 목표 부분 유니크 인덱스)", _GOAL_HISTORY_REBUILDS, None),
+    (3, "연속 기록·개인 기록 테이블 (기존 로그로 채움)", (), _create_user_records),
 )
-""")
-conn.commit()
 
-def _register_user(user_id: str, nickname: str):
+def _user_version(cursor):
+    cursor.execute("PRAGMA user_version")
+    return cursor.fetchone()[0]
+
+def _prepare_rebuild(cursor, version, rb):
+    new = f"{rb.table}__v{version}"
+    cols = ", ".join(rb.columns)
+    cursor.execute(rb.ddl.format(name=new))
+    cursor.execute(f"""
+        CREATE TRIGGER IF NOT EXISTS {new}_ins AFTER INSERT ON {rb.table} BEGIN
+            INSERT OR REPLACE INTO {new} ({cols}) VALUES ({rb.values("NEW")});
+        END""")
+    cursor.execute(f"""
+        CREATE TRIGGER IF NOT EXISTS {new}_upd AFTER UPDATE ON {rb.table} BEGIN
+            DELETE FROM {new} WHERE {rb.match("OLD")};
+            INSERT OR REPLACE INTO {new} ({cols}) VALUES ({rb.values("NEW")});
+        END""")
+    cursor.execute(f"""
+        CREATE TRIGGER IF NOT EXISTS {new}_del AFTER DELETE ON {rb.table} BEGIN
+            DELETE FROM {new} WHERE {rb.match("OLD")};
+        END""")
+
+def _copy_batch(cursor, version, rb, limit):
+    """아직 복사하지 않은 옛 행을 rowid 순으로 limit 개까지 복사하고 복사한 행 수를 반환합니다.
+    트리거가 이미 옮겨 적은 행(복사 전에 바뀐 행)은 그쪽이 최신이므로 건너뜁니다."""
+    key = f"migrate:{version}:{rb.table}"
+    cursor.execute("SELECT value FROM bot_state WHERE key = ?", (key,))
+    row = cursor.fetchone()
+    after = int(row[0]) if row else 0
+    cursor.execute(f"SELECT COUNT(*), MAX(rowid) FROM (SELECT rowid FROM {rb.table} WHERE rowid > ? ORDER BY rowid LIMIT ?)",
+                   (after, limit))
+    n, last = cursor.fetchone()
+    if not n:
+        return 0
+    cursor.execute(f"""
+        INSERT OR IGNORE INTO {rb.table}__v{version} ({", ".join(rb.columns)})
+        SELECT {rb.values(rb.table)} FROM {rb.table} WHERE rowid > ? AND rowid <= ?
+    """, (after, last))
+    cursor.execute("INSERT OR REPLACE INTO bot_state (key, value) VALUES (?, ?)", (key, str(last)))
+    return n
+
+def _swap_rebuild(cursor, version, rb):
+    new = f"{rb.table}__v{version}"
+    while _copy_batch(cursor, version, rb, MIGRATION_BATCH):
+        pass    # 준비 뒤에 남은 행 (보통 없음)
+    for suffix in ("ins", "upd", "del"):
+        cursor.execute(f"DROP TRIGGER IF EXISTS {new}_{suffix}")
+    cursor.execute(f"DROP TABLE {rb.table}")
+    cursor.execute(f"ALTER TABLE {new} RENAME TO {rb.table}")
+    for ddl in rb.indexes:
+        cursor.execute(ddl)
+    cursor.execute("DELETE FROM bot_state WHERE key = ?", (f"migrate:{version}:{rb.table}",))
+
+def schema_version():
+    with _reader() as cursor:
+        return _user_version(cursor)
+
+def pending_migrations():
+    """아직 적용하지 않은 [(버전, 설명, 옮길 테이블별 남은 복사 행 수 dict)]."""
+    out = []
+    with _reader() as cursor:
+        current = _user_version(cursor)
+        for version, title, rebuilds, _ in MIGRATIONS:
+            if version <= current:
+                continue
+            remaining = {}
+            for rb in rebuilds:
+                cursor.execute("SELECT value FROM bot_state WHERE key = ?", (f"migrate:{version}:{rb.table}",))
+                row = cursor.fetchone()
+                cursor.execute(f"SELECT COUNT(*) FROM {rb.table} WHERE rowid > ?", (int(row[0]) if row else 0,))
+                remaining[rb.table] = cursor.fetchone()[0]
+            out.append((version, title, remaining))
+    return out
+
+def migrate(batch=MIGRATION_BATCH, pause=0.0, prepare_only=False, progress=None):
+    """밀린 마이그레이션을 적용하고 적용한 버전 목록을 반환합니다.
+    pause: 배치 사이에 쉬는 초 (운영 중인 DB 의 쓰기 여유), progress(version, table, n): 배치마다 호출
+    prepare_only 면 다음 버전 하나의 새 테이블·트리거·복사까지만 하고 교체는 하지 않습니다."""
+    applied = []
+    for version, title, rebuilds, finish in MIGRATIONS:
+        with _writer() as cursor:
+            if _user_version(cursor) >= version:
+                continue
+            cursor.execute("BEGIN IMMEDIATE")   # DDL 도 한 트랜잭션으로 (sqlite3 모듈은 DDL 앞에서 트랜잭션을 열지 않음)
+            for rb in rebuilds:
+                _prepare_rebuild(cursor, version, rb)
+        for rb in rebuilds:
+            while True:
+                with _writer() as cursor:
+                    n = _copy_batch(cursor, version, rb, batch)
+                if not n:
+                    break
+                if progress is not None:
+                    progress(version, rb.table, n)
+                if pause:
+                    time.sleep(pause)
+        if prepare_only:
+            break
+        with _writer() as cursor:
+            cursor.execute("BEGIN IMMEDIATE")
+            for rb in rebuilds:
+                _swap_rebuild(cursor, version, rb)
+            if finish is not None:
+                finish(cursor)
+            cursor.execute(f"PRAGMA user_version = {version}")
+        applied.append(version)
+    return applied
+
+
+init_db()
+
+def _register_user(cursor, user_id: str, nickname: str):
     cursor.execute("SELECT 1 FROM users WHERE user_id = ?", (user_id,))
     if cursor.fetchone() is None:
         cursor.execute("INSERT INTO users (user_id, nickname) VALUES (?, ?)", (user_id, nickname))
-        conn.commit()
 
-def set_weight_goal(user_id, nickname, start_date, end_date, target_weight, current_weight):
-    _register_user(user_id, nickname)
-    cursor.execute("UPDATE goals SET active = 0 WHERE user_id = ? AND type = 'weight'", (user_id,))
-    now = datetime.now().isoformat()
-    cursor.execute("""
-    INSERT INTO goals (user_id, type, start_date, end_date, target_weight, current_weight, freq_per_week, last_modified)
-    VALUES (?, 'weight', ?, ?, ?, ?, NULL, ?)""", (user_id, start_date, end_date, target_weight, current_weight, now))
-    conn.commit()
-
-def set_freq_goal(user_id, nickname, goal_type, freq_per_week):
-    _register_user(user_id, nickname)
-    cursor.execute("UPDATE goals SET active = 0 WHERE user_id = ? AND type = ?", (user_id, goal_type))
-    today = datetime.now().strftime("%Y-%m-%d")
-    now = datetime.now().isoformat()
+def _retire_goal(cursor, user_id, goal_type):
+    # 지난 목표는 지우지 않고 비활성 버전으로 남깁니다. (활성 목표는 부분 유니크 인덱스로 (user_id, type) 당 하나)
     cursor.execute("""
-    INSERT INTO goals (user_id, type, start_date, end_date, target_weight, current_weight, freq_per_week, last_modified)
-    VALUES (?, ?, ?, NULL, NULL, NULL, ?, ?)""", (user_id, goal_type, today, freq_per_week, now))
-    conn.commit()
+        UPDATE goals SET active = 0, ended_at = ? WHERE user_id = ? AND type = ? AND active = 1
+    """, (datetime.now().isoformat(), user_id, goal_type))
+
+def _next_goal_version(cursor, user_id, goal_type):
+    cursor.execute("SELECT COALESCE(MAX(version), 0) + 1 FROM goals WHERE user_id = ? AND type = ?", (user_id, goal_type))
+    return cursor.fetchone()[0]
+
+def set_weight_goal(user_id, nickname, start_date, end_date, target_weight, current_weight, start_weight=None):
+    _flush_pending(user_id)
+    with _writer() as cursor:
+        _register_user(cursor, user_id, nickname)
+        _retire_goal(cursor, user_id, "weight")
+        now = datetime.now().isoformat()
+        cursor.execute("""
+        INSERT INTO goals (user_id, type, start_date, end_date, target_weight, current_weight, freq_per_week, last_modified, start_weight,
+                           version)
+        VALUES (?, 'weight', ?, ?, ?, ?, NULL, ?, ?, ?)""", (user_id, _day(start_date), _day(end_date), target_weight, current_weight, now,
+                                                            current_weight if start_weight is None else start_weight,
+                                                            _next_goal_version(cursor, user_id, "weight")))
+        _journal(cursor, "goal", user_id, start_date,
+                 {"type": "weight", "reached": current_weight is not None and current_weight <= target_weight})
+
+def set_freq_goal(user_id, nickname, goal_type, freq_per_week, start_date=None):
+    _flush_pending(user_id)
+    with _writer() as cursor:
+        _register_user(cursor, user_id, nickname)
+        _retire_goal(cursor, user_id, goal_type)
+        today = start_date or datetime.now().strftime("%Y-%m-%d")
+        now = datetime.now().isoformat()
+        cursor.execute("""
+        INSERT INTO goals (user_id, type, start_date, end_date, target_weight, current_weight, freq_per_week, last_modified, version)
+        VALUES (?, ?, ?, NULL, NULL, NULL, ?, ?, ?)""", (user_id, goal_type, _day(today), freq_per_week, now,
+                                                         _next_goal_version(cursor, user_id, goal_type)))
+        _journal(cursor, "goal", user_id, today, {"type": goal_type, "per_week": freq_per_week})
 
 def delete_goal(user_id, goal_type):
-    cursor.execute("UPDATE goals SET active = 0 WHERE user_id = ? AND type = ?", (user_id, goal_type))
-    conn.commit()
+    _flush_pending(user_id)
+    with _writer() as cursor:
+        _retire_goal(cursor, user_id, goal_type)
+        _journal(cursor, "goal_end", user_id, data={"type": goal_type})
 
 def get_active_goals(user_id):
-    cursor.execute("""
-    SELECT type, start_date, end_date, target_weight, current_weight, freq_per_week, last_modified
-      FROM goals WHERE user_id = ? AND active = 1
-    """, (user_id,))
-    return cursor.fetchall()
+    _flush_pending(user_id)
+    with _reader() as cursor:
+        cursor.execute("""
+        SELECT type, start_date, end_date, target_weight, current_weight, freq_per_week, last_modified
+          FROM goals WHERE user_id = ? AND active = 1
+        """, (user_id,))
+        rows = cursor.fetchall()
+    return [(gtype, _iso(start), _iso(end), *rest) for gtype, start, end, *rest in rows]
+
+def get_goal_history(user_id, goal_type=None):
+    """사용자의 목표 버전 전부 (지난 목표 포함, 종류·버전 순).
+    (type, version, start_date, end_date, target_weight, current_weight, freq_per_week, start_weight, achieved,
+     last_modified, ended_at) — ended_at 이 None 이면 지금 활성인 목표입니다."""
+    _flush_pending(user_id)
+    with _reader() as cursor:
+        cursor.execute("""
+        SELECT type, version, start_date, end_date, target_weight, current_weight, freq_per_week, start_weight,
+               COALESCE(achieved, 0), last_modified, ended_at
+          FROM goals WHERE user_id = ? AND type = COALESCE(?, type)
+         ORDER BY type, version
+        """, (user_id, goal_type))
+        rows = cursor.fetchall()
+    return [(gtype, version, _iso(start), _iso(end), *rest) for gtype, version, start, end, *rest in rows]
 
 def get_goal_last_modified(user_id, goal_type):
-    cursor.execute("""
-    SELECT last_modified FROM goals WHERE user_id = ? AND type = ? AND active = 1
-    """, (user_id, goal_type))
-    row = cursor.fetchone()
+    _flush_pending(user_id)
+    with _reader() as cursor:
+        cursor.execute("""
+        SELECT last_modified FROM goals WHERE user_id = ? AND type = ? AND active = 1
+        """, (user_id, goal_type))
+        row = cursor.fetchone()
     return row[0] if row else None
 
 def update_current_weight(user_id, new_weight):
+    now = datetime.now().isoformat()
+    if _write_buffer is not None:
+        _write_buffer.add_weight(user_id, new_weight, now)
+        return
+    with _writer() as cursor:
+        _apply_weight(cursor, user_id, new_weight, now)
+
+def _apply_weight(cursor, user_id, new_weight, modified_at):
     cursor.execute("""
         UPDATE goals SET current_weight = ?, last_modified = ?
         WHERE user_id = ? AND type = 'weight' AND active = 1
-    """, (new_weight, datetime.now().isoformat(), user_id))
-    conn.commit()
+        RETURNING target_weight
+    """, (new_weight, modified_at, user_id))
+    row = cursor.fetchone()
+    if row is not None:
+        _journal(cursor, "weight", user_id, modified_at[:10],
+                 {"reached": row[0] is not None and new_weight <= row[0]})
 
-    def increment_exercise_log(user_id, when_date=None):
-        if when_date is None:
-            when_date = datetime.now().strftime("%Y-%m-%d")
-        cursor.execute("SELECT count FROM exercise_log WHERE user_id = ? AND date = ?", (user_id, when_date))
-        row = cursor.fetchone()
-        if row:
-            if row[0] >= 1:     # ★ 하루 1회만 인정 (포럼+음성 중복 불가)
-                return row[0]
-            new_cnt = row[0] + 1
-            cursor.execute("UPDATE exercise_log SET count = ? WHERE user_id = ? AND date = ?", (new_cnt, user_id, when_date))
-        else:
-            new_cnt = 1
-            cursor.execute("INSERT INTO exercise_log (user_id, date, count) VALUES (?, ?, 1)", (user_id, when_date))
-        conn.commit()
-        return new_cnt
+def _bump_weekly(cursor, table, user_id, day, amount=1):
+    """주간 롤업을 올리고 그 주의 새 횟수를 반환합니다."""
+    cursor.execute(f"""
+        INSERT INTO {table} (user_id, week_start, count) VALUES (?, ?, ?)
+        ON CONFLICT(user_id, week_start) DO UPDATE SET count = count + excluded.count
+        RETURNING count
+    """, (user_id, _monday(day), amount))
+    return cursor.fetchone()[0]
 
-def increment_diet_log(user_id, when_date=None):
-    if when_date is None:
-        when_date = datetime.now().strftime("%Y-%m-%d")
-    cursor.execute("SELECT count FROM diet_log WHERE user_id = ? AND date = ?", (user_id, when_date))
+def _bump_record(cursor, user_id, kind, day, amount, week_count):
+    """user_records 한 행을 고칩니다. day 가 마지막 인증일 다음 날이면 연속 +1, 더 뒤면 1부터 다시.
+    마지막 인증일보다 앞선 날짜(자정 넘긴 음성 세션의 지난 날짜 등)는 연속 구간이 바뀔 수 있어 그 사용자만 다시 계산합니다."""
+    cursor.execute("""
+        SELECT current_streak, longest_streak, last_day, best_week, best_week_start
+          FROM user_records WHERE user_id = ? AND kind = ?
+    """, (user_id, kind))
+    row = cursor.fetchone()
+    if row is None:
+        cursor.execute("""
+            INSERT INTO user_records (user_id, kind, current_streak, longest_streak, last_day, best_week, best_week_start, total)
+            VALUES (?, ?, 1, 1, ?, ?, ?, ?)
+        """, (user_id, kind, day, week_count, _monday(day), amount))
+        return
+    streak, longest, last_day, best_week, best_week_start = row
+    if day < last_day:
+        _backfill_records(cursor, user_id, (kind,))
+        return
+    if day > last_day:
+        streak = streak + 1 if day == last_day + 1 else 1
+    if week_count > best_week:
+        best_week, best_week_start = week_count, _monday(day)
+    cursor.execute("""
+        UPDATE user_records
+           SET current_streak = ?, longest_streak = ?, last_day = ?, best_week = ?, best_week_start = ?, total = total + ?
+         WHERE user_id = ? AND kind = ?
+    """, (streak, max(longest, streak), day, best_week, best_week_start, amount, user_id, kind))
+
+def _apply_exercise(cursor, user_id, when_date):
+    day = _day(when_date)
+    cursor.execute("SELECT count FROM exercise_log WHERE user_id = ? AND date = ?", (user_id, day))
     row = cursor.fetchone()
     if row:
+        if row[0] >= 1:     # ★ 하루 1회만 인정 (포럼+음성 중복 불가)
+            return row[0]
         new_cnt = row[0] + 1
-        cursor.execute("UPDATE diet_log SET count = ? WHERE user_id = ? AND date = ?", (new_cnt, user_id, when_date))
+        cursor.execute("UPDATE exercise_log SET count = ? WHERE user_id = ? AND date = ?", (new_cnt, user_id, day))
     else:
         new_cnt = 1
-        cursor.execute("INSERT INTO diet_log (user_id, date, count) VALUES (?, ?, 1)", (user_id, when_date))
-    conn.commit()
+        cursor.execute("INSERT INTO exercise_log (user_id, date, count) VALUES (?, ?, 1)", (user_id, day))
+    _bump_record(cursor, user_id, "exercise", day, 1, _bump_weekly(cursor, "exercise_weekly", user_id, day))
+    _journal(cursor, "exercise", user_id, when_date)
     return new_cnt
 
-def get_week_progress(user_id, week_start, week_end):
-    result = {"exercise_goal": 0, "exercise_done": 0, "diet_goal": 0, "diet_done": 0, "weight_goal": False, "daily": {}}
-    cursor.execute("SELECT freq_per_week FROM goals WHERE user_id = ? AND type = 'freq_exercise' AND active = 1", (user_id,))
+def _apply_diet(cursor, user_id, when_date, amount=1):
+    day = _day(when_date)
+    cursor.execute("SELECT count FROM diet_log WHERE user_id = ? AND date = ?", (user_id, day))
     row = cursor.fetchone()
     if row:
-        result["exercise_goal"] = row[0]
+        new_cnt = row[0] + amount
+        cursor.execute("UPDATE diet_log SET count = ? WHERE user_id = ? AND date = ?", (new_cnt, user_id, day))
+    else:
+        new_cnt = amount
+        cursor.execute("INSERT INTO diet_log (user_id, date, count) VALUES (?, ?, ?)", (user_id, day, amount))
+    _bump_record(cursor, user_id, "diet", day, amount, _bump_weekly(cursor, "diet_weekly", user_id, day, amount))
+    _journal(cursor, "diet", user_id, when_date, {"n": amount} if amount != 1 else None)
+    return new_cnt
+
+def _claim_event(cursor, source, event_id, user_id, when_date):
+    """원천 이벤트를 기록합니다. 이미 기록된 이벤트면 False. (기본 키 조회 한 번)"""
+    cursor.execute("""
+        INSERT OR IGNORE INTO ingested_events (source, event_id, user_id, date, ingested_at) VALUES (?, ?, ?, ?, ?)
+    """, (source, str(event_id), user_id, when_date, datetime.now().isoformat()))
+    return cursor.rowcount == 1
+
+# event_id 를 주면 (source, event_id) 당 한 번만 반영하고, 이미 반영된 이벤트면 None 을 반환합니다.
+def increment_exercise_log(user_id, when_date=None, event_id=None, source="voice"):
+    if when_date is None:
+        when_date = datetime.now().strftime("%Y-%m-%d")
+    event = (source, str(event_id)) if event_id is not None else None
+    if _write_buffer is not None:
+        return _write_buffer.add_exercise(user_id, when_date, event)
+    with _writer() as cursor:
+        if event is not None and not _claim_event(cursor, source, event_id, user_id, when_date):
+            return None
+        return _apply_exercise(cursor, user_id, when_date)
+
+def increment_diet_log(user_id, when_date=None, event_id=None, source="forum"):
+    if when_date is None:
+        when_date = datetime.now().strftime("%Y-%m-%d")
+    event = (source, str(event_id)) if event_id is not None else None
+    if _write_buffer is not None:
+        return _write_buffer.add_diet(user_id, when_date, event)
+    with _writer() as cursor:
+        if event is not None and not _claim_event(cursor, source, event_id, user_id, when_date):
+            return None
+        return _apply_diet(cursor, user_id, when_date)
+
+# -----------------------------------------------------------------------------
+# 그룹 커밋 쓰기 버퍼 (옵트인)
+#   enable_write_buffer() 이후의 로그 증가/체중 갱신은 (user_id, date) 단위로 합쳐 두었다가
+#   flush_interval_ms 마다 또는 max_ops 건이 모이면 한 트랜잭션(fsync 1회)으로 기록합니다.
+#   같은 사용자를 읽는 함수는 읽기 전에 버퍼를 비우므로 방금 쓴 값이 항상 보입니다.
+# -----------------------------------------------------------------------------
+class WriteBuffer:
+    def __init__(self, flush_interval_ms: int = 200, max_ops: int = 500, max_retries: int = 3):
+        self.flush_interval = flush_interval_ms / 1000
+        self.max_ops = max_ops
+        self.max_retries = max_retries
+        self._lock = threading.RLock()
+        self._wake = threading.Event()
+        self._closed = False
+        self._exercise: set[tuple[str, str]] = set()
+        self._diet: dict[tuple[str, str], int] = {}
+        self._weights: dict[str, tuple[float, str]] = {}
+        self._events: dict[tuple[str, str], tuple[str, str, str]] = {}   # (source, event_id) → (종류, user_id, 날짜)
+        self._users: set[str] = set()
+        self._ops = 0
+        self._failures = 0   # 같은 배치가 연속으로 실패한 횟수
+        self.dropped: deque = deque(maxlen=100)   # 하나씩 기록해도 실패해 버린 쓰기 (op, 오류) — 원인 확인용
+        self.stats = {"flushes": 0, "ops": 0, "last_batch_size": 0, "max_batch_size": 0,
+                      "last_flush_ms": 0.0, "max_flush_ms": 0.0, "failed_flushes": 0, "dropped_ops": 0}
+        self._thread = threading.Thread(target=self._run, name="trainer-db-flush", daemon=True)
+        self._thread.start()
+
+    def _queued(self, user_id):
+        self._users.add(user_id)
+        self._ops += 1
+        self.stats["ops"] += 1
+        if self._ops >= self.max_ops:
+            # 호출자가 이미 _lock 을 잡고 있음 (RLock). 실패해도 쓰기는 버퍼에 남아 있으므로 호출자에게 올리지 않음
+            try:
+                self.flush()
+            except Exception:
+                log.warning("쓰기 버퍼 flush 실패 (%d/%d회)", self._failures, self.max_retries, exc_info=True)
+
+    def _seen(self, event):
+        # 이미 버퍼에 있거나 DB 에 기록된 이벤트인지 (호출자가 _lock 을 잡고 있음)
+        if event in self._events:
+            return True
+        with _reader() as cursor:
+            cursor.execute("SELECT 1 FROM ingested_events WHERE source = ? AND event_id = ?", event)
+            return cursor.fetchone() is not None
+
+    def add_exercise(self, user_id, when_date, event=None):
+        with self._lock:
+            if event is not None and self._seen(event):
+                return None
+            key = (user_id, when_date)
+            if event is not None:
+                # 그날 이미 인정됐어도 이벤트 ID 는 남김 (버퍼 없이 쓸 때처럼 ingested_events 에 기록)
+                self._events[event] = ("exercise", user_id, when_date)
+            if key in self._exercise:
+                if event is not None:
+                    self._queued(user_id)
+                return 1
+            with _reader() as cursor:
+                cursor.execute("SELECT count FROM exercise_log WHERE user_id = ? AND date = ?", (user_id, _day(when_date)))
+                row = cursor.fetchone()
+            if row and row[0] >= 1:     # ★ 하루 1회만 인정
+                if event is not None:
+                    self._queued(user_id)
+                return row[0]
+            self._exercise.add(key)
+            self._queued(user_id)
+            return 1
+
+    def add_diet(self, user_id, when_date, event=None):
+        with self._lock:
+            if event is not None and self._seen(event):
+                return None
+            key = (user_id, when_date)
+            with _reader() as cursor:
+                cursor.execute("SELECT count FROM diet_log WHERE user_id = ? AND date = ?", (user_id, _day(when_date)))
+                row = cursor.fetchone()
+            pending = self._diet.get(key, 0) + 1
+            self._diet[key] = pending
+            if event is not None:
+                self._events[event] = ("diet", user_id, when_date)
+            self._queued(user_id)
+            return (row[0] if row else 0) + pending
+
+    def add_weight(self, user_id, new_weight, modified_at):
+        with self._lock:
+            self._weights[user_id] = (new_weight, modified_at)   # 마지막 값만 반영
+            self._queued(user_id)
+
+    def has_pending(self, user_ids=None) -> bool:
+        with self._lock:
+            if user_ids is None:
+                return bool(self._users)
+            return any(uid in self._users for uid in user_ids)
+
+    def _batch(self):
+        """버퍼 내용을 (종류, user_id, 날짜, 값, 이벤트 목록) op 로 묶습니다. 이벤트는 같은 (종류, 사용자, 날짜) op 에 붙입니다."""
+        events: dict[tuple[str, str, str], list] = {}
+        for event, target in self._events.items():
+            events.setdefault(target, []).append(event)
+        ops = []
+        for user_id, when_date in self._exercise:
+            ops.append(("exercise", user_id, when_date, True, events.pop(("exercise", user_id, when_date), ())))
+        for (user_id, when_date), amount in self._diet.items():
+            ops.append(("diet", user_id, when_date, amount, events.pop(("diet", user_id, when_date), ())))
+        for (kind, user_id, when_date), evs in events.items():
+            ops.append((kind, user_id, when_date, False if kind == "exercise" else 0, evs))   # 이벤트 ID 만 남길 것
+        for user_id, value in self._weights.items():
+            ops.append(("weight", user_id, None, value, ()))
+        return ops
+
+    @staticmethod
+    def _write(cursor, op):
+        kind, user_id, when_date, value, events = op
+        # 버퍼에 쌓인 사이 다른 경로로 이미 반영된 이벤트는 그만큼 빼고 기록
+        duplicated = sum(not _claim_event(cursor, source, event_id, user_id, when_date) for source, event_id in events)
+        if kind == "exercise":
+            if value:
+                _apply_exercise(cursor, user_id, when_date)
+        elif kind == "diet":
+            if value - duplicated > 0:
+                _apply_diet(cursor, user_id, when_date, value - duplicated)
+        else:
+            _apply_weight(cursor, user_id, *value)
+
+    def flush(self):
+        """쌓인 쓰기를 한 트랜잭션으로 기록합니다. 기록이 끝날 때까지 새 쓰기는 대기합니다.
+        실패하면 버퍼를 그대로 두고 예외를 올립니다. max_retries 번 연속 실패하면 op 마다 따로 기록하고,
+        그래도 실패하는 op 는 버리고 dropped·stats["dropped_ops"] 에 남깁니다. (나머지 쓰기가 막히지 않도록)"""
+        with self._lock:
+            if not self._users:
+                return
+            batch_size = self._ops
+            started = time.perf_counter()
+            ops = self._batch()
+            try:
+                with _writer() as cursor:
+                    for op in ops:
+                        self._write(cursor, op)
+                one_by_one = False
+            except Exception:
+                self._failures += 1
+                self.stats["failed_flushes"] += 1
+                if self._failures < self.max_retries:
+                    raise
+                log.warning("쓰기 버퍼 flush 가 %d번 연속 실패 — op 마다 따로 기록합니다", self._failures, exc_info=True)
+                one_by_one = True
+            if one_by_one:
+                for op in ops:
+                    try:
+                        with _writer() as cursor:
+                            self._write(cursor, op)
+                    except Exception as e:
+                        self.dropped.append((op, repr(e)))
+                        self.stats["dropped_ops"] += 1
+                        log.warning("쓰기 버퍼 op 를 버립니다: %r", op, exc_info=True)
+            elapsed_ms = (time.perf_counter() - started) * 1000
+            self._failures = 0
+            self._exercise.clear()
+            self._diet.clear()
+            self._weights.clear()
+            self._events.clear()
+            self._users.clear()
+            self._ops = 0
+            st = self.stats
+            st["flushes"] += 1
+            st["last_batch_size"] = batch_size
+            st["max_batch_size"] = max(st["max_batch_size"], batch_size)
+            st["last_flush_ms"] = elapsed_ms
+            st["max_flush_ms"] = max(st["max_flush_ms"], elapsed_ms)
+
+    def _run(self):
+        while not self._closed:
+            self._wake.wait(self.flush_interval)
+            self._wake.clear()
+            try:
+                self.flush()
+            except Exception:
+                # 버퍼는 비우지 않았으므로 다음 주기에 다시 시도합니다. (max_retries 번째에는 op 별로 기록)
+                log.warning("쓰기 버퍼 flush 실패 (%d/%d회)", self._failures, self.max_retries, exc_info=True)
+
+    def close(self):
+        self._closed = True
+        self._wake.set()
+        self._thread.join()
+        self.flush()
+
+
+_write_buffer: Optional[WriteBuffer] = None
+
+def enable_write_buffer(flush_interval_ms: int = 200, max_ops: int = 500, max_retries: int = 3) -> WriteBuffer:
+    """그룹 커밋 쓰기 버퍼를 켭니다. 이미 켜져 있으면 기존 버퍼를 반환합니다."""
+    global _write_buffer
+    if _write_buffer is None:
+        _write_buffer = WriteBuffer(flush_interval_ms, max_ops, max_retries)
+        atexit.register(disable_write_buffer)
+    return _write_buffer
+
+def disable_write_buffer():
+    """남은 쓰기를 기록하고 버퍼를 끕니다."""
+    global _write_buffer
+    buffer, _write_buffer = _write_buffer, None
+    if buffer is not None:
+        buffer.close()
+
+def flush_writes():
+    if _write_buffer is not None:
+        _write_buffer.flush()
+
+def write_buffer_stats() -> dict:
+    """flush 횟수, 배치 크기, flush 지연(ms), 실패한 flush·버린 op 수 통계. 버퍼가 꺼져 있으면 빈 dict."""
+    return dict(_write_buffer.stats) if _write_buffer is not None else {}
+
+def _flush_pending(user_ids=None):
+    """읽기/목표 변경 전에, 해당 사용자(None 이면 전체)의 대기 중인 쓰기를 먼저 기록합니다."""
+    if _write_buffer is None:
+        return
+    if isinstance(user_ids, str):
+        user_ids = (user_ids,)
+    if _write_buffer.has_pending(user_ids):
+        _write_buffer.flush()
+
+def _empty_progress(labels):
+    return {"exercise_goal": 0, "exercise_done": 0, "diet_goal": 0, "diet_done": 0, "weight_goal": False,
+            "daily": {label: {"exercise": 0, "diet": 0} for label in labels}}
+
+def get_week_progress(user_id, week_start, week_end):
+    return get_week_progress_many([user_id], week_start, week_end)[str(user_id)]
+
+def get_week_progress_many(user_ids, week_start, week_end):
+    """여러 사용자의 주간 진행 현황을 {user_id: progress} 로 반환합니다.
+    목표 1회 + 로그(운동/식단 합본) 1회, 총 2번의 쿼리로 끝납니다."""
+    user_ids = list(dict.fromkeys(str(uid) for uid in user_ids))
+    ws, we = _day(week_start), _day(week_end)
+    labels = [_iso(day) for day in range(ws, we + 1)]   # 날짜 문자열은 사용자 수와 무관하게 한 번만 만듦
+    results = {uid: _empty_progress(labels) for uid in user_ids}
+    if not user_ids:
+        return results
+    _flush_pending(user_ids)
+    ids_json = json.dumps(user_ids)
+    with _reader() as cursor:
         cursor.execute("""
-            SELECT COALESCE(SUM(count), 0) FROM exercise_log
-            WHERE user_id = ? AND date BETWEEN ? AND ?
-        """, (user_id, week_start, week_end))
-        result["exercise_done"] = cursor.fetchone()[0]
-    cursor.execute("SELECT freq_per_week FROM goals WHERE user_id = ? AND type = 'freq_diet' AND active = 1", (user_id,))
-    row = cursor.fetchone()
-    if row:
-        result["diet_goal"] = row[0]
+            SELECT g.user_id,
+                   MAX(CASE WHEN g.type = 'freq_exercise' THEN g.freq_per_week END),
+                   MAX(CASE WHEN g.type = 'freq_diet' THEN g.freq_per_week END),
+                   MAX(CASE WHEN g.type = 'weight' AND g.current_weight <= g.target_weight THEN 1 ELSE 0 END)
+              FROM goals g
+             WHERE g.active = 1 AND g.user_id IN (SELECT value FROM json_each(?))
+             GROUP BY g.user_id
+        """, (ids_json,))
+        for user_id, ex_goal, dt_goal, weight_ok in cursor.fetchall():
+            result = results[user_id]
+            if ex_goal is not None:
+                result["exercise_goal"] = ex_goal
+            if dt_goal is not None:
+                result["diet_goal"] = dt_goal
+            result["weight_goal"] = bool(weight_ok)
+
+        # 운동/식단 로그를 한 번에 훑어 (user_id, date) 별 합계를 구합니다.
         cursor.execute("""
-            SELECT COALESCE(SUM(count), 0) FROM diet_log
-            WHERE user_id = ? AND date BETWEEN ? AND ?
-        """, (user_id, week_start, week_end))
-        result["diet_done"] = cursor.fetchone()[0]
-    cursor.execute("SELECT target_weight, current_weight FROM goals WHERE user_id = ? AND type = 'weight' AND active = 1", (user_id,))
-    row = cursor.fetchone()
-    if row and row[0] is not None and row[1] is not None and row[1] <= row[0]:
-        result["weight_goal"] = True
-    day_iter = datetime.strptime(week_start, "%Y-%m-%d").date()
-    end_dt = datetime.strptime(week_end, "%Y-%m-%d").date()
-    while day_iter <= end_dt:
-        d_str = day_iter.strftime("%Y-%m-%d")
-        cursor.execute("SELECT count FROM exercise_log WHERE user_id = ? AND date = ?", (user_id, d_str))
-        ex_count = cursor.fetchone()
-        cursor.execute("SELECT count FROM diet_log WHERE user_id = ? AND date = ?", (user_id, d_str))
-        dt_count = cursor.fetchone()
-        result["daily"][d_str] = {"exercise": ex_count[0] if ex_count else 0, "diet": dt_count[0] if dt_count else 0}
-        day_iter += timedelta(days=1)
-    return result
+            SELECT user_id, date, SUM(ex), SUM(dt) FROM (
+                SELECT user_id, date, count AS ex, 0 AS dt FROM exercise_log
+                 WHERE date BETWEEN ? AND ? AND user_id IN (SELECT value FROM json_each(?))
+                UNION ALL
+                SELECT user_id, date, 0 AS ex, count AS dt FROM diet_log
+                 WHERE date BETWEEN ? AND ? AND user_id IN (SELECT value FROM json_each(?))
+            )
+            GROUP BY user_id, date
+        """, (ws, we, ids_json, ws, we, ids_json))
+        rows = cursor.fetchall()
+
+    for user_id, day, ex_cnt, dt_cnt in rows:
+        result = results[user_id]
+        result["daily"][labels[day - ws]] = {"exercise": ex_cnt, "diet": dt_cnt}
+        # 합계는 해당 목표가 있을 때만 집계 (기존 동작 유지)
+        if result["exercise_goal"]:
+            result["exercise_done"] += ex_cnt
+        if result["diet_goal"]:
+            result["diet_done"] += dt_cnt
+    return results
 
 def get_muscle_ranking_top5():
-    cursor.execute("""
-        SELECT nickname, (badge_weekly + badge_bikini + badge_monthly) AS total,
-               badge_weekly, badge_bikini, badge_monthly
-        FROM users
-        ORDER BY total DESC
-        LIMIT 5
-    """)
-    return cursor.fetchall()
+    _flush_pending()
+    with _reader() as cursor:
+        cursor.execute("""
+            SELECT nickname, (badge_weekly + badge_bikini + badge_monthly) AS total,
+                   badge_weekly, badge_bikini, badge_monthly
+            FROM users
+            ORDER BY total DESC
+            LIMIT 5
+        """)
+        return cursor.fetchall()
+
+def _weekly_ranking(table, log_table, week_start, week_end, limit=5):
+    ws, we = _day(week_start), _day(week_end)
+    _flush_pending()
+    with _reader() as cursor:
+        # 롤업은 월~일 주 단위 합계이므로, 한 주 전체(또는 오늘까지)를 묻는 경우에만 사용
+        use_rollup = _monday(ws) == ws and we - ws <= 6 and (we - ws == 6 or we >= _day(date.today()))
+        if not use_rollup:
+            # 임의 구간은 로그를 직접 집계
+            cursor.execute(f"""
+                SELECT u.nickname, COALESCE(SUM(l.count), 0) AS total_count
+                FROM users u
+                LEFT JOIN {log_table} l ON u.user_id = l.user_id AND l.date BETWEEN ? AND ?
+                GROUP BY u.user_id
+                ORDER BY total_count DESC
+                LIMIT ?
+            """, (ws, we, limit))
+            return cursor.fetchall()
+        # 롤업 인덱스 (week_start, count DESC) 로 상위 k 개만 읽음
+        cursor.execute(f"""
+            SELECT u.nickname, w.count
+              FROM {table} w
+              JOIN users u ON u.user_id = w.user_id
+             WHERE w.week_start = ?
+             ORDER BY w.count DESC
+             LIMIT ?
+        """, (ws, limit))
+        rows = cursor.fetchall()
+        if len(rows) < limit:
+            # 기록이 부족하면 0회 사용자로 채움 (기존 LEFT JOIN 결과와 동일)
+            cursor.execute(f"""
+                SELECT nickname, 0 FROM users
+                 WHERE user_id NOT IN (SELECT user_id FROM {table} WHERE week_start = ?)
+                 LIMIT ?
+            """, (ws, limit - len(rows)))
+            rows += cursor.fetchall()
+        return rows
 
 def get_exercise_ranking_top5(week_start, week_end):
-    cursor.execute("""
-        SELECT u.nickname, COALESCE(SUM(el.count), 0) AS total_count
-        FROM users u
-        LEFT JOIN exercise_log el ON u.user_id = el.user_id AND el.date BETWEEN ? AND ?
-        GROUP BY u.user_id
-        ORDER BY total_count DESC
-        LIMIT 5
-    """, (week_start, week_end))
-    return cursor.fetchall()
+    return _weekly_ranking("exercise_weekly", "exercise_log", week_start, week_end)
 
 def get_diet_ranking_top5(week_start, week_end):
+    return _weekly_ranking("diet_weekly", "diet_log", week_start, week_end)
+
+def award_weekly_badges(week_start):
+    """week_start(월요일) 주의 달성 여부를 weekly_status 에 기록하고 주간/비키니 배지를 지급합니다.
+    같은 주를 다시 실행해도 이미 받은 배지는 다시 주지 않습니다."""
+    _flush_pending()
+    with _writer() as cursor:
+        _award_weekly_badges(cursor, week_start)
+
+def _award_weekly_badges(cursor, week_start):
+    ws = _day(week_start)
+    # 1) 활성 목표가 있는 사용자별로 이번 주 달성 여부를 한 번에 계산
+    cursor.execute("DROP TABLE IF EXISTS temp.week_eval")
     cursor.execute("""
-        SELECT u.nickname, COALESCE(SUM(dl.count), 0) AS total_count
-        FROM users u
-        LEFT JOIN diet_log dl ON u.user_id = dl.user_id AND dl.date BETWEEN ? AND ?
-        GROUP BY u.user_id
-        ORDER BY total_count DESC
-        LIMIT 5
-    """, (week_start, week_end))
-    return cursor.fetchall()
-
-def check_and_award_weekly_badges():
-    today = date.today()
-    if today.weekday() != 6: return
-    week_start = (today - timedelta(days=today.weekday())).strftime("%Y-%m-%d")
-    week_end = today.strftime("%Y-%m-%d")
-    cursor.execute("SELECT user_id, type, freq_per_week FROM goals WHERE active = 1")
-    goals = cursor.fetchall()
-    user_weeks = {}
-    for user_id, gtype, freq in goals:
-        user_weeks.setdefault(user_id, {"exercise": False, "diet": False, "weight": False})
-    for user_id in list(user_weeks.keys()):
-        cursor.execute("SELECT freq_per_week FROM goals WHERE user_id = ? AND type = 'freq_exercise' AND active = 1", (user_id,))
+        CREATE TEMP TABLE week_eval AS
+        SELECT g.user_id,
+               CASE WHEN g.ex_goal IS NOT NULL AND COALESCE(ex.total, 0) >= g.ex_goal THEN 1 ELSE 0 END AS achieved_exercise,
+               CASE WHEN g.dt_goal IS NOT NULL AND COALESCE(dt.total, 0) >= g.dt_goal THEN 1 ELSE 0 END AS achieved_diet,
+               g.weight_ok AS achieved_weight
+          FROM (SELECT user_id,
+                       MAX(CASE WHEN type = 'freq_exercise' THEN freq_per_week END) AS ex_goal,
+                       MAX(CASE WHEN type = 'freq_diet' THEN freq_per_week END) AS dt_goal,
+                       MAX(CASE WHEN type = 'weight' AND current_weight <= target_weight THEN 1 ELSE 0 END) AS weight_ok
+                  FROM goals WHERE active = 1
+                 GROUP BY user_id) g
+          LEFT JOIN (SELECT user_id, SUM(count) AS total FROM exercise_log
+                      WHERE date BETWEEN ? AND ? GROUP BY user_id) ex ON ex.user_id = g.user_id
+          LEFT JOIN (SELECT user_id, SUM(count) AS total FROM diet_log
+                      WHERE date BETWEEN ? AND ? GROUP BY user_id) dt ON dt.user_id = g.user_id
+    """, (ws, ws + 6, ws, ws + 6))
+    # 2) 주간 배지 일괄 지급 — 이 주에 이미 달성으로 기록된 사용자(재실행)는 제외
+    cursor.execute("""
+        UPDATE users SET badge_weekly = badge_weekly + 1
+         WHERE user_id IN (SELECT e.user_id FROM week_eval e
+                            WHERE e.achieved_exercise = 1 AND e.achieved_diet = 1
+                              AND NOT EXISTS (SELECT 1 FROM weekly_status ws
+                                               WHERE ws.user_id = e.user_id AND ws.week_start = ?
+                                                 AND ws.achieved_exercise != 0 AND ws.achieved_diet != 0))
+    """, (ws,))
+    # 3) weekly_status 일괄 upsert
+    cursor.execute("""
+        INSERT INTO weekly_status (user_id, week_start, achieved_exercise, achieved_diet, weight_updated, achieved_weight)
+        SELECT user_id, ?, achieved_exercise, achieved_diet, 1, achieved_weight FROM week_eval WHERE true
+        ON CONFLICT(user_id, week_start) DO UPDATE SET
+            achieved_exercise = excluded.achieved_exercise,
+            achieved_diet = excluded.achieved_diet,
+            weight_updated = excluded.weight_updated,
+            achieved_weight = excluded.achieved_weight
+    """, (ws,))
+    # 4) 비키니 배지는 체중 목표 하나당 한 번만 (DM 입력 시 record_weight 에서 이미 받았으면 제외)
+    cursor.execute("""
+        UPDATE users SET badge_bikini = badge_bikini + 1
+         WHERE user_id IN (SELECT e.user_id FROM week_eval e
+                             JOIN goals g ON g.user_id = e.user_id AND g.type = 'weight' AND g.active = 1
+                            WHERE e.achieved_weight = 1 AND COALESCE(g.achieved, 0) = 0)
+    """)
+    cursor.execute("""
+        UPDATE goals SET achieved = 1
+         WHERE type = 'weight' AND active = 1 AND COALESCE(achieved, 0) = 0
+           AND user_id IN (SELECT user_id FROM week_eval WHERE achieved_weight = 1)
+    """)
+    cursor.execute("DROP TABLE temp.week_eval")
+    _journal(cursor, "week_closed", "", week_start)
+
+def _month_mondays(year_month):
+    """해당 달의 (첫 월요일, 마지막 날, 월요일 개수)."""
+    first_day = date.fromisoformat(year_month + "-01")
+    last_day = (first_day + timedelta(days=32)).replace(day=1) - timedelta(days=1)
+    first_monday = first_day + timedelta(days=(7 - first_day.weekday()) % 7)
+    return first_monday, last_day, (last_day - first_monday).days // 7 + 1
+
+def award_monthly_trophy(year_month):
+    """year_month('YYYY-MM')의 월요일 시작 주를 모두 달성한 사용자에게 월간 트로피를 지급합니다. (이미 받은 사람 제외)"""
+    _flush_pending()
+    with _writer() as cursor:
+        _award_monthly_trophy(cursor, year_month)
+
+def _award_monthly_trophy(cursor, year_month):
+    # 그 달의 월요일 개수 = 모든 주를 달성해야 하는 주 수
+    first_monday, last_day, monday_count = _month_mondays(year_month)
+    # 그 달 월요일 주차를 모두 달성한 사용자 중 아직 트로피를 받지 않은 사람
+    cursor.execute("DROP TABLE IF EXISTS temp.month_winners")
+    cursor.execute("""
+        CREATE TEMP TABLE month_winners AS
+        SELECT ws.user_id
+          FROM weekly_status ws
+          JOIN users u ON u.user_id = ws.user_id
+         WHERE ws.week_start BETWEEN ? AND ?
+           AND ws.achieved_exercise != 0 AND ws.achieved_diet != 0
+           AND NOT EXISTS (SELECT 1 FROM monthly_trophy mt
+                            WHERE mt.user_id = ws.user_id AND mt.year_month = ?)
+         GROUP BY ws.user_id
+        HAVING COUNT(*) = ?
+    """, (_day(first_monday), _day(last_day), year_month, monday_count))
+    cursor.execute("""
+        INSERT INTO monthly_trophy (user_id, year_month, won_trophy)
+        SELECT user_id, ?, 1 FROM month_winners
+    """, (year_month,))
+    cursor.execute("""
+        UPDATE users SET badge_monthly = badge_monthly + 1
+         WHERE user_id IN (SELECT user_id FROM month_winners)
+    """)
+    cursor.execute("DROP TABLE temp.month_winners")
+    _journal(cursor, "month_closed", "", year_month)
+
+# -----------------------------------------------------------------------------
+# 정기 작업: 기간(주/월)별 워터마크로 실제 경계에서 한 번씩만 실행
+#   weekly_badges  : 주(월요일 'YYYY-MM-DD')가 끝난 뒤 월요일 00:05 KST 부터 실행 가능
+#   monthly_trophy : 달('YYYY-MM')이 끝난 뒤 1일 00:10 KST 부터, 그 달 마지막 월요일 주의 weekly_badges 가 끝난 뒤 실행
+# 봇이 꺼져 있던 동안 지난 기간은 다음 실행 때 순서대로 따라잡습니다.
+# 집계와 워터마크 갱신이 한 트랜잭션이라 같은 기간이 두 번 반영되지 않습니다.
+# -----------------------------------------------------------------------------
+WEEKLY_JOB = "weekly_badges"
+MONTHLY_JOB = "monthly_trophy"
+WEEKLY_JOB_DELAY = timedelta(minutes=5)
+MONTHLY_JOB_DELAY = timedelta(minutes=10)
+_JOBS = {WEEKLY_JOB: _award_weekly_badges, MONTHLY_JOB: _award_monthly_trophy}
+
+def get_job_watermark(job):
+    """job 이 마지막으로 끝낸 기간. (한 번도 실행하지 않았으면 None)"""
+    with _reader() as cursor:
+        cursor.execute("SELECT last_period FROM job_runs WHERE job = ?", (job,))
         row = cursor.fetchone()
-        if row:
-            target_cnt = row[0]
-            cursor.execute("SELECT COALESCE(SUM(count), 0) FROM exercise_log WHERE user_id = ? AND date BETWEEN ? AND ?", (user_id, week_start, week_end))
-            total_ex = cursor.fetchone()[0]
-            if total_ex >= target_cnt: user_weeks[user_id]["exercise"] = True
-        cursor.execute("SELECT freq_per_week FROM goals WHERE user_id = ? AND type = 'freq_diet' AND active = 1", (user_id,))
+        return row[0] if row else None
+
+def run_job(job, period):
+    """job 을 period 에 대해 실행하고 워터마크를 올립니다. 이미 끝낸 기간이면 아무것도 하지 않고 False."""
+    _flush_pending()
+    with _writer() as cursor:
+        cursor.execute("SELECT last_period FROM job_runs WHERE job = ?", (job,))
         row = cursor.fetchone()
-        if row:
-            target_cnt = row[0]
-            cursor.execute("SELECT COALESCE(SUM(count), 0) FROM diet_log WHERE user_id = ? AND date BETWEEN ? AND ?", (user_id, week_start, week_end))
-            total_diet = cursor.fetchone()[0]
-            if total_diet >= target_cnt: user_weeks[user_id]["diet"] = True
-        cursor.execute("SELECT target_weight, current_weight FROM goals WHERE user_id = ? AND type = 'weight' AND active = 1", (user_id,))
+        if row is not None and row[0] >= period:
+            return False
+        started = time.perf_counter()
+        _JOBS[job](cursor, period)
+        cursor.execute("""
+            INSERT INTO job_runs (job, last_period, completed_at, duration_ms) VALUES (?, ?, ?, ?)
+            ON CONFLICT(job) DO UPDATE SET last_period = excluded.last_period,
+                completed_at = excluded.completed_at, duration_ms = excluded.duration_ms
+        """, (job, period, datetime.now().isoformat(), int((time.perf_counter() - started) * 1000)))
+        return True
+
+def _due_weeks(now, last):
+    """now(KST, naive) 기준으로 실행할 주 목록. 워터마크가 없으면 가장 최근에 끝난 주 하나만."""
+    t = now - timedelta(days=7) - WEEKLY_JOB_DELAY
+    latest = t.date() - timedelta(days=t.weekday())
+    if last is None:
+        return [latest.strftime("%Y-%m-%d")]
+    weeks = []
+    week = date.fromisoformat(last) + timedelta(days=7)
+    while week <= latest:
+        weeks.append(week.strftime("%Y-%m-%d"))
+        week += timedelta(days=7)
+    return weeks
+
+def _due_months(now, last, weekly_done):
+    """now 기준으로 실행할 달 목록. 그 달 마지막 월요일 주가 weekly_done 까지 끝난 달만."""
+    t = now - MONTHLY_JOB_DELAY
+    latest = (t.date().replace(day=1) - timedelta(days=1)).strftime("%Y-%m")
+    if last is None:
+        months = [latest]
+    else:
+        months = []
+        month = date.fromisoformat(last + "-01")
+        while True:
+            month = (month + timedelta(days=32)).replace(day=1)
+            if month.strftime("%Y-%m") > latest:
+                break
+            months.append(month.strftime("%Y-%m"))
+    due = []
+    for ym in months:
+        _, last_day, _ = _month_mondays(ym)
+        last_monday = (last_day - timedelta(days=last_day.weekday())).strftime("%Y-%m-%d")
+        if weekly_done is None or weekly_done < last_monday:
+            break
+        due.append(ym)
+    return due
+
+def run_due_jobs(now):
+    """now(KST) 까지 실행 가능한 주간/월간 작업을 모두 따라잡고 실행한 (job, period) 목록을 반환합니다."""
+    if now.tzinfo is not None:
+        now = now.replace(tzinfo=None)
+    done = []
+    for week in _due_weeks(now, get_job_watermark(WEEKLY_JOB)):
+        if run_job(WEEKLY_JOB, week):
+            done.append((WEEKLY_JOB, week))
+    for ym in _due_months(now, get_job_watermark(MONTHLY_JOB), get_job_watermark(WEEKLY_JOB)):
+        if run_job(MONTHLY_JOB, ym):
+            done.append((MONTHLY_JOB, ym))
+    return done
+
+# -----------------------------------------------------------------------------
+# 봇 상태 로드/저장 (main.py 의 사용자 캐시와 DM 대화 상태가 사용)
+# -----------------------------------------------------------------------------
+def load_user_state(user_id, week_start, week_end):
+    """사용자 한 명의 배지, 활성 목표, 연속·개인 기록, 이번 주 진행 현황을 한 번에 읽습니다. 없는 사용자면 None."""
+    user_id = str(user_id)
+    _flush_pending(user_id)
+    with _reader() as cursor:
+        cursor.execute("SELECT nickname, badge_weekly, badge_monthly, badge_bikini FROM users WHERE user_id = ?", (user_id,))
+        user_row = cursor.fetchone()
+        cursor.execute("""
+            SELECT type, start_date, end_date, target_weight, current_weight, freq_per_week,
+                   start_weight, progress_pct, achieved
+              FROM goals WHERE user_id = ? AND active = 1
+        """, (user_id,))
+        goal_rows = cursor.fetchall()
+        # 연속·개인 기록과, 마지막 인증일이 속한 주의 횟수 (캐시에서 최고 주간 기록을 이어 갱신할 때 씀)
+        cursor.execute("""
+            SELECT r.kind, r.current_streak, r.longest_streak, r.last_day, r.best_week, r.best_week_start, r.total,
+                   CASE r.kind WHEN 'exercise' THEN ew.count ELSE dw.count END
+              FROM user_records r
+              LEFT JOIN exercise_weekly ew ON ew.user_id = r.user_id AND ew.week_start = r.last_day - (r.last_day + 3) % 7
+              LEFT JOIN diet_weekly dw ON dw.user_id = r.user_id AND dw.week_start = r.last_day - (r.last_day + 3) % 7
+             WHERE r.user_id = ?
+        """, (user_id,))
+        record_rows = cursor.fetchall()
+    if user_row is None and not goal_rows:
+        return None
+    goals = {}
+    for gtype, start_date, end_date, target_w, current_w, freq, start_w, pct, achieved in goal_rows:
+        goals[gtype] = {"start_date": _iso(start_date), "end_date": _iso(end_date), "target_weight": target_w,
+                        "current_weight": current_w, "freq_per_week": freq, "start_weight": start_w,
+                        "progress_pct": pct or 0, "achieved": bool(achieved)}
+    records = {}
+    for kind, streak, longest, last_day, best_week, best_week_start, total, week_count in record_rows:
+        records[kind] = {"current_streak": streak, "longest_streak": longest, "last_day": _iso(last_day),
+                         "best_week": best_week, "best_week_start": _iso(best_week_start), "total": total,
+                         "last_week_count": week_count or 0}
+    nickname, badge_weekly, badge_monthly, badge_bikini = user_row or (None, 0, 0, 0)
+    return {
+        "nickname": nickname,
+        "badges": {"weekly": badge_weekly, "monthly": badge_monthly, "bikini": badge_bikini},
+        "goals": goals,
+        "records": records,
+        "progress": get_week_progress(user_id, week_start, week_end),
+    }
+
+def record_weight(user_id, new_weight, progress_pct):
+    """주간 체중 입력을 기록합니다. 처음으로 목표 체중에 도달했다면 비키니 배지를 주고 True 를 반환합니다."""
+    _flush_pending(user_id)
+    with _writer() as cursor:
+        cursor.execute("""
+            SELECT target_weight, COALESCE(achieved, 0) FROM goals
+             WHERE user_id = ? AND type = 'weight' AND active = 1
+        """, (user_id,))
         row = cursor.fetchone()
-        if row and row[0] is not None and row[1] is not None and row[1] <= row[0]:
-            user_weeks[user_id]["weight"] = True
-    for user_id, status in user_weeks.items():
-        achieved_ex = 1 if status["exercise"] else 0
-        achieved_dt = 1 if status["diet"] else 0
-        achieved_wt = 1 if status["weight"] else 0
-        cursor.execute("""
-            INSERT OR REPLACE INTO weekly_status (user_id, week_start, achieved_exercise, achieved_diet, weight_updated, achieved_weight)
-            VALUES (?, ?, ?, ?, 1, ?)
-        """, (user_id, week_start, achieved_ex, achieved_dt, achieved_wt))
-        if achieved_ex and achieved_dt:
-            cursor.execute("UPDATE users SET badge_weekly = badge_weekly + 1 WHERE user_id = ?", (user_id,))
-        if achieved_wt:
+        if row is None:
+            return False
+        target_weight, achieved = row
+        newly_achieved = not achieved and target_weight is not None and new_weight <= target_weight
+        cursor.execute("""
+            UPDATE goals SET current_weight = ?, progress_pct = ?, achieved = ?, last_modified = ?
+             WHERE user_id = ? AND type = 'weight' AND active = 1
+        """, (new_weight, progress_pct, 1 if (achieved or newly_achieved) else 0, datetime.now().isoformat(), user_id))
+        if newly_achieved:
             cursor.execute("UPDATE users SET badge_bikini = badge_bikini + 1 WHERE user_id = ?", (user_id,))
-    conn.commit()
+        _journal(cursor, "weight", user_id, data={"reached": target_weight is not None and new_weight <= target_weight})
+    return newly_achieved
 
-def check_and_award_monthly_trophy():
-    today = date.today()
-    if today.day != 1: return
-    last_month = (today.replace(day=1) - timedelta(days=1))
-    year_month = last_month.strftime("%Y-%m")
-    first_day = last_month.replace(day=1)
-    last_day = last_month.replace(day=last_month.day)
-    week_starts = []
-    day_iter = first_day
-    while day_iter <= last_day:
-        if day_iter.weekday() == 0: week_starts.append(day_iter.strftime("%Y-%m-%d"))
-        day_iter += timedelta(days=1)
-    cursor.execute("SELECT user_id FROM users")
-    all_users = [row[0] for row in cursor.fetchall()]
-    for user_id in all_users:
-        all_weeks_ok = True
-        for wstart in week_starts:
+def get_weight_prompt_targets():
+    """주간 체중 DM 을 받아야 하는 사용자 (체중 목표가 있고 아직 달성 전)."""
+    with _reader() as cursor:
+        cursor.execute("""
+            SELECT user_id FROM goals
+             WHERE type = 'weight' AND active = 1 AND COALESCE(achieved, 0) = 0
+        """)
+        return [row[0] for row in cursor.fetchall()]
+
+# -----------------------------------------------------------------------------
+# 주간 체중 DM 예약: 사용자별 시간대와 알림 시각
+#   timezone       : IANA 시간대 이름 (NULL 이면 Asia/Seoul)
+#   prompt_weekday : 현지 요일 (월=0 ~ 일=6, NULL 이면 일요일)
+#   prompt_minute  : 현지 자정 이후 분 (NULL 이면 21:00~23:45 사이 15분 슬롯 중 user_id 로 고르게 분산)
+#   last_prompted_week : 마지막으로 DM 을 받은 주의 현지 월요일. 이 값을 먼저 써 두는 것으로 주당 한 번만 보냅니다.
+# -----------------------------------------------------------------------------
+DEFAULT_TIMEZONE = "Asia/Seoul"
+DEFAULT_PROMPT_WEEKDAY = 6
+PROMPT_SLOT_MINUTES = 15
+DEFAULT_PROMPT_WINDOW = (21 * 60, 24 * 60)
+
+def default_prompt_minute(user_id):
+    start, end = DEFAULT_PROMPT_WINDOW
+    slots = (end - start) // PROMPT_SLOT_MINUTES
+    return start + (int(user_id) % slots) * PROMPT_SLOT_MINUTES
+
+def _tz(tz_name):
+    try:
+        return pytz.timezone(tz_name or DEFAULT_TIMEZONE)
+    except pytz.UnknownTimeZoneError:
+        return pytz.timezone(DEFAULT_TIMEZONE)
+
+def set_prompt_schedule(user_id, nickname, tz_name=None, weekday=None, minute=None):
+    """주간 체중 DM 시간대/요일/시각을 저장합니다. None 은 기본값으로 되돌림."""
+    with _writer() as cursor:
+        _register_user(cursor, user_id, nickname)
+        cursor.execute("UPDATE users SET timezone = ?, prompt_weekday = ?, prompt_minute = ? WHERE user_id = ?",
+                       (tz_name, weekday, minute, user_id))
+
+def get_prompt_schedule(user_id):
+    """기본값을 채운 (시간대 이름, 요일, 자정 이후 분)."""
+    with _reader() as cursor:
+        cursor.execute("SELECT timezone, prompt_weekday, prompt_minute FROM users WHERE user_id = ?", (user_id,))
+        row = cursor.fetchone() or (None, None, None)
+    tz_name, weekday, minute = row
+    return (_tz(tz_name).zone,
+            DEFAULT_PROMPT_WEEKDAY if weekday is None else weekday,
+            default_prompt_minute(user_id) if minute is None else minute)
+
+def claim_weight_prompts(now=None):
+    """알림 시각이 지났는데 이번 주(현지 기준) DM 을 아직 받지 않은 체중 DM 대상자를 선점하고 user_id 목록을 반환합니다.
+    선점은 쓰기 트랜잭션 안에서 last_prompted_week 를 바꾸는 것이므로 여러 번 불러도 한 주에 한 번만 돌려줍니다."""
+    now = now or datetime.now(pytz.utc)
+    local_now = {}   # 시간대 이름 → (현지 주 월요일, 주 시작부터 지난 분)
+    due = []
+    with _writer() as cursor:
+        cursor.execute("""
+            SELECT u.user_id, u.timezone, u.prompt_weekday, u.prompt_minute, u.last_prompted_week
+              FROM goals g JOIN users u ON u.user_id = g.user_id
+             WHERE g.type = 'weight' AND g.active = 1 AND COALESCE(g.achieved, 0) = 0
+        """)
+        for uid, tz_name, weekday, minute, last_week in cursor.fetchall():
+            if tz_name not in local_now:
+                local = now.astimezone(_tz(tz_name))
+                monday = local.date() - timedelta(days=local.weekday())
+                local_now[tz_name] = (monday.strftime("%Y-%m-%d"), local.weekday() * 1440 + local.hour * 60 + local.minute)
+            week, now_minute = local_now[tz_name]
+            if last_week == week:
+                continue
+            weekday = DEFAULT_PROMPT_WEEKDAY if weekday is None else weekday
+            minute = default_prompt_minute(uid) if minute is None else minute
+            if weekday * 1440 + minute <= now_minute:
+                due.append((week, uid))
+        cursor.executemany("UPDATE users SET last_prompted_week = ? WHERE user_id = ?", due)
+    return [uid for _, uid in due]
+
+def release_weight_prompts(user_ids):
+    """보내기에 실패한 사용자의 선점을 풀어 다음 슬롯에 다시 시도하게 합니다."""
+    if not user_ids:
+        return
+    with _writer() as cursor:
+        cursor.execute("UPDATE users SET last_prompted_week = NULL WHERE user_id IN (SELECT value FROM json_each(?))",
+                       (json.dumps([str(uid) for uid in user_ids]),))
+
+def get_ranking_scores(week_start):
+    """모든 사용자의 (user_id, 배지 합계, 이번 주 운동 횟수, 이번 주 식단 횟수, 최장 연속 운동 일수). 랭킹판 초기 적재용.
+    주간 횟수는 해당 목표가 있는 사용자만 집계합니다."""
+    _flush_pending()
+    with _reader() as cursor:
+        cursor.execute("""
+            SELECT u.user_id,
+                   u.badge_weekly + u.badge_bikini + u.badge_monthly,
+                   CASE WHEN EXISTS (SELECT 1 FROM goals g WHERE g.user_id = u.user_id AND g.type = 'freq_exercise' AND g.active = 1)
+                        THEN COALESCE(ew.count, 0) ELSE 0 END,
+                   CASE WHEN EXISTS (SELECT 1 FROM goals g WHERE g.user_id = u.user_id AND g.type = 'freq_diet' AND g.active = 1)
+                        THEN COALESCE(dw.count, 0) ELSE 0 END,
+                   COALESCE(r.longest_streak, 0)
+              FROM users u
+              LEFT JOIN exercise_weekly ew ON ew.user_id = u.user_id AND ew.week_start = ?
+              LEFT JOIN diet_weekly dw ON dw.user_id = u.user_id AND dw.week_start = ?
+              LEFT JOIN user_records r ON r.user_id = u.user_id AND r.kind = 'exercise'
+        """, (_day(week_start), _day(week_start)))
+        return cursor.fetchall()
+
+def load_dm_contexts(flow):
+    """진행 중인 DM 대화 상태를 {user_id: dict} 로 읽습니다."""
+    with _reader() as cursor:
+        cursor.execute("SELECT user_id, data FROM dm_context WHERE flow = ?", (flow,))
+        return {user_id: json.loads(data) for user_id, data in cursor.fetchall()}
+
+def save_dm_context(flow, user_id, data):
+    with _writer() as cursor:
+        cursor.execute("""
+            INSERT INTO dm_context (user_id, flow, data, updated_at) VALUES (?, ?, ?, ?)
+            ON CONFLICT(user_id, flow) DO UPDATE SET data = excluded.data, updated_at = excluded.updated_at
+        """, (user_id, flow, json.dumps(data), datetime.now().isoformat()))
+
+def delete_dm_context(flow, user_id):
+    with _writer() as cursor:
+        cursor.execute("DELETE FROM dm_context WHERE user_id = ? AND flow = ?", (user_id, flow))
+
+def get_dm_channels(user_ids):
+    """저장된 DM 채널 ID 를 {user_id: channel_id} 로 읽습니다. (캐시가 없는 사용자는 빠짐)"""
+    with _reader() as cursor:
+        cursor.execute("""
+            SELECT user_id, dm_channel_id FROM users
+             WHERE dm_channel_id IS NOT NULL AND user_id IN (SELECT value FROM json_each(?))
+        """, (json.dumps([str(uid) for uid in user_ids]),))
+        return dict(cursor.fetchall())
+
+def update_dm_channels(updates):
+    """{user_id: channel_id 또는 None} 을 한 번에 반영합니다. None 은 캐시 무효화."""
+    if not updates:
+        return
+    with _writer() as cursor:
+        cursor.executemany("UPDATE users SET dm_channel_id = ? WHERE user_id = ?",
+                           [(channel_id, str(uid)) for uid, channel_id in updates.items()])
+
+# -----------------------------------------------------------------------------
+# 음성 채널 세션 (시각은 KST naive datetime)
+# -----------------------------------------------------------------------------
+def load_voice_sessions():
+    """열린 음성 세션 {user_id: (channel_id, started_at)}."""
+    with _reader() as cursor:
+        cursor.execute("SELECT user_id, channel_id, started_at FROM voice_sessions")
+        return {uid: (channel_id, datetime.fromisoformat(started)) for uid, channel_id, started in cursor.fetchall()}
+
+def open_voice_session(user_id, channel_id, started_at):
+    """세션을 엽니다. 이미 열려 있으면 채널만 바꾸고 시작 시각은 유지합니다. (트래킹 채널 간 이동)"""
+    with _writer() as cursor:
+        cursor.execute("""
+            INSERT INTO voice_sessions (user_id, channel_id, started_at) VALUES (?, ?, ?)
+            ON CONFLICT(user_id) DO UPDATE SET channel_id = excluded.channel_id
+        """, (user_id, channel_id, started_at.isoformat()))
+
+def close_voice_session(user_id, ended_at):
+    """세션을 닫고 머문 시간을 날짜별로 나눠 voice_minutes 에 더합니다.
+    [(날짜, 더하기 전 누적 분, 더한 뒤 누적 분, 세션 ID)] 를 반환합니다. 열린 세션이 없으면 [].
+    세션 ID('user_id:시작 시각')는 이 세션으로 인정되는 운동의 중복 방지 키로 씁니다."""
+    with _writer() as cursor:
+        cursor.execute("SELECT started_at FROM voice_sessions WHERE user_id = ?", (user_id,))
+        row = cursor.fetchone()
+        if row is None:
+            return []
+        cursor.execute("DELETE FROM voice_sessions WHERE user_id = ?", (user_id,))
+        start = datetime.fromisoformat(row[0])
+        session_id = f"{user_id}:{row[0]}"
+        result = []
+        while start < ended_at:
+            midnight = datetime.combine(start.date() + timedelta(days=1), datetime.min.time())
+            end = min(ended_at, midnight)
+            day = start.strftime("%Y-%m-%d")
+            cursor.execute("SELECT minutes FROM voice_minutes WHERE user_id = ? AND date = ?", (user_id, day))
+            before = (cursor.fetchone() or (0,))[0]
+            after = before + (end - start).total_seconds() / 60
             cursor.execute("""
-                SELECT achieved_exercise, achieved_diet FROM weekly_status
-                WHERE user_id = ? AND week_start = ?
-            """, (user_id, wstart))
-            row = cursor.fetchone()
-            if row is None or row[0] == 0 or row[1] == 0:
-                all_weeks_ok = False
-                break
-        if all_weeks_ok:
-            cursor.execute("SELECT 1 FROM monthly_trophy WHERE user_id = ? AND year_month = ?", (user_id, year_month))
-            if cursor.fetchone() is None:
-                cursor.execute("""
-                    INSERT INTO monthly_trophy (user_id, year_month, won_trophy)
-                    VALUES (?, ?, 1)
-                """, (user_id, year_month))
-                cursor.execute("UPDATE users SET badge_monthly = badge_monthly + 1 WHERE user_id = ?", (user_id,))
-    conn.commit()
+                INSERT INTO voice_minutes (user_id, date, minutes) VALUES (?, ?, ?)
+                ON CONFLICT(user_id, date) DO UPDATE SET minutes = excluded.minutes
+            """, (user_id, day, after))
+            result.append((day, before, after, session_id))
+            start = end
+        return result
+
+# -----------------------------------------------------------------------------
+# 봇 상태 (재시작 시 놓친 이벤트 복구용)
+# -----------------------------------------------------------------------------
+def get_bot_state(key, default=None):
+    with _reader() as cursor:
+        cursor.execute("SELECT value FROM bot_state WHERE key = ?", (key,))
+        row = cursor.fetchone()
+        return row[0] if row else default
+
+def set_bot_state(key, value):
+    with _writer() as cursor:
+        cursor.execute("""
+            INSERT INTO bot_state (key, value) VALUES (?, ?)
+            ON CONFLICT(key) DO UPDATE SET value = excluded.value
+        """, (key, str(value)))
+
+def _advance_bot_state(cursor, key, value):
+    # 정수 값(스노우플레이크 등)을 더 큰 값으로만 올립니다.
+    cursor.execute("""
+        INSERT INTO bot_state (key, value) VALUES (?, ?)
+        ON CONFLICT(key) DO UPDATE SET value = excluded.value
+         WHERE CAST(bot_state.value AS INTEGER) < CAST(excluded.value AS INTEGER)
+    """, (key, str(value)))
+
+def advance_bot_state(key, value):
+    with _writer() as cursor:
+        _advance_bot_state(cursor, key, value)
+
+def apply_missed_diet_posts(posts, watermark_key, watermark):
+    """놓친 식단 인증 글 [(thread_id, user_id, 'YYYY-MM-DD')] 을 한 트랜잭션으로 반영하고 워터마크를 올립니다.
+    식단 목표가 있는 사용자만, 아직 반영되지 않은 스레드만 반영하며 실제로 반영된 user_id 집합을 반환합니다."""
+    _flush_pending()
+    with _writer() as cursor:
+        cursor.execute("""
+            SELECT user_id FROM goals
+             WHERE type = 'freq_diet' AND active = 1 AND user_id IN (SELECT value FROM json_each(?))
+        """, (json.dumps(sorted({uid for _, uid, _ in posts})),))
+        with_goal = {row[0] for row in cursor.fetchall()}
+        applied = set()
+        for thread_id, user_id, when_date in posts:
+            if user_id in with_goal and _claim_event(cursor, "forum", thread_id, user_id, when_date):
+                _apply_diet(cursor, user_id, when_date)
+                applied.add(user_id)
+        _advance_bot_state(cursor, watermark_key, watermark)
+        return applied
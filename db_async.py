@@ -0,0 +1,108 @@
+# db_async.py
+# db.py 함수들을 이벤트 루프 밖(전용 스레드)에서 실행하는 비동기 API.
+# 코루틴(이벤트 핸들러, 버튼 콜백, 루프 태스크)에서는 db.* 대신 이 모듈을 await 해서 사용합니다.
+#   예) await db_async.increment_diet_log(user_id)
+import asyncio
+import functools
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+import db
+import metrics
+
+# 쓰기는 SQLite 특성상 한 번에 하나뿐이므로 워커 1개로 직렬화하고,
+# 읽기는 WAL 스냅샷으로 쓰기와 동시에 돌 수 있으므로 별도 풀에서 실행합니다.
+_write_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="trainer-db-w")
+_read_executor = ThreadPoolExecutor(
+    max_workers=int(os.getenv("TRAINER_DB_READERS", "4")), thread_name_prefix="trainer-db-r"
+)
+
+
+async def run(func, *args, **kwargs):
+    """임의의 동기 DB 함수를 쓰기 전용 스레드에서 실행하고 결과를 기다립니다."""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_write_executor, functools.partial(func, *args, **kwargs))
+
+
+async def run_read(func, *args, **kwargs):
+    """읽기 전용 DB 함수를 읽기 풀에서 실행합니다. 쓰기 작업 뒤에 줄 서지 않습니다."""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_read_executor, functools.partial(func, *args, **kwargs))
+
+
+# 주간 체중 DM 슬롯 길이(분). weight_prompt_task 주기로 씁니다.
+PROMPT_SLOT_MINUTES = db.PROMPT_SLOT_MINUTES
+
+
+# SQL 문장별 시간/행 수 계측 (TRAINER_SQL_METRICS=0 이면 끔)
+if os.getenv("TRAINER_SQL_METRICS", "1") != "0":
+    db.set_cursor_factory(metrics.TimedCursor)
+
+
+# 실행 시간은 DB 스레드 안에서 잽니다. (스레드를 기다린 시간은 제외)
+def _wrap(func):
+    timed = metrics.timed("db", func.__name__)(func)
+
+    @functools.wraps(func)
+    async def wrapper(*args, **kwargs):
+        return await run(timed, *args, **kwargs)
+    return wrapper
+
+
+def _wrap_read(func):
+    timed = metrics.timed("db", func.__name__)(func)
+
+    @functools.wraps(func)
+    async def wrapper(*args, **kwargs):
+        return await run_read(timed, *args, **kwargs)
+    return wrapper
+
+
+def shutdown(wait: bool = True):
+    """봇 종료 시 대기 중인 DB 작업을 마저 처리하고 스레드/연결을 정리합니다."""
+    _write_executor.shutdown(wait=wait)
+    _read_executor.shutdown(wait=wait)
+    db.close_all()
+
+
+# db.py 공개 함수와 동일한 이름/인자의 코루틴 (읽기 함수는 읽기 풀에서 실행)
+set_weight_goal = _wrap(db.set_weight_goal)
+set_freq_goal = _wrap(db.set_freq_goal)
+delete_goal = _wrap(db.delete_goal)
+get_active_goals = _wrap_read(db.get_active_goals)
+get_goal_last_modified = _wrap_read(db.get_goal_last_modified)
+get_goal_history = _wrap_read(db.get_goal_history)
+update_current_weight = _wrap(db.update_current_weight)
+increment_exercise_log = _wrap(db.increment_exercise_log)
+increment_diet_log = _wrap(db.increment_diet_log)
+get_week_progress = _wrap_read(db.get_week_progress)
+get_week_progress_many = _wrap_read(db.get_week_progress_many)
+get_muscle_ranking_top5 = _wrap_read(db.get_muscle_ranking_top5)
+get_exercise_ranking_top5 = _wrap_read(db.get_exercise_ranking_top5)
+get_diet_ranking_top5 = _wrap_read(db.get_diet_ranking_top5)
+award_weekly_badges = _wrap(db.award_weekly_badges)
+award_monthly_trophy = _wrap(db.award_monthly_trophy)
+get_job_watermark = _wrap_read(db.get_job_watermark)
+run_job = _wrap(db.run_job)
+run_due_jobs = _wrap(db.run_due_jobs)
+flush_writes = _wrap(db.flush_writes)
+load_user_state = _wrap_read(db.load_user_state)
+record_weight = _wrap(db.record_weight)
+get_weight_prompt_targets = _wrap_read(db.get_weight_prompt_targets)
+set_prompt_schedule = _wrap(db.set_prompt_schedule)
+get_prompt_schedule = _wrap_read(db.get_prompt_schedule)
+claim_weight_prompts = _wrap(db.claim_weight_prompts)
+release_weight_prompts = _wrap(db.release_weight_prompts)
+get_ranking_scores = _wrap_read(db.get_ranking_scores)
+load_dm_contexts = _wrap_read(db.load_dm_contexts)
+save_dm_context = _wrap(db.save_dm_context)
+delete_dm_context = _wrap(db.delete_dm_context)
+get_dm_channels = _wrap_read(db.get_dm_channels)
+update_dm_channels = _wrap(db.update_dm_channels)
+load_voice_sessions = _wrap_read(db.load_voice_sessions)
+open_voice_session = _wrap(db.open_voice_session)
+close_voice_session = _wrap(db.close_voice_session)
+get_bot_state = _wrap_read(db.get_bot_state)
+set_bot_state = _wrap(db.set_bot_state)
+advance_bot_state = _wrap(db.advance_bot_state)
+apply_missed_diet_posts = _wrap(db.apply_missed_diet_posts)
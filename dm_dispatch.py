@@ -0,0 +1,199 @@
+# dm_dispatch.py
+# 여러 사용자에게 같은 DM 을 보내는 일괄 발송기. (주간 체중 DM 등)
+#   - 동시에 진행하는 발송 수를 concurrency 로 제한하고,
+#   - 전역/경로(route)별 토큰 버킷으로 초당 요청 수를 Discord 제한 아래로 유지하며,
+#   - 429·5xx·네트워크 오류는 지수 백오프로 재시도합니다.
+# DM 을 막아 둔 사용자(Forbidden)나 없는 사용자(NotFound)는 실패가 아니라 '건너뜀'으로 셉니다.
+# 이전에 저장해 둔 DM 채널 ID 가 있으면 fetch_user/create_dm 없이 바로 보내고(요청 1회),
+# 없으면 게이트웨이 캐시(get_user) → REST(fetch_user) 순으로 사용자를 찾아 채널을 엽니다.
+import asyncio
+import logging
+import random
+import time
+from typing import Awaitable, Callable, Iterable, Optional
+
+import aiohttp
+import discord
+
+log = logging.getLogger("trainer.dm")
+
+# 봇 전역 제한은 초당 50회. 여유를 두고 그보다 낮게 잡습니다.
+GLOBAL_RATE = 40.0
+# 경로별 초당 요청 수. discord.py 가 응답 헤더의 버킷 정보도 따르지만, 미리 속도를 맞춰 429 자체를 줄입니다.
+ROUTE_RATES = {"fetch_user": 20.0, "create_dm": 10.0, "send": 10.0}
+_PRIVATE = discord.ChannelType.private
+
+
+class TokenBucket:
+    """초당 rate 개씩 채워지는 토큰 버킷. acquire() 는 토큰이 생길 때까지 기다립니다."""
+
+    __slots__ = ("rate", "capacity", "_tokens", "_updated", "_lock")
+
+    def __init__(self, rate: float, capacity: Optional[float] = None):
+        self.rate = rate
+        self.capacity = capacity if capacity is not None else rate
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    async def acquire(self):
+        async with self._lock:
+            self._refill()
+            while self._tokens < 1:
+                await asyncio.sleep((1 - self._tokens) / self.rate)
+                self._refill()
+            self._tokens -= 1
+
+    def pause(self, seconds: float):
+        """429 응답의 Retry-After 만큼 버킷을 비워 그동안 아무도 보내지 못하게 합니다."""
+        self._refill()
+        self._tokens = min(self._tokens, -seconds * self.rate)
+
+
+class DispatchReport:
+    """일괄 발송 결과."""
+
+    __slots__ = ("total", "sent", "failed", "skipped", "retries", "duration", "cache_hits", "channel_updates",
+                 "failed_ids")
+
+    def __init__(self, total: int = 0):
+        self.total = total
+        self.sent = 0
+        self.failed = 0
+        self.skipped = 0
+        self.retries = 0
+        self.duration = 0.0
+        self.cache_hits = 0
+        # 발송 중 바뀐 DM 채널 캐시 {user_id: 새 channel_id 또는 None(무효화)} → db.update_dm_channels 로 저장
+        self.channel_updates: dict = {}
+        self.failed_ids: list = []   # 재시도까지 실패한 user_id (건너뜀은 포함하지 않음)
+
+    @property
+    def done(self) -> int:
+        return self.sent + self.failed + self.skipped
+
+    def __str__(self) -> str:
+        return (f"전송 {self.sent} / 실패 {self.failed} / 건너뜀 {self.skipped} "
+                f"(대상 {self.total}, 채널 캐시 {self.cache_hits}, 재시도 {self.retries}, {self.duration:.1f}s)")
+
+
+class _Skip(Exception):
+    """DM 을 보낼 수 없는 사용자. (DM 차단, 탈퇴 등)"""
+
+
+class DMDispatcher:
+    """user_id 목록에 같은 내용의 DM 을 보냅니다.
+
+    bot: discord.Client
+    concurrency: 동시에 진행하는 사용자 수
+    max_retries: 요청 하나당 재시도 횟수 (429, 5xx, 네트워크 오류)
+    """
+
+    def __init__(self, bot: discord.Client, concurrency: int = 8, max_retries: int = 4,
+                 global_rate: float = GLOBAL_RATE, route_rates: Optional[dict] = None,
+                 progress_every: float = 10.0):
+        self.bot = bot
+        self.concurrency = max(1, concurrency)
+        self.max_retries = max_retries
+        self.progress_every = progress_every
+        self._global = TokenBucket(global_rate)
+        self._routes = {name: TokenBucket(rate) for name, rate in {**ROUTE_RATES, **(route_rates or {})}.items()}
+
+    async def _request(self, route: str, report: DispatchReport, make_call: Callable[[], Awaitable]):
+        """토큰을 받아 요청을 보내고, 일시적 오류면 백오프 후 다시 시도합니다."""
+        bucket = self._routes[route]
+        for attempt in range(self.max_retries + 1):
+            await self._global.acquire()
+            await bucket.acquire()
+            try:
+                return await make_call()
+            except (discord.Forbidden, discord.NotFound) as e:
+                raise _Skip(f"{route}: {e.status}") from e
+            except discord.HTTPException as e:
+                if e.status == 429:
+                    headers = getattr(e.response, "headers", None) or {}
+                    retry_after = float(headers.get("Retry-After", 1.0))
+                    # 전역 제한이면 모든 요청을, 아니면 이 경로만 멈춥니다.
+                    (self._global if headers.get("X-RateLimit-Global") else bucket).pause(retry_after)
+                    delay = retry_after
+                elif e.status >= 500:
+                    delay = 2 ** attempt
+                else:
+                    raise
+            except (aiohttp.ClientError, asyncio.TimeoutError, OSError):
+                delay = 2 ** attempt
+            if attempt == self.max_retries:
+                raise
+            report.retries += 1
+            await asyncio.sleep(delay + random.uniform(0, 0.5))
+
+    async def _send_one(self, uid: str, content: str, report: DispatchReport, channel_id: Optional[int]):
+        if channel_id is not None:
+            report.cache_hits += 1
+            dm = self.bot.get_partial_messageable(channel_id, type=_PRIVATE)
+            try:
+                await self._request("send", report, lambda: dm.send(content))
+                return
+            except _Skip as e:
+                report.channel_updates[uid] = None
+                # 채널이 사라졌으면(NotFound) 새로 열어서 보내고, DM 차단(Forbidden)이면 그대로 건너뜀
+                if not isinstance(e.__cause__, discord.NotFound):
+                    raise
+            except Exception:
+                report.channel_updates[uid] = None
+                raise
+
+        user = self.bot.get_user(int(uid))
+        if user is None:
+            user = await self._request("fetch_user", report, lambda: self.bot.fetch_user(int(uid)))
+        dm = user.dm_channel
+        if dm is None:
+            dm = await self._request("create_dm", report, user.create_dm)
+        await self._request("send", report, lambda: dm.send(content))
+        report.channel_updates[uid] = dm.id
+
+    async def send_many(self, user_ids: Iterable[str], content: str,
+                        on_sent: Optional[Callable[[str], Awaitable]] = None,
+                        channels: Optional[dict] = None) -> DispatchReport:
+        """user_ids 모두에게 content 를 보내고 결과를 반환합니다.
+
+        on_sent: 전송 성공 직후 user_id 로 await 됩니다.
+        channels: 저장된 DM 채널 캐시 {user_id: channel_id}. 바뀐 항목은 report.channel_updates 에 담깁니다.
+        """
+        user_ids = list(user_ids)
+        channels = channels or {}
+        report = DispatchReport(len(user_ids))
+        queue = iter(user_ids)
+        started = time.monotonic()
+        last_log = started
+
+        async def worker():
+            nonlocal last_log
+            for uid in queue:   # 같은 이터레이터를 워커들이 나눠 씀
+                try:
+                    await self._send_one(uid, content, report, channels.get(uid))
+                except _Skip as e:
+                    report.skipped += 1
+                    log.debug("DM 건너뜀 %s (%s)", uid, e)
+                except Exception:
+                    report.failed += 1
+                    report.failed_ids.append(uid)
+                    log.warning("DM 실패 %s", uid, exc_info=True)
+                else:
+                    report.sent += 1
+                    if on_sent is not None:
+                        await on_sent(uid)
+                now = time.monotonic()
+                if now - last_log >= self.progress_every:
+                    last_log = now
+                    log.info("DM 발송 진행 %d/%d — 전송 %d, 실패 %d, 건너뜀 %d",
+                             report.done, report.total, report.sent, report.failed, report.skipped)
+
+        await asyncio.gather(*(worker() for _ in range(min(self.concurrency, len(user_ids)) or 1)))
+        report.duration = time.monotonic() - started
+        return report
@@ -0,0 +1,187 @@
+# lagwatch.py
+# 이벤트 루프 지연(lag) 측정과 루프를 막는 코드 추적기.
+#   - 루프 안의 틱 태스크가 interval 초마다 깨어나 "예정보다 얼마나 늦게 깨어났는지"를 잽니다.
+#     이 값은 metrics 에 ("loop", "lag") 히스토그램으로 쌓이므로 !stats 와 Prometheus 파일에서 보입니다.
+#   - 별도 감시 스레드는 틱이 threshold_ms 넘게 멈추면 sys._current_frames() 로 그 순간 루프 스레드의
+#     스택을 떠 둡니다. 콜백 하나가 루프를 막고 있는 동안이므로 스택에는 막고 있는 코루틴/함수가 그대로 보입니다.
+#   - 멈춤은 스택에서 가장 안쪽의 이 저장소 코드 위치(파일:줄 함수)로 묶어, 위치별 횟수·최대·누적 시간과
+#     마지막 스택을 보관합니다. (위치는 max_sites 개까지, 최근 멈춤은 recent 개까지)
+# 프로파일러 없이 운영 중에 느린 곳을 찾기 위한 것으로, 틱 하나와 잠깐씩 깨는 스레드 하나만 비용입니다.
+import asyncio
+import logging
+import os
+import sys
+import threading
+import time
+import traceback
+from collections import deque
+from typing import Optional
+
+import metrics
+
+log = logging.getLogger("trainer.lagwatch")
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+STACK_DEPTH = 12   # 보관·출력하는 스택 프레임 수 (안쪽부터)
+
+
+class Site:
+    """같은 코드 위치에서 일어난 멈춤 누적."""
+
+    __slots__ = ("location", "count", "total_ms", "max_ms", "stack", "task", "last_seen")
+
+    def __init__(self, location: str):
+        self.location = location
+        self.count = 0
+        self.total_ms = 0.0
+        self.max_ms = 0.0
+        self.stack: list[str] = []
+        self.task = ""
+        self.last_seen = 0.0
+
+
+def _short(path: str) -> str:
+    return os.path.relpath(path, ROOT) if path.startswith(ROOT) else path
+
+
+def _is_ours(path: str) -> bool:
+    return path.startswith(ROOT) and "site-packages" not in path
+
+
+class LoopWatchdog:
+    """threshold_ms 이상 루프를 막은 콜백의 스택을 잡아 위치별로 모읍니다.
+
+    start() 는 감시할 루프 안에서 호출해야 합니다. (루프 스레드 ID 를 거기서 얻음)
+    """
+
+    def __init__(self, threshold_ms: float = 200, interval: float = 0.1,
+                 max_sites: int = 50, recent: int = 20):
+        self.threshold = threshold_ms / 1000
+        self.interval = interval
+        self.max_sites = max_sites
+        self.sites: dict[str, Site] = {}
+        self.recent: deque = deque(maxlen=recent)   # (시각, 멈춘 ms, 위치)
+        self.max_lag_ms = 0.0
+        self._lock = threading.Lock()
+        self._beat = time.monotonic()   # 마지막 틱 시각 (감시 스레드가 읽음)
+        self._pending: Optional[Site] = None   # 스택은 잡았지만 아직 끝나지 않은 멈춤
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._loop_thread = 0
+        self._ticker: Optional[asyncio.Task] = None
+        self._thread: Optional[threading.Thread] = None
+        self._stop = threading.Event()
+
+    @property
+    def running(self) -> bool:
+        return self._ticker is not None and not self._ticker.done()
+
+    def start(self):
+        if self.running:
+            return
+        self._loop = asyncio.get_running_loop()
+        self._loop_thread = threading.get_ident()
+        self._beat = time.monotonic()
+        self._stop.clear()
+        self._ticker = self._loop.create_task(self._tick(), name="lagwatch-tick")
+        self._thread = threading.Thread(target=self._watch, name="lagwatch", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._ticker is not None:
+            self._ticker.cancel()
+            self._ticker = None
+
+    # -------------------------------------------------------------------------
+    # 루프 쪽: 지연 측정
+    # -------------------------------------------------------------------------
+    async def _tick(self):
+        while True:
+            expected = time.monotonic() + self.interval
+            await asyncio.sleep(self.interval)
+            now = time.monotonic()
+            lag_ms = max(0.0, (now - expected) * 1000)
+            metrics.observe("loop", "lag", lag_ms)
+            with self._lock:
+                self._beat = now
+                self.max_lag_ms = max(self.max_lag_ms, lag_ms)
+                site, self._pending = self._pending, None
+                if site is not None:
+                    # 스택을 잡은 멈춤이 끝남 → 실제로 막혀 있던 전체 시간으로 기록
+                    site.count += 1
+                    site.total_ms += lag_ms
+                    site.max_ms = max(site.max_ms, lag_ms)
+                    self.recent.append((time.time(), lag_ms, site.location))
+            if site is not None:
+                log.warning("이벤트 루프가 %.0fms 멈춤 — %s (%s)\n%s",
+                            lag_ms, site.location, site.task, "".join(site.stack))
+
+    # -------------------------------------------------------------------------
+    # 감시 스레드: 멈춤 중인 루프 스레드의 스택 캡처
+    # -------------------------------------------------------------------------
+    def _watch(self):
+        poll = max(self.threshold / 4, 0.01)
+        while not self._stop.wait(poll):
+            with self._lock:
+                stalled = self._pending is None and time.monotonic() - self._beat > self.threshold + self.interval
+            if stalled:
+                self._capture()
+
+    def _capture(self):
+        frame = sys._current_frames().get(self._loop_thread)
+        if frame is None:
+            return
+        stack = traceback.extract_stack(frame)
+        del frame
+        # 루프 내부(run_forever → Handle._run) 프레임은 빼고 실행 중인 콜백부터
+        for i in range(len(stack) - 1, -1, -1):
+            if stack[i].name == "_run" and stack[i].filename.endswith(os.path.join("asyncio", "events.py")):
+                stack = stack[i + 1:]
+                break
+        stack = stack[-STACK_DEPTH:]
+        if not stack:
+            return
+        inner = next((f for f in reversed(stack) if _is_ours(f.filename)), stack[-1])
+        location = f"{_short(inner.filename)}:{inner.lineno} {inner.name}"
+        task = asyncio.current_task(self._loop) if self._loop is not None else None
+        lines = [f'  {_short(f.filename)}:{f.lineno} in {f.name}\n' + (f"    {f.line}\n" if f.line else "")
+                 for f in stack]
+        with self._lock:
+            site = self.sites.get(location)
+            if site is None:
+                if len(self.sites) >= self.max_sites:
+                    # 가장 덜 중요한(누적 시간이 가장 작은) 위치를 버림
+                    del self.sites[min(self.sites.values(), key=lambda s: s.total_ms).location]
+                site = self.sites[location] = Site(location)
+            site.stack = lines
+            site.task = task.get_name() if task is not None else "-"
+            site.last_seen = time.time()
+            self._pending = site
+
+    # -------------------------------------------------------------------------
+    # 보고
+    # -------------------------------------------------------------------------
+    def reset(self):
+        with self._lock:
+            self.sites.clear()
+            self.recent.clear()
+            self.max_lag_ms = 0.0
+
+    def report(self, top: int = 5, stacks: bool = True) -> str:
+        """최대 멈춤 시간이 큰 위치 순으로 top 개와, 가장 나쁜 위치의 스택."""
+        with self._lock:
+            sites = sorted((s for s in self.sites.values() if s.count),
+                           key=lambda s: (-s.max_ms, -s.total_ms))[:top]
+            lines = [f"루프 멈춤 기준 {self.threshold * 1000:.0f}ms — 최대 지연 {self.max_lag_ms:.0f}ms, "
+                     f"기록된 위치 {len(self.sites)}곳"]
+            if not sites:
+                lines.append("기준을 넘은 멈춤 없음")
+                return "\n".join(lines)
+            lines.append(f"{'count':>6}{'max':>8}{'total':>9}  location (task)")
+            for s in sites:
+                lines.append(f"{s.count:>6}{s.max_ms:>8.0f}{s.total_ms:>9.0f}  {s.location} ({s.task})")
+            if stacks:
+                lines.append("")
+                lines.append(f"가장 오래 멈춘 곳의 스택: {sites[0].location}")
+                lines.extend(line.rstrip("\n") for line in sites[0].stack)
+        return "\n".join(lines)
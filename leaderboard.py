@@ -0,0 +1,50 @@
+# leaderboard.py
+# 근육랭킹용 증분 랭킹판.
+# 점수가 바뀔 때마다 정렬 위치만 고쳐 두기 때문에, 조회(top)는 전체 정렬 없이 앞의 k개만 잘라 읽습니다.
+from bisect import bisect_left, insort
+
+
+class Leaderboard:
+    """user_id → 점수를 내림차순으로 유지하는 랭킹판. (동점은 user_id 순)"""
+
+    __slots__ = ("_scores", "_order")
+
+    def __init__(self):
+        self._scores: dict[str, int] = {}
+        self._order: list[tuple[int, str]] = []  # (-점수, user_id) 오름차순 = 점수 내림차순
+
+    def __len__(self) -> int:
+        return len(self._scores)
+
+    def __contains__(self, user_id: str) -> bool:
+        return user_id in self._scores
+
+    def score(self, user_id: str) -> int:
+        return self._scores.get(user_id, 0)
+
+    def update(self, user_id: str, score: int):
+        """사용자 점수를 설정합니다. 점수가 같으면 아무것도 하지 않습니다."""
+        old = self._scores.get(user_id)
+        if old == score:
+            return
+        if old is not None:
+            del self._order[bisect_left(self._order, (-old, user_id))]
+        insort(self._order, (-score, user_id))
+        self._scores[user_id] = score
+
+    def add(self, user_id: str, delta: int = 1):
+        self.update(user_id, self._scores.get(user_id, 0) + delta)
+
+    def remove(self, user_id: str):
+        old = self._scores.pop(user_id, None)
+        if old is not None:
+            del self._order[bisect_left(self._order, (-old, user_id))]
+
+    def reset(self, score: int = 0):
+        """모든 사용자의 점수를 같은 값으로 되돌립니다. (주간 초기화 등)"""
+        self._scores = dict.fromkeys(self._scores, score)
+        self._order = sorted((-score, uid) for uid in self._scores)
+
+    def top(self, k: int = 5) -> list[tuple[str, int]]:
+        """상위 k명의 (user_id, 점수) 목록. O(k)."""
+        return [(uid, -neg) for neg, uid in self._order[:k]]
@@ -1,17 +1,29 @@
 import discord
 from discord.ext import commands, tasks
-from discord.ui import View, Button
-from datetime import datetime, timedelta, time
+from discord.ui import Button
+from datetime import date, datetime, timedelta
 from pytz import timezone
 import asyncio
+import logging
 import os
 
+import db_async
+import lagwatch
+import metrics
+from dm_dispatch import DMDispatcher
+from leaderboard import Leaderboard
+from metrics import View   # 버튼 콜백 지연을 자동 계측하는 discord.ui.View
+import replay
+from store import DMContextStore, UserState, UserStore, week_bounds
+from voice import VoiceTracker
+
 # -----------------------------------------------------------------------------
 # 환경 변수 로드 및 봇 초기화
 # -----------------------------------------------------------------------------
 from dotenv import load_dotenv
 load_dotenv()
 TOKEN = os.getenv("DISCORD_TOKEN")
+log = logging.getLogger("trainer")
 
 intents = discord.Intents.default()
 intents.message_content = True
@@ -53,49 +65,75 @@ def format_footer(user: discord.User) -> dict:
     }
 
 # -----------------------------------------------------------------------------
-# 전역: 사용자별 목표 & 진행 로그 저장소 (데모용, 실제 서비스 시 DB 사용 권장)
-# -----------------------------------------------------------------------------
-# user_goals 구조 예시:
-# user_goals = {
-#   "user_id_str": {
-#       "weight_goal": {
-#           "weeks": int,
-#           "start_weight": float,
-#           "target_weight": float,
-#           "achieved": bool,
-#           "progress_pct": int
-#       },
-#       "frequency_goal": {
-#           "per_week": int,
-#           "achieved_this_week": int
-#       },
-#       "diet_goal": {
-#           "per_week": int,
-#           "achieved_this_week": int
-#       },
-#       "badges": {
-#           "weekly_badges": int,
-#           "monthly_trophies": int,
-#           "bikinis": int
-#       },
-#       "weekly_log": { "월": bool, "화": bool, "수": bool, "목": bool, "금": bool },
-#       "voice_session": { "start": datetime or None }  # 음성 채널 운동 추적용
-#   }
-# }
-user_goals: dict[str, dict] = {}
-
-# 주간 체중 DM 흐름 관리용
-# weight_dm_context = {
-#   "user_id_str": {"stage": int, "weeks": int, "start_weight": float}
-# }
-weight_dm_context: dict[str, dict] = {}
+# 전역: 사용자별 목표 & 진행 로그 저장소 (trainer.db + LRU 캐시)
+# -----------------------------------------------------------------------------
+# await user_goals.get(user_id) 가 돌려주는 상태(store.UserState, __slots__ 객체):
+#   .weight_goal    : WeightGoal(weeks, start_weight, target_weight, achieved, progress_pct) 또는 None
+#   .frequency_goal : FreqGoal(per_week, achieved_this_week) 또는 None
+#   .diet_goal      : FreqGoal(per_week, achieved_this_week) 또는 None
+#   .weekly_badges / .bikinis / .monthly_trophies : int
+#   .exercise_days / .diet_days : 이번 주 요일별 인증 비트마스크 (월=bit0 ~ 일=bit6)
+#                                 → .done_on(요일), .done_weekdays() 로 읽습니다.
+#   .exercise_record / .diet_record : StreakRecord (연속·최장 연속 일수, 최고 주간 횟수, 누적 횟수)
+#                                     → 현재 연속 일수는 .streak_on(오늘) 로 읽습니다.
+# 상태 변경은 반드시 user_goals.set_*/record_* 메서드로 하세요. (DB 에 먼저 기록됨)
+
+# 근육랭킹: 배지/이번 주 운동/이번 주 식단/최장 연속 운동 점수를 증분 갱신하는 랭킹판
+# user_goals 가 상태를 바꿀 때마다 refresh_rankings 로 갱신되고, 시작 시 load_rankings()로 채웁니다.
+rankings = {"badges": Leaderboard(), "exercise": Leaderboard(), "diet": Leaderboard(), "streak": Leaderboard()}
+
+def refresh_rankings(user_id: str, data: UserState):
+    """사용자 상태(data)의 현재 값으로 랭킹판 4종을 갱신합니다."""
+    rankings["badges"].update(user_id, data.badge_total)
+    rankings["exercise"].update(user_id, data.frequency_goal.achieved_this_week if data.frequency_goal else 0)
+    rankings["diet"].update(user_id, data.diet_goal.achieved_this_week if data.diet_goal else 0)
+    rankings["streak"].update(user_id, data.exercise_record.longest_streak)
+
+async def load_rankings():
+    """DB 의 배지 합계, 이번 주 횟수, 최장 연속 운동 일수로 랭킹판을 다시 채웁니다. (봇 시작, 일괄 배지 지급 후)"""
+    week_start, _ = week_bounds(get_kst_now().date())
+    for board in rankings.values():
+        board.reset(0)
+    for uid, badge_total, exercise_count, diet_count, longest_streak in await db_async.get_ranking_scores(week_start):
+        rankings["badges"].update(uid, badge_total)
+        rankings["exercise"].update(uid, exercise_count)
+        rankings["diet"].update(uid, diet_count)
+        rankings["streak"].update(uid, longest_streak)
+
+user_goals = UserStore(
+    today_fn=lambda: get_kst_now().date(),
+    capacity=int(os.getenv("USER_CACHE_SIZE", "2048")),
+    on_change=refresh_rankings,
+)
+
+# 체중 목표 설정 DM 흐름 관리용
+# weight_dm_context["user_id_str"] = {"stage": int, "weeks": int, "start_weight": float}
+weight_dm_context = DMContextStore("weight_setup")
 
 # -----------------------------------------------------------------------------
 # 트래킹 채널 정보 (서버 환경에 맞게 변경하세요)
 # -----------------------------------------------------------------------------
-TRACKED_VOICE_CHANNELS = ["🏋🏻｜헬스장", "🏋🏻｜헬스장2"]  # 15분 이상 머무르면 운동 인증
+TRACKED_VOICE_CHANNELS = ["🏋🏻｜헬스장", "🏋🏻｜헬스장2"]  # 하루 누적 15분 이상 머무르면 운동 인증
+# 채널 ID 를 직접 지정하려면 TRACKED_VOICE_CHANNEL_IDS="123,456" (없으면 봇 시작 시 위 이름으로 찾음)
+TRACKED_VOICE_CHANNEL_IDS = {int(x) for x in os.getenv("TRACKED_VOICE_CHANNEL_IDS", "").split(",") if x.strip()}
 FORUM_CHANNEL_ID = 1379409429597786112  # “식단인증” 포럼 채널 ID 
 
+# 음성 채널 세션 엔진 (열린 세션과 날짜별 누적 시간은 DB 에 저장)
+voice_tracker = VoiceTracker(
+    now_fn=get_kst_now,
+    on_credit=lambda uid, day, event_id: user_goals.record_exercise(uid, day, event_id),   # 목표가 있을 때만, 하루 1회
+    channel_ids=TRACKED_VOICE_CHANNEL_IDS,
+)
+
+def resolve_voice_channels():
+    """TRACKED_VOICE_CHANNEL_IDS 가 비어 있으면 서버의 음성 채널 중 이름이 일치하는 채널 ID 를 찾아 씁니다."""
+    if TRACKED_VOICE_CHANNEL_IDS:
+        return
+    for guild in bot.guilds:
+        for channel in guild.voice_channels:
+            if channel.name in TRACKED_VOICE_CHANNELS:
+                voice_tracker.channel_ids.add(channel.id)
+
 # -----------------------------------------------------------------------------
 # 1) 메인 메뉴: !쌤 커맨드 → 인삿말 + 프로필 이미지 임베드 + 세 가지 버튼
 # -----------------------------------------------------------------------------
@@ -127,11 +165,8 @@ class MainMenuView(View):
         user_id = str(interaction.user.id)
         footer = format_footer(interaction.user)
 
-        if user_id not in user_goals or (
-            "weight_goal" not in user_goals[user_id]
-            and "frequency_goal" not in user_goals[user_id]
-            and "diet_goal" not in user_goals[user_id]
-        ):
+        data = await user_goals.get(user_id)
+        if not data.has_goal:
             embed = discord.Embed(
                 title="📊 기록 확인",
                 description="아직 목표를 설정하지 않으셨습니다. 먼저 **목표설정**을 해주세요! 🐹",
@@ -140,15 +175,14 @@ class MainMenuView(View):
             embed.set_footer(text=footer["text"], icon_url=footer["icon_url"])
             return await interaction.response.edit_message(embed=embed, view=MainMenuView())
 
-        data = user_goals[user_id]
         embed = discord.Embed(title="📊 현재 진행 현황", color=discord.Color.green())
 
         # 1) ⚖️ 체중 감량 목표 현황
-        if "weight_goal" in data:
-            wg = data["weight_goal"]
-            total_weeks = wg["weeks"]
-            progress_pct = wg.get("progress_pct", 0)
-            bikini_badge = wg.get("achieved", False)
+        if data.weight_goal is not None:
+            wg = data.weight_goal
+            total_weeks = wg.weeks
+            progress_pct = wg.progress_pct
+            bikini_badge = wg.achieved
             embed.add_field(
                 name="⚖️ 체중 감량 목표",
                 value=(
@@ -162,11 +196,11 @@ class MainMenuView(View):
             embed.add_field(name="⚖️ 체중 감량 목표", value="설정되지 않음", inline=False)
 
         # 2) 🏋️‍♂️ 주당 운동 횟수 목표 현황
-        if "frequency_goal" in data:
-            fg = data["frequency_goal"]
-            per_week = fg["per_week"]
-            achieved = fg.get("achieved_this_week", 0)
-            remaining_days = max(0, 5 - sum(data.get("weekly_log", {}).values()))
+        if data.frequency_goal is not None:
+            fg = data.frequency_goal
+            per_week = fg.per_week
+            achieved = fg.achieved_this_week
+            remaining_days = max(0, 5 - data.done_weekdays())
             status = "⭕" if achieved >= per_week else "❌"
             embed.add_field(
                 name="🏋️‍♂️ 주당 운동 횟수 목표",
@@ -182,11 +216,11 @@ class MainMenuView(View):
             embed.add_field(name="🏋️‍♂️ 주당 운동 횟수 목표", value="설정되지 않음", inline=False)
 
         # 3) 🍎 주당 식단 인증 목표 현황
-        if "diet_goal" in data:
-            dg = data["diet_goal"]
-            per_week = dg["per_week"]
-            achieved = dg.get("achieved_this_week", 0)
-            remaining_days = max(0, 5 - sum(data.get("weekly_log", {}).values()))
+        if data.diet_goal is not None:
+            dg = data.diet_goal
+            per_week = dg.per_week
+            achieved = dg.achieved_this_week
+            remaining_days = max(0, 5 - data.done_weekdays())
             status = "⭕" if achieved >= per_week else "❌"
             embed.add_field(
                 name="🍎 주당 식단 인증 목표",
@@ -202,23 +236,32 @@ class MainMenuView(View):
             embed.add_field(name="🍎 주당 식단 인증 목표", value="설정되지 않음", inline=False)
 
         # 4) 📅 이번주 월~금 진행현황
-        if "weekly_log" in data:
-            wl = data["weekly_log"]
-            weekday_names = ["월", "화", "수", "목", "금"]
-            symbols = [("⭕" if wl.get(day, False) else "❌") for day in weekday_names]
-            text = "\n".join([f"• {d}: {s}" for d, s in zip(weekday_names, symbols)])
-            embed.add_field(name="📅 이번주 진행현황 (월~금)", value=text, inline=False)
-        else:
-            embed.add_field(name="📅 이번주 진행현황 (월~금)", value="기록 없음", inline=False)
+        weekday_names = ["월", "화", "수", "목", "금"]
+        symbols = [("⭕" if data.done_on(i) else "❌") for i in range(5)]
+        text = "\n".join([f"• {d}: {s}" for d, s in zip(weekday_names, symbols)])
+        embed.add_field(name="📅 이번주 진행현황 (월~금)", value=text, inline=False)
+
+        # 5) 🔥 연속 기록 / 개인 기록 (user_records 를 캐시에서 읽음)
+        today = get_kst_now().date()
+        lines = []
+        for label, rec in (("운동", data.exercise_record), ("식단", data.diet_record)):
+            if rec.last_day is None:
+                lines.append(f"• {label}: 아직 기록 없음")
+                continue
+            best_week = date.fromordinal(rec.best_week_start).strftime("%m/%d") if rec.best_week_start else "-"
+            lines.append(
+                f"• {label}: 현재 {rec.streak_on(today)}일 연속 / 최장 {rec.longest_streak}일\n"
+                f"  최고 주간 {rec.best_week}회({best_week} 주) / 누적 {rec.total}회"
+            )
+        embed.add_field(name="🔥 연속 기록 · 개인 기록", value="\n".join(lines), inline=False)
 
-        # 5) 🎗️ 배지 현황
-        badges = data.get("badges", {"weekly_badges": 0, "bikinis": 0, "monthly_trophies": 0})
+        # 6) 🎗️ 배지 현황
         embed.add_field(
             name="🎗️ 배지 현황",
             value=(
-                f"• 훈장(주간 달성): {badges['weekly_badges']}개\n"
-                f"• 비키니(체중 달성): {badges['bikinis']}개\n"
-                f"• 트로피(월간 완주): {badges['monthly_trophies']}개"
+                f"• 훈장(주간 달성): {data.weekly_badges}개\n"
+                f"• 비키니(체중 달성): {data.bikinis}개\n"
+                f"• 트로피(월간 완주): {data.monthly_trophies}개"
             ),
             inline=False
         )
@@ -228,36 +271,19 @@ class MainMenuView(View):
 
     @discord.ui.button(label="💪🏻 근육랭킹", style=discord.ButtonStyle.secondary, custom_id="muscle_ranking")
     async def on_muscle_ranking(self, interaction: discord.Interaction, button: discord.ui.Button):
-        """근육랭킹 버튼 클릭 시: 배지/운동/식단 순위 임베드 표시"""
+        """근육랭킹 버튼 클릭 시: 배지/운동/식단/연속 기록 순위 임베드 표시"""
         footer = format_footer(interaction.user)
 
-        ranking_data = []
-        for uid, data in user_goals.items():
-            # 길드 내 Member 객체 시도
-            if interaction.guild:
-                member_obj = interaction.guild.get_member(int(uid))
-                name = member_obj.display_name if member_obj else f"사용자({uid})"
-            else:
-                name = f"사용자({uid})"
-
-            badges = data.get("badges", {"weekly_badges": 0, "bikinis": 0, "monthly_trophies": 0})
-            exercise_count = data.get("frequency_goal", {}).get("achieved_this_week", 0)
-            diet_count = data.get("diet_goal", {}).get("achieved_this_week", 0)
-            total_badges = badges["weekly_badges"] + badges["bikinis"] + badges["monthly_trophies"]
-
-            ranking_data.append({
-                "name": name,
-                "badges": total_badges,
-                "exercise": exercise_count,
-                "diet": diet_count
-            })
-
-        # 배지 Top 5
-        top_badges = sorted(ranking_data, key=lambda x: x["badges"], reverse=True)[:5]
-        # 운동 Top 5
-        top_exercise = sorted(ranking_data, key=lambda x: x["exercise"], reverse=True)[:5]
-        # 식단 Top 5
-        top_diet = sorted(ranking_data, key=lambda x: x["diet"], reverse=True)[:5]
+        def display_name(uid: str) -> str:
+            # 화면에 표시되는 상위 5명만 이름을 조회
+            member_obj = interaction.guild.get_member(int(uid)) if interaction.guild else None
+            return member_obj.display_name if member_obj else f"사용자({uid})"
+
+        # 배지 / 운동 / 식단 / 연속 기록 Top 5 (랭킹판에서 앞의 5명만 읽음)
+        top_badges = [{"name": display_name(uid), "badges": score} for uid, score in rankings["badges"].top(5)]
+        top_exercise = [{"name": display_name(uid), "exercise": score} for uid, score in rankings["exercise"].top(5)]
+        top_diet = [{"name": display_name(uid), "diet": score} for uid, score in rankings["diet"].top(5)]
+        top_streak = [{"name": display_name(uid), "streak": score} for uid, score in rankings["streak"].top(5) if score]
 
         embed = discord.Embed(title="💪🏻 근육랭킹", color=discord.Color.purple())
 
@@ -279,6 +305,12 @@ class MainMenuView(View):
         ) or "식단 데이터가 없습니다."
         embed.add_field(name="🥗 이번 주 식단 Top 5", value=description_dt, inline=False)
 
+        description_st = "\n".join(
+            [f"{i+1}위 📆 **{entry['name']}** — {entry['streak']}일 연속"
+             for i, entry in enumerate(top_streak)]
+        ) or "연속 기록 데이터가 없습니다."
+        embed.add_field(name="📆 최장 연속 운동 Top 5", value=description_st, inline=False)
+
         embed.set_footer(text=footer["text"], icon_url=footer["icon_url"])
         await interaction.response.edit_message(embed=embed, view=MainMenuView())
 
@@ -357,16 +389,9 @@ class ExerciseGoalView(View):
     async def on_weight_loss_goal(self, interaction: discord.Interaction, button: discord.ui.Button):
         """체중 감량 목표 설정 → DM으로 3단계 입력 요청"""
         user_id = str(interaction.user.id)
-        if user_id not in user_goals:
-            # 최초 구조 초기화
-            user_goals[user_id] = {
-                "badges": {"weekly_badges": 0, "bikinis": 0, "monthly_trophies": 0},
-                "weekly_log": {},
-                "voice_session": {}
-            }
 
         # DM 컨텍스트 초기화
-        weight_dm_context[user_id] = {"stage": 1}
+        await weight_dm_context.set(user_id, {"stage": 1})
         await interaction.response.send_message(
             content="✅ DM으로 **체중 감량 목표** 정보를 요청드릴게요! DM을 확인해주세요. 📨",
             ephemeral=True
@@ -384,14 +409,6 @@ class ExerciseGoalView(View):
     @discord.ui.button(label="🌐 주당 운동 횟수 목표", style=discord.ButtonStyle.primary, custom_id="frequency_goal")
     async def on_frequency_goal(self, interaction: discord.Interaction, button: discord.ui.Button):
         """주당 운동 횟수 목표 설정 → 숫자(1~7) 버튼 메뉴로 이동"""
-        user_id = str(interaction.user.id)
-        if user_id not in user_goals:
-            user_goals[user_id] = {
-                "badges": {"weekly_badges": 0, "bikinis": 0, "monthly_trophies": 0},
-                "weekly_log": {},
-                "voice_session": {}
-            }
-
         embed = discord.Embed(
             title="🌐 주당 운동 목표 설정",
             description="이번 주에 **몇 회** 운동할 계획인가요? (1~7)\n\n"
@@ -434,12 +451,7 @@ class FrequencyGoalView(View):
     async def handle_frequency_selection(self, interaction: discord.Interaction, times: int):
         """사용자가 숫자 버튼을 클릭했을 때, 주당 운동 목표 저장 및 안내"""
         user_id = str(interaction.user.id)
-        data = user_goals[user_id]
-        data["frequency_goal"] = {"per_week": times, "achieved_this_week": 0}
-        # 주간 로그 초기화(월~금)
-        data.setdefault("weekly_log", {})
-        for wd in ["월", "화", "수", "목", "금"]:
-            data["weekly_log"][wd] = False
+        await user_goals.set_frequency_goal(user_id, interaction.user.display_name, times)
 
         embed = discord.Embed(
             title="✅ 주당 운동 목표 설정 완료!",
@@ -506,19 +518,7 @@ class DietGoalView(View):
     async def handle_diet_selection(self, interaction: discord.Interaction, days: int):
         """사용자가 숫자 버튼을 클릭했을 때, 식단 목표 저장 및 안내"""
         user_id = str(interaction.user.id)
-        if user_id not in user_goals:
-            user_goals[user_id] = {
-                "badges": {"weekly_badges": 0, "bikinis": 0, "monthly_trophies": 0},
-                "weekly_log": {},
-                "voice_session": {}
-            }
-
-        data = user_goals[user_id]
-        data["diet_goal"] = {"per_week": days, "achieved_this_week": 0}
-        # 주간 로그 초기화(월~금)
-        data.setdefault("weekly_log", {})
-        for wd in ["월", "화", "수", "목", "금"]:
-            data["weekly_log"][wd] = False
+        await user_goals.set_diet_goal(user_id, interaction.user.display_name, days)
 
         embed = discord.Embed(
             title="✅ 식단 목표 설정 완료!",
@@ -599,65 +599,107 @@ async def 쌤(ctx: commands.Context):
 
 
 # -----------------------------------------------------------------------------
-# 4) on_ready 이벤트: 주간/월간 자동 루틴 스케줄링
+# 3-1) !알림시간 커맨드: 주간 체중 DM 요일/시각/시간대 설정
+#      !알림시간                       → 현재 설정 보기
+#      !알림시간 일 21:30              → 일요일 21:30 (시간대는 그대로)
+#      !알림시간 토 09:00 Europe/Paris → 시간대까지 변경
+#      !알림시간 기본                  → 기본값(일요일 밤, KST)으로 되돌리기
 # -----------------------------------------------------------------------------
-@bot.event
-async def on_ready():
-    print(f"✅ {bot.user} 로그인 완료 — {get_kst_now().strftime('%Y-%m-%d %H:%M:%S')}")
+PROMPT_WEEKDAYS = ["월", "화", "수", "목", "금", "토", "일"]
 
-    # 1) 매주 일요일 밤 23:00 KST → 주간 DM & 주간 배지 지급
-    if not weekly_task.is_running():
-        weekly_task.start()
+@bot.command(name="알림시간")
+async def 알림시간(ctx: commands.Context, day: str = None, hhmm: str = None, tz_name: str = None):
+    user_id = str(ctx.author.id)
+    if day == "기본":
+        await db_async.set_prompt_schedule(user_id, ctx.author.display_name)
+    elif day is not None:
+        try:
+            weekday = PROMPT_WEEKDAYS.index(day[0])
+            hour, minute = (int(x) for x in (hhmm or "").split(":"))
+            if not (0 <= hour < 24 and 0 <= minute < 60):
+                raise ValueError
+            if tz_name is not None:
+                timezone(tz_name)
+            else:
+                tz_name, _, _ = await db_async.get_prompt_schedule(user_id)
+        except Exception:
+            return await ctx.send("❌ `!알림시간 일 21:30` 또는 `!알림시간 일 21:30 Asia/Seoul` 형식으로 입력해주세요.")
+        await db_async.set_prompt_schedule(user_id, ctx.author.display_name, tz_name, weekday, hour * 60 + minute)
+
+    tz_name, weekday, minute = await db_async.get_prompt_schedule(user_id)
+    await ctx.send(f"⏰ 주간 체중 DM: 매주 **{PROMPT_WEEKDAYS[weekday]}요일 {minute // 60:02d}:{minute % 60:02d}** ({tz_name})")
+
+
+# -----------------------------------------------------------------------------
+# 3-2) !stats 커맨드 (관리자 전용): 핸들러·버튼·DB 함수·정기 작업 지연과 SQL 문장별 시간
+#      !stats         → 총 소요 시간 상위 10개
+#      !stats 20      → 상위 20개
+#      !stats reset   → 누적값 초기화
+#      !stats lag     → 이벤트 루프를 오래 막은 코드 위치와 스택 (LOOP_WATCHDOG_MS 를 지정한 경우)
+# METRICS_FILE 을 지정하면 같은 지표를 Prometheus 텍스트 형식으로 주기적으로 씁니다. (node_exporter textfile 등)
+# LOOP_WATCHDOG_MS 를 지정하면 루프 지연을 계속 재고, 그보다 오래 루프를 막은 콜백의 스택을 모읍니다.
+# -----------------------------------------------------------------------------
+METRICS_FILE = os.getenv("METRICS_FILE")
+METRICS_INTERVAL = int(os.getenv("METRICS_INTERVAL", "30"))   # 초
+LOOP_WATCHDOG_MS = float(os.getenv("LOOP_WATCHDOG_MS", "0"))   # 0 이면 끔
+loop_watchdog = lagwatch.LoopWatchdog(threshold_ms=LOOP_WATCHDOG_MS) if LOOP_WATCHDOG_MS > 0 else None
+
+@bot.command(name="stats")
+@commands.has_permissions(administrator=True)
+async def stats(ctx: commands.Context, arg: str = "10"):
+    if arg == "reset":
+        metrics.reset()
+        if loop_watchdog is not None:
+            loop_watchdog.reset()
+        return await ctx.send("🧹 계측값을 초기화했습니다.")
+    if arg == "lag":
+        if loop_watchdog is None:
+            return await ctx.send("❌ 루프 감시가 꺼져 있습니다. (LOOP_WATCHDOG_MS 설정)")
+        text = loop_watchdog.report()
+    else:
+        text = metrics.summary(int(arg) if arg.isdigit() else 10)
+    # 메시지 길이 제한(2000자) 안에서 줄 단위로 잘라 보냄
+    chunk = ""
+    for line in text.splitlines():
+        if len(chunk) + len(line) > 1900:
+            await ctx.send(f"```\n{chunk}```")
+            chunk = ""
+        chunk += line + "\n"
+    if chunk:
+        await ctx.send(f"```\n{chunk}```")
+
+@stats.error
+async def stats_error(ctx: commands.Context, error: commands.CommandError):
+    if isinstance(error, commands.MissingPermissions):
+        await ctx.send("❌ 관리자만 사용할 수 있습니다.")
+    else:
+        raise error
 
-    # 2) 매월 1일 00:10 KST → 월간 트로피 지급
-    if not monthly_task.is_running():
-        monthly_task.start()
+@tasks.loop(seconds=METRICS_INTERVAL)
+async def metrics_task():
+    await asyncio.to_thread(metrics.write_prometheus, METRICS_FILE)
 
 
 # -----------------------------------------------------------------------------
 # 5) 음성 채널 운동 인증: on_voice_state_update
 # -----------------------------------------------------------------------------
 @bot.event
+@metrics.timed("event")
 async def on_voice_state_update(member, before, after):
-    user_id = str(member.id)
-    # 1) 입장 감지 → 시작 시간 기록
-    if after.channel and after.channel.name in TRACKED_VOICE_CHANNELS:
-        # 음성 채널에 진입하면 시작 시간 기록
-        data = user_goals.setdefault(user_id, {
-            "badges": {"weekly_badges": 0, "bikinis": 0, "monthly_trophies": 0},
-            "weekly_log": {},
-            "voice_session": {}
-        })
-        data["voice_session"]["start"] = datetime.now(timezone("Asia/Seoul"))
-
-    # 2) 퇴장 감지 → 15분 이상 머물렀으면 운동 1회 기록
-    if before.channel and before.channel.name in TRACKED_VOICE_CHANNELS:
-        data = user_goals.setdefault(user_id, {
-            "badges": {"weekly_badges": 0, "bikinis": 0, "monthly_trophies": 0},
-            "weekly_log": {},
-            "voice_session": {}
-        })
-        start_time = data.get("voice_session", {}).get("start")
-        if start_time:
-            elapsed = (datetime.now(timezone("Asia/Seoul")) - start_time).total_seconds() / 60
-            # 15분 이상 머물렀다면
-            if elapsed >= 15:
-                # 주당 운동 횟수 목표가 설정되어 있으면 증가
-                if "frequency_goal" in data:
-                    data["frequency_goal"]["achieved_this_week"] = data["frequency_goal"].get("achieved_this_week", 0) + 1
-                    # 해당 요일 로그 기록 (월~금만)
-                    weekday = datetime.now(timezone("Asia/Seoul")).weekday()  # 0=월,4=금
-                    if 0 <= weekday <= 4:
-                        day_name = ["월","화","수","목","금"][weekday]
-                        data.setdefault("weekly_log", {})[day_name] = True
-            # 시작 시간 초기화
-            data["voice_session"]["start"] = None
+    # 입장/퇴장/이동만 처리 (음소거 등 같은 채널 안의 변경은 엔진에서 무시)
+    # 퇴장 시 그날 누적 15분을 처음 넘기면 운동 1회 기록
+    await voice_tracker.on_update(
+        str(member.id),
+        before.channel.id if before.channel else None,
+        after.channel.id if after.channel else None,
+    )
 
 
 # -----------------------------------------------------------------------------
 # 6) 포럼 채널 식단 인증: on_thread_create
 # -----------------------------------------------------------------------------
 @bot.event
+@metrics.timed("event")
 async def on_thread_create(thread: discord.Thread):
     """
     포럼에 새 스레드(포스트)가 생성되면 식단 인증으로 간주하고 카운트.
@@ -665,25 +707,17 @@ async def on_thread_create(thread: discord.Thread):
     channel = thread.parent  # 포럼 채널이 parent 객체
     if channel and channel.type == discord.ChannelType.forum and channel.id == FORUM_CHANNEL_ID:
         user_id = str(thread.owner_id)
-        data = user_goals.setdefault(user_id, {
-            "badges": {"weekly_badges": 0, "bikinis": 0, "monthly_trophies": 0},
-            "weekly_log": {},
-            "voice_session": {}
-        })
-        # 식단 목표가 있다면 증가
-        if "diet_goal" in data:
-            data["diet_goal"]["achieved_this_week"] = data["diet_goal"].get("achieved_this_week", 0) + 1
-            # 해당 요일이 월~금이면 로그 기록
-            weekday = datetime.now(timezone("Asia/Seoul")).weekday()
-            if 0 <= weekday <= 4:
-                day_name = ["월","화","수","목","금"][weekday]
-                data.setdefault("weekly_log", {})[day_name] = True
+        # 식단 목표가 있다면 증가 (요일 로그는 저장된 일별 기록에서 계산됨)
+        await user_goals.record_diet(user_id, str(thread.id))   # 같은 스레드는 한 번만
+        # 여기까지 처리했음을 기록 (재시작 시 이후 글만 복구)
+        await db_async.advance_bot_state(FORUM_WATERMARK_KEY, thread.id)
 
 
 # -----------------------------------------------------------------------------
 # 7) DM으로 체중 입력 처리: on_message (DM 채널에서)
 # -----------------------------------------------------------------------------
 @bot.event
+@metrics.timed("event")
 async def on_message(message: discord.Message):
     # 봇 본인 메시지는 무시
     if message.author.bot:
@@ -703,8 +737,7 @@ async def on_message(message: discord.Message):
                 # 숫자(주)만 입력받음
                 if content.isdigit() and int(content) > 0:
                     weeks = int(content)
-                    weight_dm_context[user_id]["weeks"] = weeks
-                    weight_dm_context[user_id]["stage"] = 2
+                    await weight_dm_context.set(user_id, {**ctx, "weeks": weeks, "stage": 2})
                     await message.channel.send("✅ 좋아요! 목표 기간을 **{}주**로 설정할게요.\n"
                                                "2️⃣ 이제 **현재 체중(kg)**을 알려주세요! (예: 62.5)".format(weeks))
                 else:
@@ -716,8 +749,7 @@ async def on_message(message: discord.Message):
                     current_w = float(content)
                     if current_w <= 0:
                         raise ValueError
-                    weight_dm_context[user_id]["start_weight"] = current_w
-                    weight_dm_context[user_id]["stage"] = 3
+                    await weight_dm_context.set(user_id, {**ctx, "start_weight": current_w, "stage": 3})
                     await message.channel.send("✅ 현재 체중을 **{}kg**으로 기록했어요.\n"
                                                "3️⃣ 마지막으로 **목표 체중(kg)**을 알려주세요! (예: 55.0)".format(current_w))
                 except:
@@ -729,38 +761,21 @@ async def on_message(message: discord.Message):
                     target_w = float(content)
                     if target_w <= 0:
                         raise ValueError
-                    ctx["target_weight"] = target_w
-                    # 모든 정보 입력 완료 → user_goals에 저장
+                    # 모든 정보 입력 완료 → user_goals에 저장 (진행률 0%, 달성 False)
                     weeks = ctx["weeks"]
                     start_w = ctx["start_weight"]
-                    # 진행률 0%, 달성 False
-                    user_goals.setdefault(user_id, {
-                        "badges": {"weekly_badges": 0, "bikinis": 0, "monthly_trophies": 0},
-                        "weekly_log": {},
-                        "voice_session": {}
-                    })
-                    user_goals[user_id]["weight_goal"] = {
-                        "weeks": weeks,
-                        "start_weight": start_w,
-                        "target_weight": target_w,
-                        "achieved": False,
-                        "progress_pct": 0
-                    }
-                    # 로그 초기화
-                    user_goals[user_id].setdefault("weekly_log", {})
-                    for wd in ["월", "화", "수", "목", "금"]:
-                        user_goals[user_id]["weekly_log"][wd] = False
+                    await user_goals.set_weight_goal(user_id, message.author.display_name, weeks, start_w, target_w)
 
                     await message.channel.send(
                         "✅ 체중 감량 목표가 설정되었습니다!\n"
                         f"• 기간: **{weeks}주**\n"
                         f"• 시작 체중: **{start_w}kg**\n"
                         f"• 목표 체중: **{target_w}kg**\n\n"
-                        "이제 매주 일요일 밤에 DM으로 현재 체중을 물어볼게요!\n"
+                        "이제 매주 일요일 밤에 DM으로 현재 체중을 물어볼게요! (`!알림시간`으로 요일·시각 변경 가능)\n"
                         "“진행률”만 관리되니, 실제 체중 숫자는 서버에 저장되지 않아요. 안심하세요! 😊"
                     )
                     # 컨텍스트 삭제
-                    del weight_dm_context[user_id]
+                    await weight_dm_context.delete(user_id)
 
                 except:
                     await message.channel.send("❌ 올바른 체중(예: 55.0) 형태로 입력해주세요.")
@@ -768,32 +783,11 @@ async def on_message(message: discord.Message):
         # ---------- 2) 주간 DM으로 체중 묻는 플로우 (매주) ----------
         # 사용자에게 “이번 주 체중을 입력해 주세요”로 묻고 응답 받기
         elif user_id in weekly_dm_context:
-            ctx = weekly_dm_context[user_id]
             # stage 1: 이번 주 체중 입력
             try:
                 new_w = float(message.content.strip())
-                start_w = user_goals[user_id]["weight_goal"]["start_weight"]
-                target_w = user_goals[user_id]["weight_goal"]["target_weight"]
-                # 진행률 계산
-                total_diff = start_w - target_w
-                if total_diff <= 0:
-                    pct = 100
-                else:
-                    progress = start_w - new_w
-                    pct = int((progress / total_diff) * 100)
-                    if pct < 0:
-                        pct = 0
-                    if pct > 100:
-                        pct = 100
-
-                user_goals[user_id]["weight_goal"]["progress_pct"] = pct
-                # 목표 달성 여부
-                if new_w <= target_w:
-                    user_goals[user_id]["weight_goal"]["achieved"] = True
-                    # 비키니 배지 1개 추가 (중복 방지: 이미 획득하지 않았다면)
-                    if not user_goals[user_id]["weight_goal"].get("achieved_before", False):
-                        user_goals[user_id]["weight_goal"]["achieved_before"] = True
-                        user_goals[user_id]["badges"]["bikinis"] += 1
+                # 진행률 계산 + 목표 첫 달성 시 비키니 배지 1개 (중복 지급 없음)
+                pct = await user_goals.record_weight(user_id, new_w)
 
                 await message.channel.send(
                     f"✅ 이번 주 체중을 기록했어요! 진행률: **{pct}%**입니다.\n"
@@ -804,7 +798,7 @@ async def on_message(message: discord.Message):
                 await message.channel.send("❌ 숫자(예: 60.3)만 입력해주세요. 다시 “이번 주 체중”을 입력해주세요.")
 
             # 한 주 DM 완료 → 컨텍스트 삭제
-            del weekly_dm_context[user_id]
+            await weekly_dm_context.delete(user_id)
 
         # DM 메시지 처리 끝 (서버 채팅 메시지는 아래로 계속)
         return
@@ -814,78 +808,65 @@ async def on_message(message: discord.Message):
 
 
 # -----------------------------------------------------------------------------
-# 8) 매주 일요일 밤 23:00 KST → 주간 DM으로 체중 묻고, 주간 목표 달성 시 ‘주간 배지’ 지급
+# 8) 주간 체중 DM (사용자별 시간대·알림 시각, 15분 슬롯)
 # -----------------------------------------------------------------------------
-weekly_dm_context: dict[str, dict] = {}  # {user_id: {"asked": True}}
+weekly_dm_context = DMContextStore("weekly_weight")  # {user_id: {"asked": True}}
+
+WEIGHT_PROMPT_TEXT = (
+    "⚖️ **이번 주 체중**을 입력해주세요! (숫자만, 예: 60.5)\n"
+    "__(입력하신 체중은 저장되지 않으며, 진행률만 업데이트됩니다.)_"
+)
 
-@tasks.loop(time=time(hour=23, minute=0, tzinfo=timezone("Asia/Seoul")))
-async def weekly_task():
+@tasks.loop(minutes=db_async.PROMPT_SLOT_MINUTES)
+@metrics.timed("task")
+async def weight_prompt_task():
     """
-    매주 일요일 밤 23:00 KST에 실행됩니다.
-    1) 모든 사용자에게 DM으로 “이번 주 체중을 입력해주세요” 요청
-    2) 주간 운동 + 식단 달성 여부를 체크하여 ‘주간 배지(weekly_badges)’를 지급
-    3) 주간 로그 초기화(다음 주를 위해) → 주간 운동/식단/로그 Reset
+    15분마다 실행됩니다.
+    체중 목표를 아직 달성하지 않은 사용자 중, 자기 알림 시각(기본: 일요일 21:00~23:45 중 한 슬롯)이 지났고
+    이번 주에 아직 DM 을 받지 않은 사용자에게만 “이번 주 체중을 입력해주세요” DM 을 보냅니다.
+    대상은 DB 에서 먼저 선점하므로 한 주에 한 번만 보내고, 전송에 실패한 사용자는 다음 슬롯에 다시 시도합니다.
     """
-    # 1) 체중 DM 전송
-    for uid, data in user_goals.items():
-        if "weight_goal" in data and not data["weight_goal"].get("achieved", False):
-            # 아직 체중 목표를 달성하지 않은 사용자에게만 DM
-            try:
-                user = await bot.fetch_user(int(uid))
-                dm = await user.create_dm()
-                await dm.send(
-                    "⚖️ **이번 주 체중**을 입력해주세요! (숫자만, 예: 60.5)\n"
-                    "__(입력하신 체중은 저장되지 않으며, 진행률만 업데이트됩니다.)_"
-                )
-                # 응답 받기 위해 컨텍스트 설정
-                weekly_dm_context[uid] = {"asked": True}
-            except:
-                # DM이 불가능하거나 오류 시 무시
-                continue
+    targets = await db_async.claim_weight_prompts()
+    if not targets:
+        return
+    log.info("주간 체중 DM 발송 시작: 대상 %d명", len(targets))
+    dispatcher = DMDispatcher(bot, concurrency=int(os.getenv("DM_CONCURRENCY", "8")))
+    report = await dispatcher.send_many(
+        targets,
+        WEIGHT_PROMPT_TEXT,
+        # 응답 받기 위해 컨텍스트 설정 (DM 이 불가능한 사용자는 건너뜀으로 집계)
+        on_sent=lambda uid: weekly_dm_context.set(uid, {"asked": True}),
+        channels=await db_async.get_dm_channels(targets),
+    )
+    # 새로 연 DM 채널은 저장하고, 보내기에 실패한 채널 캐시는 지웁니다.
+    await db_async.update_dm_channels(report.channel_updates)
+    await db_async.release_weight_prompts(report.failed_ids)
+    log.info("주간 체중 DM 발송 완료: %s", report)
 
-    # 2) 주간 목표 달성 여부 확인 → 주간 배지 지급
-    # 주간 배지 조건: “frequency_goal”과 “diet_goal” 모두 달성한 경우 (achieved_this_week >= per_week)
-    for uid, data in user_goals.items():
-        fg = data.get("frequency_goal", {})
-        dg = data.get("diet_goal", {})
-        if fg and dg:
-            if fg.get("achieved_this_week", 0) >= fg.get("per_week", 0) and \
-               dg.get("achieved_this_week", 0) >= dg.get("per_week", 0):
-                # 이미 주간 배지 받은 적이 없는 상태로 가정 (매주 발급됨)
-                data["badges"]["weekly_badges"] = data["badges"].get("weekly_badges", 0) + 1
-
-    # 3) 주간 기록 초기화 (다음 주를 위해)
-    for uid, data in user_goals.items():
-        # 운동/식단 달성 횟수 리셋
-        if "frequency_goal" in data:
-            data["frequency_goal"]["achieved_this_week"] = 0
-        if "diet_goal" in data:
-            data["diet_goal"]["achieved_this_week"] = 0
-        # 주간 로그(월~금) 리셋
-        if "weekly_log" in data:
-            for wd in ["월","화","수","목","금"]:
-                data["weekly_log"][wd] = False
-
-    # 다음주를 위해 task가 다시 대기
-    # (tasks.loop는 자동으로 다음 스케줄을 기다립니다)
-
-
-# -----------------------------------------------------------------------------
-# 9) 매월 1일 00:10 KST → 월간 트로피 지급 (한 달 동안 매주 배지를 얻은 사람에게)
-# -----------------------------------------------------------------------------
-@tasks.loop(time=time(hour=0, minute=10, tzinfo=timezone("Asia/Seoul")))
-async def monthly_task():
+
+# -----------------------------------------------------------------------------
+# 9) 주간 배지(월요일 00:05 KST) / 월간 트로피(1일 00:10 KST) 정기 작업
+# -----------------------------------------------------------------------------
+@tasks.loop(minutes=5)
+@metrics.timed("task")
+async def scheduler_task():
     """
-    매월 1일 00:10 KST에 실행됩니다.
-    한 달(즉 지난 달)에 얻은 주간 배지 개수가 **>= 4**(약 4주)라면 ‘월간 트로피’ 지급
-    지급 후, 해당 사용자의 주간 배지 수는 0으로 초기화합니다.
+    5분마다 실행됩니다. 실행할 때가 된 기간만 db 에서 처리합니다. (작업별 워터마크 기준)
+    1) 지난 주(월~일) 운동 + 식단 목표를 모두 달성한 사용자에게 ‘주간 배지(weekly_badges)’ 지급
+    2) 지난 달의 모든 주(월요일 시작 주)를 달성한 사용자에게 ‘월간 트로피’ 지급
+    봇이 꺼져 있어 놓친 기간은 다음 실행(재시작 직후 포함) 때 순서대로 따라잡습니다.
+    주간 횟수/요일 로그는 날짜별 기록에서 계산되므로 따로 초기화하지 않습니다.
     """
-    for uid, data in user_goals.items():
-        weekly_badges = data["badges"].get("weekly_badges", 0)
-        if weekly_badges >= 4:
-            data["badges"]["monthly_trophies"] = data["badges"].get("monthly_trophies", 0) + 1
-        # 한 달 단위 체크였으므로 주간 배지 수 초기화
-        data["badges"]["weekly_badges"] = 0
+    done = await db_async.run_due_jobs(get_kst_now())
+    if not done:
+        return
+    for job, period in done:
+        log.info("정기 작업 완료: %s %s", job, period)
+    user_goals.invalidate()
+    await load_rankings()
+    # 정산 직후 저널 재생 상태를 스냅샷으로 남겨 다음 재생이 이 지점부터 시작하게 함
+    seq = await db_async.run(replay.take_snapshot, get_kst_now().date())
+    log.info("저널 스냅샷 저장 (seq %d)", seq)
 
 
 # -----------------------------------------------------------------------------
@@ -893,20 +874,114 @@ async def monthly_task():
 #     → on_message(DM)에서 처리하도록 되어 있음 (위에서 구현됨)
 # -----------------------------------------------------------------------------
 
+# -----------------------------------------------------------------------------
+# 10-1) 봇이 꺼져 있던 동안 놓친 음성 입퇴장·식단 인증 글 복구 (on_ready 에서 실행)
+# -----------------------------------------------------------------------------
+LAST_SEEN_KEY = "last_seen"              # 봇이 마지막으로 살아 있던 시각 (KST)
+FORUM_WATERMARK_KEY = "forum_watermark"  # 마지막으로 처리한 식단 인증 스레드 ID
+
+@tasks.loop(minutes=1)
+@metrics.timed("task")
+async def heartbeat_task():
+    """1분마다 봇이 살아 있던 시각을 기록합니다. (재시작 시 꺼져 있던 동안 나간 사람의 음성 세션을 닫는 시각)"""
+    await db_async.set_bot_state(LAST_SEEN_KEY, get_kst_now().replace(tzinfo=None).isoformat())
+
+async def reconcile_voice():
+    """지금 트래킹 채널에 있는 사람 기준으로 음성 세션을 맞춥니다."""
+    last_seen = await db_async.get_bot_state(LAST_SEEN_KEY)
+    resolve_voice_channels()
+    await voice_tracker.load()
+    await voice_tracker.reconcile(
+        {
+            str(m.id): channel.id
+            for guild in bot.guilds for channel in guild.voice_channels
+            if channel.id in voice_tracker.channel_ids
+            for m in channel.members if not m.bot
+        },
+        left_at=datetime.fromisoformat(last_seen) if last_seen else None,
+    )
+
+async def _forum_threads_since(forum: discord.ForumChannel, since_id: int) -> list:
+    """since_id 이후에 생성된 포럼 스레드(활성 + 보관됨)를 ID 순으로. 두 목록은 동시에 가져옵니다."""
+    since = discord.utils.snowflake_time(since_id)
+
+    async def active():
+        return [t for t in await forum.guild.active_threads() if t.parent_id == forum.id]
+
+    async def archived():
+        found = []
+        # 보관 시각 내림차순으로 100개씩 커서 페이지를 넘깁니다.
+        # 워터마크보다 먼저 보관된 스레드는 그 전에 생성된 것이므로 거기서 멈춥니다.
+        async for t in forum.archived_threads(limit=None):
+            if t.archive_timestamp < since:
+                break
+            found.append(t)
+        return found
+
+    active_threads, archived_threads = await asyncio.gather(active(), archived())
+    threads = {t.id: t for t in active_threads + archived_threads if t.id > since_id}
+    return sorted(threads.values(), key=lambda t: t.id)
+
+async def reconcile_forum():
+    """워터마크 이후 생성된 식단 인증 글을 한 번에 반영합니다."""
+    forum = bot.get_channel(FORUM_CHANNEL_ID)
+    if forum is None:
+        return
+    watermark = await db_async.get_bot_state(FORUM_WATERMARK_KEY)
+    if watermark is None:
+        # 처음 실행: 예전 글은 소급하지 않고 지금부터 처리
+        await db_async.advance_bot_state(FORUM_WATERMARK_KEY, discord.utils.time_snowflake(discord.utils.utcnow()))
+        return
+    threads = await _forum_threads_since(forum, int(watermark))
+    if not threads:
+        return
+    kst = timezone("Asia/Seoul")
+    posts = [
+        (t.id, str(t.owner_id), (t.created_at or discord.utils.snowflake_time(t.id)).astimezone(kst).strftime("%Y-%m-%d"))
+        for t in threads
+    ]
+    applied = await db_async.apply_missed_diet_posts(posts, FORUM_WATERMARK_KEY, threads[-1].id)
+    for uid in applied:
+        user_goals.invalidate(uid)
+    if applied:
+        await load_rankings()
+    log.info("놓친 식단 인증 글 %d개 확인 (반영된 사용자 %d명, 이미 반영된 글은 제외)", len(threads), len(applied))
+
+
 # -----------------------------------------------------------------------------
 # 11) 봇 준비 완료 시 작업 스케줄링
 # -----------------------------------------------------------------------------
 @bot.event
 async def on_ready():
     print(f"✅ {bot.user} 로그인 완료 — {get_kst_now().strftime('%Y-%m-%d %H:%M:%S')}")
+    # 복구 작업이 루프를 막는 것도 잡히도록 가장 먼저 시작 (재연결 시에는 이미 실행 중)
+    if loop_watchdog is not None:
+        loop_watchdog.start()
+    # 저장된 DM 대화 상태와 랭킹판 복원
+    await weight_dm_context.load()
+    await weekly_dm_context.load()
+    await load_rankings()
+    # 꺼져 있던 동안 놓친 이벤트 복구
+    #  - 음성: 그동안 나간 사람은 마지막 생존 시각에 세션을 닫고, 새로 들어와 있는 사람은 세션을 엽니다.
+    #  - 포럼: 워터마크 이후 올라온 식단 인증 글을 한 번에 반영합니다.
+    await reconcile_voice()
+    try:
+        await reconcile_forum()
+    except discord.HTTPException:
+        log.exception("식단 인증 글 복구 실패")
     # 중복 실행 방지
-    if not weekly_task.is_running():
-        weekly_task.start()
-    if not monthly_task.is_running():
-        monthly_task.start()
+    if not heartbeat_task.is_running():
+        heartbeat_task.start()
+    if not scheduler_task.is_running():
+        scheduler_task.start()
+    if not weight_prompt_task.is_running():
+        weight_prompt_task.start()
+    if METRICS_FILE and not metrics_task.is_running():
+        metrics_task.start()
 
 
 # -----------------------------------------------------------------------------
 # 12) 봇 실행
 # -----------------------------------------------------------------------------
-bot.run(TOKEN)
+if __name__ == "__main__":   # import 만 할 때(벤치마크 등)는 접속하지 않음
+    bot.run(TOKEN, root_logger=True)   # trainer.* 로거도 discord 로그와 같은 형식으로 출력
@@ -0,0 +1,266 @@
+# metrics.py
+# 핫패스 계측: 이벤트 핸들러·버튼 콜백·DB 함수·정기 작업의 호출 수와 지연 히스토그램, SQL 문장별 시간과 행 수.
+#   - @timed("event") 처럼 감싸면 동기/비동기 함수 모두 호출 수, 오류 수, 지연 분포가 쌓입니다.
+#   - View 를 discord.ui.View 대신 상속하면 버튼 콜백이 자동으로 계측됩니다. (kind="button")
+#   - TimedCursor 를 db 의 커서 팩토리로 쓰면 SQL 문장별 실행 횟수·시간·행 수가 쌓입니다.
+# 결과는 summary()(관리자 !stats 명령)와 write_prometheus()(node_exporter textfile 형식 파일)로 봅니다.
+# DB 함수는 실행 스레드에서 불리므로 모든 기록은 잠금 하나로 보호합니다.
+import asyncio
+import functools
+import os
+import re
+import sqlite3
+import threading
+import time
+from typing import Optional
+
+import discord
+
+# 지연 히스토그램 버킷 상한(ms). 마지막은 +Inf
+BUCKETS_MS = (0.5, 1, 2.5, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000)
+
+_lock = threading.Lock()
+
+
+class Histogram:
+    __slots__ = ("counts", "total_ms", "max_ms", "calls", "errors")
+
+    def __init__(self):
+        self.counts = [0] * (len(BUCKETS_MS) + 1)
+        self.total_ms = 0.0
+        self.max_ms = 0.0
+        self.calls = 0
+        self.errors = 0
+
+    def observe(self, ms: float, error: bool = False):
+        i = 0
+        while i < len(BUCKETS_MS) and ms > BUCKETS_MS[i]:
+            i += 1
+        self.counts[i] += 1
+        self.total_ms += ms
+        self.calls += 1
+        if ms > self.max_ms:
+            self.max_ms = ms
+        if error:
+            self.errors += 1
+
+    def quantile(self, q: float) -> float:
+        """버킷 상한으로 어림한 q 분위수(ms). 마지막 버킷이면 최댓값."""
+        if not self.calls:
+            return 0.0
+        rank = q * self.calls
+        seen = 0
+        for i, n in enumerate(self.counts):
+            seen += n
+            if seen >= rank:
+                return min(BUCKETS_MS[i], self.max_ms) if i < len(BUCKETS_MS) else self.max_ms
+        return self.max_ms
+
+
+class SqlStat:
+    __slots__ = ("calls", "total_ms", "max_ms", "rows")
+
+    def __init__(self):
+        self.calls = 0
+        self.total_ms = 0.0
+        self.max_ms = 0.0
+        self.rows = 0
+
+
+handlers: dict[tuple[str, str], Histogram] = {}   # (kind, name) → 지연 분포
+sql: dict[str, SqlStat] = {}                       # 정규화한 SQL → 누적
+_sql_keys: dict[str, str] = {}                     # 원문 SQL → 정규화한 키 (같은 문자열을 다시 정규화하지 않음)
+started_at = time.time()
+
+
+def observe(kind: str, name: str, ms: float, error: bool = False):
+    with _lock:
+        hist = handlers.get((kind, name))
+        if hist is None:
+            hist = handlers[(kind, name)] = Histogram()
+        hist.observe(ms, error)
+
+
+def timed(kind: str, name: Optional[str] = None):
+    """함수 실행 시간을 (kind, name 또는 함수 이름) 으로 기록하는 데코레이터. 코루틴 함수도 됩니다."""
+    def decorator(func):
+        key = name or func.__name__
+        if asyncio.iscoroutinefunction(func):
+            @functools.wraps(func)
+            async def async_wrapper(*args, **kwargs):
+                t0 = time.perf_counter()
+                error = True
+                try:
+                    result = await func(*args, **kwargs)
+                    error = False
+                    return result
+                finally:
+                    observe(kind, key, (time.perf_counter() - t0) * 1000, error)
+            return async_wrapper
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            t0 = time.perf_counter()
+            error = True
+            try:
+                result = func(*args, **kwargs)
+                error = False
+                return result
+            finally:
+                observe(kind, key, (time.perf_counter() - t0) * 1000, error)
+        return wrapper
+    return decorator
+
+
+class View(discord.ui.View):
+    """버튼 콜백을 자동으로 계측하는 View. ('클래스명.메서드명' 으로 기록)"""
+
+    def __init_subclass__(cls, **kwargs):
+        for attr, member in list(cls.__dict__.items()):
+            if hasattr(member, "__discord_ui_model_type__"):
+                # functools.wraps 가 __dict__(버튼 정의)를 복사하므로 discord.py 가 그대로 버튼으로 인식
+                setattr(cls, attr, timed("button", f"{cls.__name__}.{attr}")(member))
+        super().__init_subclass__(**kwargs)
+
+
+# -----------------------------------------------------------------------------
+# SQL 계측
+# -----------------------------------------------------------------------------
+_WS = re.compile(r"\s+")
+
+
+def _sql_key(statement: str) -> str:
+    key = _sql_keys.get(statement)
+    if key is None:
+        key = _WS.sub(" ", statement).strip()[:160]
+        if len(_sql_keys) < 10000:   # 동적으로 만든 SQL 이 끝없이 늘어나도 메모리는 제한
+            _sql_keys[statement] = key
+    return key
+
+
+class TimedCursor(sqlite3.Cursor):
+    """execute/executemany 와 fetch 시간을 문장별로 누적하는 커서. (db.set_cursor_factory 로 사용)
+    행 수는 INSERT/UPDATE/DELETE 는 rowcount, SELECT 는 가져온 행 수입니다."""
+
+    _stat: Optional[SqlStat] = None
+    _elapsed = 0.0
+
+    def _record(self, statement: str, ms: float, rows: int):
+        key = _sql_key(statement)
+        with _lock:
+            stat = sql.get(key)
+            if stat is None:
+                stat = sql[key] = SqlStat()
+            stat.calls += 1
+            stat.total_ms += ms
+            stat.max_ms = max(stat.max_ms, ms)
+            stat.rows += max(rows, 0)
+        self._stat = stat
+        self._elapsed = ms
+
+    def _fetched(self, ms: float, rows: int):
+        stat = self._stat
+        if stat is not None:
+            self._elapsed += ms   # 최댓값도 실행+fetch 기준
+            with _lock:
+                stat.total_ms += ms
+                stat.max_ms = max(stat.max_ms, self._elapsed)
+                stat.rows += rows
+
+    def execute(self, statement, parameters=()):
+        t0 = time.perf_counter()
+        try:
+            return super().execute(statement, parameters)
+        finally:
+            self._record(statement, (time.perf_counter() - t0) * 1000, self.rowcount)
+
+    def executemany(self, statement, seq_of_parameters):
+        t0 = time.perf_counter()
+        try:
+            return super().executemany(statement, seq_of_parameters)
+        finally:
+            self._record(statement, (time.perf_counter() - t0) * 1000, self.rowcount)
+
+    def fetchone(self):
+        t0 = time.perf_counter()
+        row = super().fetchone()
+        self._fetched((time.perf_counter() - t0) * 1000, row is not None)
+        return row
+
+    def fetchall(self):
+        t0 = time.perf_counter()
+        rows = super().fetchall()
+        self._fetched((time.perf_counter() - t0) * 1000, len(rows))
+        return rows
+
+
+# -----------------------------------------------------------------------------
+# 출력
+# -----------------------------------------------------------------------------
+def reset():
+    with _lock:
+        handlers.clear()
+        sql.clear()
+
+
+def summary(top: int = 10) -> str:
+    """총 소요 시간이 큰 순으로 핸들러/SQL 상위 top 개를 표로 만듭니다. (!stats 용)"""
+    with _lock:
+        rows = sorted(handlers.items(), key=lambda kv: -kv[1].total_ms)[:top]
+        lines = [f"가동 {int(time.time() - started_at) // 60}분 — 총 시간 상위 핸들러",
+                 f"{'kind':<7}{'name':<34}{'calls':>7}{'err':>5}{'p50':>8}{'p99':>8}{'max':>9}"]
+        for (kind, name), h in rows:
+            lines.append(f"{kind:<7}{name[:33]:<34}{h.calls:>7}{h.errors:>5}"
+                         f"{h.quantile(0.5):>8.1f}{h.quantile(0.99):>8.1f}{h.max_ms:>9.1f}")
+        stmts = sorted(sql.items(), key=lambda kv: -kv[1].total_ms)[:top]
+        if stmts:
+            lines.append("")
+            lines.append("총 시간 상위 SQL (ms)")
+            lines.append(f"{'calls':>7}{'total':>10}{'avg':>8}{'max':>8}{'rows':>9}  statement")
+            for key, s in stmts:
+                lines.append(f"{s.calls:>7}{s.total_ms:>10.1f}{s.total_ms / s.calls:>8.2f}{s.max_ms:>8.1f}"
+                             f"{s.rows:>9}  {key[:60]}")
+    return "\n".join(lines)
+
+
+def _label(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", " ")
+
+
+def prometheus_text() -> str:
+    """Prometheus 텍스트 형식 (시간 단위는 초)."""
+    out = [
+        "# HELP trainer_handler_latency_seconds 핸들러/버튼/DB 함수/정기 작업 실행 시간",
+        "# TYPE trainer_handler_latency_seconds histogram",
+    ]
+    with _lock:
+        for (kind, name), h in sorted(handlers.items()):
+            labels = f'kind="{_label(kind)}",name="{_label(name)}"'
+            cumulative = 0
+            for bound, n in zip(BUCKETS_MS, h.counts):
+                cumulative += n
+                out.append(f'trainer_handler_latency_seconds_bucket{{{labels},le="{bound / 1000:g}"}} {cumulative}')
+            out.append(f'trainer_handler_latency_seconds_bucket{{{labels},le="+Inf"}} {h.calls}')
+            out.append(f"trainer_handler_latency_seconds_sum{{{labels}}} {h.total_ms / 1000:.6f}")
+            out.append(f"trainer_handler_latency_seconds_count{{{labels}}} {h.calls}")
+        out.append("# TYPE trainer_handler_errors_total counter")
+        for (kind, name), h in sorted(handlers.items()):
+            out.append(f'trainer_handler_errors_total{{kind="{_label(kind)}",name="{_label(name)}"}} {h.errors}')
+        for metric, help_text, value in (
+            ("trainer_sql_statements_total", "SQL 실행 횟수", lambda s: s.calls),
+            ("trainer_sql_seconds_total", "SQL 실행+fetch 누적 시간", lambda s: f"{s.total_ms / 1000:.6f}"),
+            ("trainer_sql_rows_total", "SQL 이 바꾸거나 읽은 행 수", lambda s: s.rows),
+        ):
+            out.append(f"# HELP {metric} {help_text}")
+            out.append(f"# TYPE {metric} counter")
+            for key, s in sorted(sql.items()):
+                out.append(f'{metric}{{statement="{_label(key)}"}} {value(s)}')
+    return "\n".join(out) + "\n"
+
+
+def write_prometheus(path: str):
+    """path 에 원자적으로(임시 파일 → rename) 씁니다. 스크레이퍼가 쓰다 만 파일을 읽지 않도록."""
+    tmp = f"{path}.{os.getpid()}.tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        f.write(prometheus_text())
+    os.replace(tmp, path)
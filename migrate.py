@@ -0,0 +1,55 @@
+# migrate.py
+# trainer.db 스키마 마이그레이션 도구. (봇은 시작할 때 init_db 에서 밀린 마이그레이션을 자동으로 적용합니다)
+#   python migrate.py --status               # 현재 버전과 남은 마이그레이션, 테이블별 남은 복사 행 수
+#   python migrate.py --prepare              # 기존 봇을 띄운 채 다음 버전의 새 테이블 복사까지만 (교체는 재시작 때)
+#   python migrate.py                        # 밀린 마이그레이션 전부 적용 (교체까지)
+# 큰 DB 는 --prepare 를 먼저 돌려 두면 새 버전으로 재시작할 때 테이블 교체만 남아 멈춤이 짧습니다.
+# --pause 로 배치 사이에 쉬게 하면 복사 중에도 봇의 쓰기가 밀리지 않습니다.
+import argparse
+import os
+import sys
+import time
+
+
+def main():
+    parser = argparse.ArgumentParser(description="trainer.db 스키마 마이그레이션")
+    parser.add_argument("--db", help="DB 파일 (기본: TRAINER_DB 또는 trainer.db)")
+    parser.add_argument("--status", action="store_true", help="남은 마이그레이션만 출력")
+    parser.add_argument("--prepare", action="store_true", help="다음 버전의 복사까지만 하고 교체는 하지 않음")
+    parser.add_argument("--batch", type=int, default=5000, help="트랜잭션 하나에 복사할 행 수")
+    parser.add_argument("--pause", type=float, default=0.05, help="배치 사이에 쉬는 초")
+    args = parser.parse_args()
+
+    # db 는 import 시 init_db 로 마이그레이션까지 하므로, 그 전에 대상 파일을 정하고 자동 적용을 끔
+    if args.db:
+        os.environ["TRAINER_DB"] = args.db
+    os.environ["TRAINER_AUTO_MIGRATE"] = "0"
+    import db
+
+    print(f"{db.DB_PATH}: 스키마 버전 {db.schema_version()} (최신 {db.MIGRATIONS[-1][0]})")
+    pending = db.pending_migrations()
+    for version, title, remaining in pending:
+        left = ", ".join(f"{table} {n:,}" for table, n in remaining.items())
+        print(f"  v{version} {title} — 남은 복사: {left}")
+    if args.status or not pending:
+        return
+
+    copied = {}
+
+    def progress(version, table, n):
+        copied[table] = copied.get(table, 0) + n
+        print(f"\r  v{version} {table}: {copied[table]:,}행 복사", end="", flush=True)
+
+    started = time.perf_counter()
+    applied = db.migrate(batch=args.batch, pause=args.pause, prepare_only=args.prepare, progress=progress)
+    if copied:
+        print()
+    if args.prepare:
+        print(f"복사 완료 ({time.perf_counter() - started:.1f}s). 새 버전으로 봇을 재시작하면 테이블을 교체합니다.")
+    else:
+        print(f"적용: {', '.join(f'v{v}' for v in applied)} ({time.perf_counter() - started:.1f}s)")
+    sys.exit(0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,306 @@
+# replay.py
+# 활동 이벤트 저널(db.events)을 재생해 배지·주간 횟수·랭킹을 다시 계산합니다.
+#   - 라이브 테이블(users, weekly_status 등)은 건드리지 않고 메모리에서만 계산합니다.
+#   - 가장 최근 스냅샷에서 시작해 그 뒤 이벤트만 재생하므로, 정기 작업 후 찍어 둔 스냅샷이 있으면 금방 끝납니다.
+#   - 배지 규칙은 Rule 하위 클래스로 꽂아 넣습니다. 새 규칙은 처음부터(from_scratch) 재생해 과거 전체에 소급 적용해 볼 수 있습니다.
+#     python replay.py --verify                     # 재생 결과와 라이브 배지 비교
+#     python replay.py --from-scratch --rule perfect_week --top 10
+import argparse
+import heapq
+import json
+import sys
+import time
+from datetime import date, timedelta
+from typing import Iterable, Optional
+
+import db
+
+
+def _monday(day: str) -> str:
+    d = date.fromisoformat(day)
+    return (d - timedelta(days=d.weekday())).isoformat()
+
+
+class UserAgg:
+    """사용자 한 명의 재생 상태."""
+
+    __slots__ = ("badges", "goals", "weight_achieved", "weeks", "achieved")
+
+    def __init__(self):
+        self.badges: dict[str, int] = {}          # 규칙 이름 → 받은 개수
+        self.goals: dict[str, int] = {}           # 목표 종류 → 주당 횟수 (체중 목표는 0)
+        self.weight_achieved = False              # 현재 체중 목표로 비키니 배지를 받았는지
+        self.weeks: dict[str, list] = {}          # 아직 마감되지 않은 주 → [운동 횟수, 식단 횟수]
+        self.achieved: set[str] = set()           # 운동·식단 목표를 모두 달성한 주 (월간 판정 전까지만 유지)
+
+    @property
+    def badge_total(self) -> int:
+        return sum(self.badges.values())
+
+
+class Rule:
+    """배지 규칙. 필요한 훅만 구현하고, 지급할 배지 개수를 반환합니다."""
+
+    name = ""
+
+    def on_event(self, agg: UserAgg, kind: str, day: str, data: dict) -> int:
+        """사용자 이벤트(운동, 식단, 목표, 체중)마다 호출됩니다."""
+        return 0
+
+    def on_week_closed(self, agg: UserAgg, week: str, counts: list, achieved: bool) -> int:
+        """그 주에 기록이 있던 사용자마다 주 마감 시 호출됩니다. counts = [운동, 식단]."""
+        return 0
+
+    def on_month_closed(self, agg: UserAgg, year_month: str, mondays: list) -> int:
+        """달 마감 시, 최근 달성한 주가 있는 사용자마다 호출됩니다."""
+        return 0
+
+
+class WeeklyBadge(Rule):
+    """주간 배지: 그 주 운동·식단 목표를 모두 달성. (db._award_weekly_badges)"""
+
+    name = "weekly"
+
+    def on_week_closed(self, agg, week, counts, achieved):
+        return int(achieved)
+
+
+class MonthlyTrophy(Rule):
+    """월간 트로피: 그 달의 월요일 시작 주를 모두 달성. (db._award_monthly_trophy)"""
+
+    name = "monthly"
+
+    def on_month_closed(self, agg, year_month, mondays):
+        return int(all(m in agg.achieved for m in mondays))
+
+
+class Bikini(Rule):
+    """비키니 배지: 체중 목표 하나당 목표 체중에 처음 도달했을 때 한 번."""
+
+    name = "bikini"
+
+    def on_event(self, agg, kind, day, data):
+        if kind in ("weight", "goal") and data.get("reached") and "weight" in agg.goals and not agg.weight_achieved:
+            agg.weight_achieved = True
+            return 1
+        return 0
+
+
+class PerfectWeek(Rule):
+    """(예시) 한 주에 운동 7회를 모두 채운 주마다 1개. 새 규칙을 과거 기록에 소급 적용하는 예입니다."""
+
+    name = "perfect_week"
+
+    def on_week_closed(self, agg, week, counts, achieved):
+        return int(counts[0] >= 7)
+
+
+RULES = {rule.name: rule for rule in (WeeklyBadge, MonthlyTrophy, Bikini, PerfectWeek)}
+DEFAULT_RULES = ("weekly", "monthly", "bikini")   # users 의 badge_* 컬럼과 같은 배지
+LIVE_COLUMNS = {"weekly": "badge_weekly", "monthly": "badge_monthly", "bikini": "badge_bikini"}
+
+
+class Replay:
+    """이벤트를 seq 순서로 적용해 사용자별 집계를 만듭니다."""
+
+    def __init__(self, rules: Optional[Iterable[Rule]] = None):
+        self.rules = list(rules) if rules is not None else [RULES[name]() for name in DEFAULT_RULES]
+        self.users: dict[str, UserAgg] = {}
+        self.seq = 0
+        self.last_closed = ""                      # 마지막으로 마감된 주 (이 주 이전 날짜의 기록은 무시)
+        self._pending: dict[str, set] = {}         # 열린 주 → 기록이 있는 user_id
+        self._achievers: set[str] = set()          # achieved 가 비어 있지 않은 user_id
+
+    def _user(self, user_id: str) -> UserAgg:
+        agg = self.users.get(user_id)
+        if agg is None:
+            agg = self.users[user_id] = UserAgg()
+        return agg
+
+    def _award(self, agg: UserAgg, rule: Rule, n: int):
+        if n:
+            agg.badges[rule.name] = agg.badges.get(rule.name, 0) + n
+
+    # ---------------------------------------------------------------- 스냅샷
+    def state(self) -> dict:
+        """스냅샷으로 저장할 JSON 호환 상태."""
+        return {
+            "last_closed": self.last_closed,
+            "users": {uid: {"badges": agg.badges, "goals": agg.goals, "weight_achieved": agg.weight_achieved,
+                            "weeks": agg.weeks, "achieved": sorted(agg.achieved)}
+                      for uid, agg in self.users.items()},
+        }
+
+    def load_state(self, seq: int, state: dict):
+        self.seq = seq
+        self.last_closed = state.get("last_closed") or ""
+        names = {rule.name for rule in self.rules}
+        for uid, u in state["users"].items():
+            agg = self._user(uid)
+            # 스냅샷에 없는 규칙(새 규칙)은 스냅샷 이후 이벤트부터만 셉니다.
+            agg.badges = {name: n for name, n in u["badges"].items() if name in names and n}
+            agg.goals = u["goals"]
+            agg.weight_achieved = u["weight_achieved"]
+            agg.weeks = u["weeks"]
+            agg.achieved = set(u["achieved"])
+            for week in agg.weeks:
+                self._pending.setdefault(week, set()).add(uid)
+            if agg.achieved:
+                self._achievers.add(uid)
+
+    # ---------------------------------------------------------------- 재생
+    def apply(self, seq: int, kind: str, user_id: str, day: str, data: Optional[dict]):
+        self.seq = seq
+        if kind == "week_closed":
+            self._close_week(day)
+            return
+        if kind == "month_closed":
+            self._close_month(day)
+            return
+        data = data or {}
+        agg = self._user(user_id)
+        if kind in ("exercise", "diet"):
+            week = _monday(day)
+            if week <= self.last_closed:   # 정산이 끝난 주에 늦게 들어온 기록은 라이브에서도 배지에 반영되지 않음
+                return
+            agg.weeks.setdefault(week, [0, 0])[kind == "diet"] += data.get("n", 1)
+            self._pending.setdefault(week, set()).add(user_id)
+        elif kind == "goal":
+            agg.goals[data["type"]] = data.get("per_week") or 0
+            if data["type"] == "weight":
+                agg.weight_achieved = False
+        elif kind == "goal_end":
+            agg.goals.pop(data["type"], None)
+            if data["type"] == "weight":
+                agg.weight_achieved = False
+        for rule in self.rules:
+            self._award(agg, rule, rule.on_event(agg, kind, day, data))
+
+    def _close_week(self, week: str):
+        # 정산되지 않고 지나간 더 이른 주(봇 도입 전 등)는 버립니다.
+        for stale in [w for w in self._pending if w < week]:
+            for uid in self._pending.pop(stale):
+                self.users[uid].weeks.pop(stale, None)
+        for uid in self._pending.pop(week, ()):
+            agg = self.users[uid]
+            counts = agg.weeks.pop(week)
+            ex_goal, dt_goal = agg.goals.get("freq_exercise"), agg.goals.get("freq_diet")
+            achieved = ex_goal is not None and dt_goal is not None and counts[0] >= ex_goal and counts[1] >= dt_goal
+            if achieved:
+                agg.achieved.add(week)
+                self._achievers.add(uid)
+            for rule in self.rules:
+                self._award(agg, rule, rule.on_week_closed(agg, week, counts, achieved))
+        self.last_closed = max(self.last_closed, week)
+
+    def _close_month(self, year_month: str):
+        first_monday, last_day, count = db._month_mondays(year_month)
+        mondays = [(first_monday + timedelta(days=7 * i)).isoformat() for i in range(count)]
+        last_monday = mondays[-1]
+        for uid in list(self._achievers):
+            agg = self.users[uid]
+            for rule in self.rules:
+                self._award(agg, rule, rule.on_month_closed(agg, year_month, mondays))
+            # 이 달까지의 달성 주는 더 필요 없음
+            agg.achieved = {w for w in agg.achieved if w > last_monday}
+            if not agg.achieved:
+                self._achievers.discard(uid)
+
+    def run(self, until_seq: Optional[int] = None) -> int:
+        """저널에서 현재 seq 이후 이벤트를 읽어 적용하고, 적용한 이벤트 수를 반환합니다."""
+        n = 0
+        for seq, kind, user_id, day, data in db.iter_events(self.seq, until_seq):
+            self.apply(seq, kind, user_id, day, json.loads(data) if data else None)
+            n += 1
+        return n
+
+    # ---------------------------------------------------------------- 조회
+    def badge_counts(self, name: Optional[str] = None) -> dict[str, int]:
+        """{user_id: 배지 수}. name 이 없으면 모든 규칙의 합계."""
+        if name is None:
+            return {uid: agg.badge_total for uid, agg in self.users.items() if agg.badges}
+        return {uid: agg.badges[name] for uid, agg in self.users.items() if agg.badges.get(name)}
+
+    def rankings(self, k: int = 5, week: Optional[str] = None) -> dict[str, list]:
+        """배지 합계, week(기본: 가장 최근 열린 주) 운동/식단 횟수 상위 k명의 (user_id, 점수).
+        주간 횟수는 해당 목표가 있는 사용자만 셉니다. (db.get_ranking_scores 와 같은 기준)"""
+        if week is None:
+            week = max(self._pending, default="")
+        ranked = {"badges": heapq.nlargest(k, self.badge_counts().items(), key=lambda kv: (kv[1], kv[0]))}
+        for i, (key, goal) in enumerate((("exercise", "freq_exercise"), ("diet", "freq_diet"))):
+            scores = ((uid, self.users[uid].weeks[week][i]) for uid in self._pending.get(week, ())
+                      if goal in self.users[uid].goals)
+            ranked[key] = heapq.nlargest(k, scores, key=lambda kv: (kv[1], kv[0]))
+        return ranked
+
+
+def rebuild(rules: Optional[Iterable[Rule]] = None, until_seq: Optional[int] = None,
+            from_scratch: bool = False) -> Replay:
+    """until_seq(기본: 끝)까지 재생한 Replay. from_scratch 면 스냅샷 없이 저널 처음부터 재생합니다."""
+    replay = Replay(rules)
+    snapshot = None if from_scratch else db.get_latest_snapshot(until_seq)
+    if snapshot is not None:
+        last_seq, _, state = snapshot
+        replay.load_state(last_seq, state)
+    replay.run(until_seq)
+    return replay
+
+
+def take_snapshot(as_of: Optional[date] = None) -> int:
+    """현재 저널 끝까지 재생한 기본 규칙 상태를 스냅샷으로 저장하고 그 seq 를 반환합니다. (정기 작업 직후 호출)"""
+    replay = rebuild(until_seq=db.get_journal_head())
+    db.save_snapshot(replay.seq, (as_of or date.today()).isoformat(), replay.state())
+    return replay.seq
+
+
+def verify(replay: Replay) -> list[tuple[str, str, int, int]]:
+    """재생한 기본 배지와 users 테이블 값이 다른 (user_id, 규칙, 재생 값, 라이브 값) 목록."""
+    live = {}
+    with db._reader() as cursor:
+        cursor.execute(f"SELECT user_id, {', '.join(LIVE_COLUMNS.values())} FROM users")
+        for uid, *counts in cursor.fetchall():
+            live[uid] = dict(zip(LIVE_COLUMNS, counts))
+    diffs = []
+    for uid in sorted(set(live) | set(replay.users)):
+        agg = replay.users.get(uid)
+        for name in LIVE_COLUMNS:
+            got = agg.badges.get(name, 0) if agg is not None else 0
+            want = live.get(uid, {}).get(name) or 0
+            if got != want:
+                diffs.append((uid, name, got, want))
+    return diffs
+
+
+def main():
+    parser = argparse.ArgumentParser(description="활동 이벤트 저널 재생")
+    parser.add_argument("--db", help="DB 파일 (기본: TRAINER_DB 또는 trainer.db)")
+    parser.add_argument("--until-seq", type=int, help="이 seq 까지만 재생")
+    parser.add_argument("--from-scratch", action="store_true", help="스냅샷 없이 저널 처음부터 재생")
+    parser.add_argument("--rule", action="append", choices=sorted(RULES),
+                        help="적용할 규칙 (여러 번 지정 가능, 기본: weekly, monthly, bikini)")
+    parser.add_argument("--top", type=int, default=5, help="랭킹 출력 인원")
+    parser.add_argument("--verify", action="store_true", help="기본 배지를 users 테이블과 비교")
+    parser.add_argument("--snapshot", action="store_true", help="재생 후 스냅샷 저장")
+    args = parser.parse_args()
+
+    if args.db:
+        db.init_db(args.db)
+    rules = [RULES[name]() for name in args.rule] if args.rule else None
+    started = time.perf_counter()
+    replay = rebuild(rules, args.until_seq, args.from_scratch)
+    print(f"seq {replay.seq} 까지 재생, 사용자 {len(replay.users)}명, {time.perf_counter() - started:.2f}s")
+    for key, rows in replay.rankings(args.top).items():
+        print(f"[{key}] " + ", ".join(f"{uid}={score}" for uid, score in rows))
+    if args.snapshot and rules is None:   # 스냅샷은 기본 규칙 상태만 저장
+        db.save_snapshot(replay.seq, date.today().isoformat(), replay.state())
+        print("스냅샷 저장")
+    if args.verify:
+        diffs = verify(replay)
+        for uid, name, got, want in diffs[:20]:
+            print(f"  {uid} {name}: 재생 {got} / 라이브 {want}")
+        print(f"불일치 {len(diffs)}건")
+        sys.exit(1 if diffs else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,348 @@
+# store.py
+# main.py 의 사용자 상태(user_goals)와 DM 대화 상태(weight_dm_context 등)를 SQLite 에 영구 저장합니다.
+#   - UserStore: 크기 제한 LRU 캐시 + write-through. 처음 접근할 때 DB 에서 읽어 오고(lazy),
+#                변경은 항상 DB 에 먼저 기록한 뒤 캐시에 반영합니다.
+#   - DMContextStore: 진행 중인 DM 대화 단계를 dict 처럼 쓰되, 바뀔 때마다 DB 에 기록합니다.
+# 캐시 항목은 __slots__ 클래스(UserState)이고, 이번 주 요일별 인증 여부는 7비트 마스크(월=bit0 ~ 일=bit6)로 둡니다.
+# 연속·개인 기록(StreakRecord)도 캐시에 두고 인증할 때마다 이어 갱신하므로, 기록 확인에 로그 조회가 필요 없습니다.
+from collections import OrderedDict
+from datetime import date, datetime, timedelta
+from typing import Callable, Optional
+
+import db_async
+
+WEEKDAY_NAMES = ["월", "화", "수", "목", "금"]
+WEEKDAY_MASK = 0b0011111   # 월~금
+
+
+def week_bounds(today) -> tuple[str, str]:
+    """today 가 속한 주의 (월요일, 일요일) 날짜 문자열."""
+    monday = today - timedelta(days=today.weekday())
+    return monday.strftime("%Y-%m-%d"), (monday + timedelta(days=6)).strftime("%Y-%m-%d")
+
+
+def _week_key(today) -> int:
+    """today 가 속한 주 월요일의 ordinal. (캐시 항목의 주 비교용)"""
+    return today.toordinal() - today.weekday()
+
+
+class FreqGoal:
+    """주당 횟수 목표(운동/식단)."""
+
+    __slots__ = ("per_week", "achieved_this_week")
+
+    def __init__(self, per_week: int, achieved_this_week: int = 0):
+        self.per_week = per_week
+        self.achieved_this_week = achieved_this_week
+
+
+class WeightGoal:
+    """체중 감량 목표."""
+
+    __slots__ = ("weeks", "start_weight", "target_weight", "achieved", "progress_pct")
+
+    def __init__(self, weeks: int, start_weight: float, target_weight: float,
+                 achieved: bool = False, progress_pct: int = 0):
+        self.weeks = weeks
+        self.start_weight = start_weight
+        self.target_weight = target_weight
+        self.achieved = achieved
+        self.progress_pct = progress_pct
+
+
+class StreakRecord:
+    """연속 기록·개인 기록(운동/식단 각각). 날짜는 date.toordinal() 값으로 둡니다.
+    DB(user_records)와 같은 규칙으로 캐시에서도 이어 갱신합니다."""
+
+    __slots__ = ("current_streak", "longest_streak", "last_day", "best_week", "best_week_start", "total",
+                 "week", "week_count")
+
+    def __init__(self):
+        self.current_streak = 0
+        self.longest_streak = 0
+        self.last_day: Optional[int] = None         # 마지막 인증일
+        self.best_week = 0
+        self.best_week_start: Optional[int] = None  # 최고 주간 기록을 세운 주의 월요일
+        self.total = 0
+        self.week: Optional[int] = None             # last_day 가 속한 주의 월요일과 그 주 횟수
+        self.week_count = 0
+
+    def streak_on(self, today) -> int:
+        """today 기준 현재 연속 일수. 어제까지 이어져 있으면 오늘 아직 안 했어도 유지됩니다."""
+        if self.last_day is None or self.last_day < today.toordinal() - 1:
+            return 0
+        return self.current_streak
+
+    def add(self, day, amount: int = 1) -> bool:
+        """day 에 amount 회 인증을 반영합니다. 마지막 인증일보다 앞선 날이면 False (DB 에서 다시 읽어야 함)."""
+        n = day.toordinal()
+        if self.last_day is not None and n < self.last_day:
+            return False
+        if n != self.last_day:
+            self.current_streak = self.current_streak + 1 if self.last_day == n - 1 else 1
+            self.longest_streak = max(self.longest_streak, self.current_streak)
+            self.last_day = n
+        week = _week_key(day)
+        if week != self.week:
+            self.week, self.week_count = week, 0
+        self.week_count += amount
+        if self.week_count > self.best_week:
+            self.best_week, self.best_week_start = self.week_count, week
+        self.total += amount
+        return True
+
+
+class UserState:
+    """user_goals 캐시 항목. 목표가 없으면 해당 필드는 None 입니다."""
+
+    __slots__ = ("week", "nickname", "weekly_badges", "bikinis", "monthly_trophies",
+                 "frequency_goal", "diet_goal", "weight_goal", "exercise_days", "diet_days",
+                 "exercise_record", "diet_record")
+
+    def __init__(self, week: int, nickname: Optional[str] = None):
+        self.week = week
+        self.nickname = nickname
+        self.weekly_badges = 0
+        self.bikinis = 0
+        self.monthly_trophies = 0
+        self.frequency_goal: Optional[FreqGoal] = None
+        self.diet_goal: Optional[FreqGoal] = None
+        self.weight_goal: Optional[WeightGoal] = None
+        self.exercise_days = 0   # 이번 주 운동 인정된 요일 비트
+        self.diet_days = 0       # 이번 주 식단 인증한 요일 비트
+        self.exercise_record = StreakRecord()
+        self.diet_record = StreakRecord()
+
+    @property
+    def has_goal(self) -> bool:
+        return self.frequency_goal is not None or self.diet_goal is not None or self.weight_goal is not None
+
+    @property
+    def badge_total(self) -> int:
+        return self.weekly_badges + self.bikinis + self.monthly_trophies
+
+    def done_on(self, weekday: int) -> bool:
+        """해당 요일(월=0)에 운동 또는 식단 인증이 있었는지."""
+        return bool((self.exercise_days | self.diet_days) >> weekday & 1)
+
+    def done_weekdays(self) -> int:
+        """월~금 중 운동 또는 식단 인증이 있었던 날 수."""
+        return bin((self.exercise_days | self.diet_days) & WEEKDAY_MASK).count("1")
+
+
+def _build_state(raw: Optional[dict], week: int) -> UserState:
+    """db.load_user_state 결과를 UserState 로 바꿉니다."""
+    state = UserState(week)
+    if raw is None:
+        return state
+    state.nickname = raw["nickname"]
+    state.weekly_badges = raw["badges"]["weekly"]
+    state.bikinis = raw["badges"]["bikini"]
+    state.monthly_trophies = raw["badges"]["monthly"]
+    progress = raw["progress"]
+    # daily 는 이번 주 월~일 순서
+    for bit, counts in enumerate(progress["daily"].values()):
+        if counts["exercise"]:
+            state.exercise_days |= 1 << bit
+        if counts["diet"]:
+            state.diet_days |= 1 << bit
+    for kind, rec in (("exercise", state.exercise_record), ("diet", state.diet_record)):
+        r = raw["records"].get(kind)
+        if r is None:
+            continue
+        rec.current_streak = r["current_streak"]
+        rec.longest_streak = r["longest_streak"]
+        rec.last_day = date.fromisoformat(r["last_day"]).toordinal()
+        rec.best_week = r["best_week"]
+        rec.best_week_start = date.fromisoformat(r["best_week_start"]).toordinal() if r["best_week_start"] else None
+        rec.total = r["total"]
+        rec.week = rec.last_day - date.fromordinal(rec.last_day).weekday()
+        rec.week_count = r["last_week_count"]
+    goals = raw["goals"]
+    if "weight" in goals:
+        g = goals["weight"]
+        weeks = 0
+        if g["start_date"] and g["end_date"]:
+            start = datetime.strptime(g["start_date"], "%Y-%m-%d")
+            end = datetime.strptime(g["end_date"], "%Y-%m-%d")
+            weeks = (end - start).days // 7
+        state.weight_goal = WeightGoal(
+            weeks,
+            g["start_weight"] if g["start_weight"] is not None else g["current_weight"],
+            g["target_weight"],
+            bool(g["achieved"]),
+            g["progress_pct"] or 0,
+        )
+    if "freq_exercise" in goals:
+        state.frequency_goal = FreqGoal(goals["freq_exercise"]["freq_per_week"], progress["exercise_done"])
+    if "freq_diet" in goals:
+        state.diet_goal = FreqGoal(goals["freq_diet"]["freq_per_week"], progress["diet_done"])
+    return state
+
+
+class UserStore:
+    """사용자 상태의 write-through LRU 캐시.
+
+    today_fn: 현재 날짜(KST)를 돌려주는 함수. 주가 바뀌면 캐시 항목을 다시 읽습니다.
+    on_change: 상태가 바뀔 때마다 (user_id, state) 로 호출됩니다. (랭킹판 갱신용)
+    """
+
+    def __init__(self, today_fn: Callable, capacity: int = 2048, on_change: Optional[Callable] = None):
+        self.today_fn = today_fn
+        self.capacity = capacity
+        self.on_change = on_change
+        self._cache: "OrderedDict[str, UserState]" = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self) -> int:
+        return len(self._cache)
+
+    def _put(self, user_id: str, state: UserState):
+        self._cache[user_id] = state
+        self._cache.move_to_end(user_id)
+        while len(self._cache) > self.capacity:
+            self._cache.popitem(last=False)
+
+    def _changed(self, user_id: str, state: UserState):
+        if self.on_change is not None:
+            self.on_change(user_id, state)
+
+    async def get(self, user_id: str) -> UserState:
+        """사용자 상태를 반환합니다. 캐시에 없거나 주가 바뀌었으면 DB 에서 읽어 옵니다."""
+        today = self.today_fn()
+        week = _week_key(today)
+        state = self._cache.get(user_id)
+        if state is not None and state.week == week:
+            self.hits += 1
+            self._cache.move_to_end(user_id)
+            return state
+        self.misses += 1
+        week_start, week_end = week_bounds(today)
+        raw = await db_async.load_user_state(user_id, week_start, week_end)
+        state = _build_state(raw, week)
+        self._put(user_id, state)
+        return state
+
+    def peek(self, user_id: str) -> Optional[UserState]:
+        return self._cache.get(user_id)
+
+    def invalidate(self, user_id: Optional[str] = None):
+        """캐시 항목을 버립니다. user_id 가 없으면 전체. (일괄 배지 지급 후 등)"""
+        if user_id is None:
+            self._cache.clear()
+        else:
+            self._cache.pop(user_id, None)
+
+    async def _reload(self, user_id: str) -> UserState:
+        self._cache.pop(user_id, None)
+        state = await self.get(user_id)
+        self._changed(user_id, state)
+        return state
+
+    # ---------------------------------------------------------------- 목표 설정
+    async def set_frequency_goal(self, user_id: str, nickname: str, per_week: int) -> UserState:
+        await db_async.set_freq_goal(user_id, nickname, "freq_exercise", per_week, self.today_fn().strftime("%Y-%m-%d"))
+        return await self._reload(user_id)
+
+    async def set_diet_goal(self, user_id: str, nickname: str, per_week: int) -> UserState:
+        await db_async.set_freq_goal(user_id, nickname, "freq_diet", per_week, self.today_fn().strftime("%Y-%m-%d"))
+        return await self._reload(user_id)
+
+    async def set_weight_goal(self, user_id: str, nickname: str, weeks: int,
+                              start_weight: float, target_weight: float) -> UserState:
+        today = self.today_fn()
+        await db_async.set_weight_goal(
+            user_id, nickname,
+            today.strftime("%Y-%m-%d"), (today + timedelta(weeks=weeks)).strftime("%Y-%m-%d"),
+            target_weight, start_weight, start_weight,
+        )
+        return await self._reload(user_id)
+
+    # ---------------------------------------------------------------- 활동 기록
+    async def record_exercise(self, user_id: str, day=None, event_id: Optional[str] = None) -> bool:
+        """day(기본: 오늘)에 운동 1회를 기록합니다. 운동 목표가 없거나 그날 이미 인정됐으면 False.
+        event_id(음성 세션)를 주면 같은 이벤트는 한 번만 반영합니다."""
+        state = await self.get(user_id)
+        if state.frequency_goal is None:
+            return False
+        day = day or self.today_fn()
+        this_week = _week_key(day) == state.week   # 자정을 넘긴 음성 세션은 지난 주 날짜일 수 있음
+        bit = 1 << day.weekday()
+        if this_week and state.exercise_days & bit:   # 하루 1회만 인정
+            return False
+        if await db_async.increment_exercise_log(user_id, day.strftime("%Y-%m-%d"), event_id) is None:
+            return False   # 이미 반영된 이벤트
+        if this_week:
+            state.exercise_days |= bit
+            state.frequency_goal.achieved_this_week += 1
+        if this_week and state.exercise_record.add(day):
+            self._changed(user_id, state)
+        else:
+            await self._reload(user_id)   # 지난 날짜: 연속 기록은 DB 가 다시 계산한 값을 읽어 옴
+        return True
+
+    async def record_diet(self, user_id: str, event_id: Optional[str] = None) -> bool:
+        """식단 인증 1회를 기록합니다. 식단 목표가 없으면 False.
+        event_id(포럼 스레드 ID)를 주면 같은 글은 한 번만 반영합니다."""
+        state = await self.get(user_id)
+        if state.diet_goal is None:
+            return False
+        today = self.today_fn()
+        if await db_async.increment_diet_log(user_id, today.strftime("%Y-%m-%d"), event_id) is None:
+            return False   # 이미 반영된 글
+        state.diet_days |= 1 << today.weekday()
+        state.diet_goal.achieved_this_week += 1
+        if state.diet_record.add(today):
+            self._changed(user_id, state)
+        else:
+            await self._reload(user_id)
+        return True
+
+    async def record_weight(self, user_id: str, new_weight: float) -> int:
+        """주간 체중을 기록하고 진행률(%)을 반환합니다. 목표 첫 달성 시 비키니 배지가 지급됩니다."""
+        state = await self.get(user_id)
+        wg = state.weight_goal
+        total_diff = wg.start_weight - wg.target_weight
+        if total_diff <= 0:
+            pct = 100
+        else:
+            pct = int(((wg.start_weight - new_weight) / total_diff) * 100)
+            pct = max(0, min(100, pct))
+        newly_achieved = await db_async.record_weight(user_id, new_weight, pct)
+        wg.progress_pct = pct
+        if new_weight <= wg.target_weight:
+            wg.achieved = True
+        if newly_achieved:
+            state.bikinis += 1
+        self._changed(user_id, state)
+        return pct
+
+
+class DMContextStore:
+    """진행 중인 DM 대화 상태. 읽기는 메모리에서, 변경은 DB 에도 기록합니다."""
+
+    def __init__(self, flow: str):
+        self.flow = flow
+        self._data: dict[str, dict] = {}
+
+    async def load(self):
+        """봇 시작 시 DB 에 남아 있는 대화 상태를 불러옵니다."""
+        self._data = await db_async.load_dm_contexts(self.flow)
+
+    def __contains__(self, user_id: str) -> bool:
+        return user_id in self._data
+
+    def __getitem__(self, user_id: str) -> dict:
+        return self._data[user_id]
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    async def set(self, user_id: str, data: dict):
+        self._data[user_id] = data
+        await db_async.save_dm_context(self.flow, user_id, data)
+
+    async def delete(self, user_id: str):
+        self._data.pop(user_id, None)
+        await db_async.delete_dm_context(self.flow, user_id)
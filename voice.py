@@ -0,0 +1,76 @@
+# voice.py
+# 음성 채널 운동 인증 세션 엔진.
+#   - 트래킹 채널은 ID 집합으로 비교하고, 채널이 바뀌지 않는 음성 상태 변경(음소거, 화면 공유 등)은 무시합니다.
+#   - 트래킹 채널 사이의 이동은 같은 세션으로 이어집니다.
+#   - 머문 시간은 사용자·날짜별로 누적되며(자정을 넘기면 날짜별로 나눔), 하루 누적이 min_minutes 를
+#     처음 넘는 순간 on_credit(user_id, 날짜, 이벤트 ID) 가 호출됩니다. (운동 1회 인정)
+#     이벤트 ID 는 '세션 ID:날짜' 로, 같은 세션의 인정이 두 번 반영되지 않게 합니다.
+#   - 열린 세션은 DB 에 있으므로 봇이 재시작돼도 사라지지 않습니다.
+from datetime import date, datetime
+from typing import Awaitable, Callable, Iterable, Optional
+
+import db_async
+
+
+class VoiceTracker:
+    """음성 채널 체류 시간 추적기.
+
+    now_fn: 현재 시각(KST)을 돌려주는 함수
+    on_credit: 하루 누적 시간이 기준을 넘었을 때 (user_id, date, event_id) 로 await 됩니다.
+    """
+
+    def __init__(self, now_fn: Callable[[], datetime], on_credit: Callable[[str, date, str], Awaitable],
+                 channel_ids: Iterable[int] = (), min_minutes: float = 15):
+        self.now_fn = now_fn
+        self.on_credit = on_credit
+        self.channel_ids: set[int] = set(channel_ids)
+        self.min_minutes = min_minutes
+        self._open: dict[str, int] = {}   # user_id → 현재 채널 ID
+
+    def _now(self) -> datetime:
+        return self.now_fn().replace(tzinfo=None)
+
+    def __len__(self) -> int:
+        return len(self._open)
+
+    def __contains__(self, user_id: str) -> bool:
+        return user_id in self._open
+
+    async def load(self):
+        """DB 에 남아 있는 열린 세션을 불러옵니다."""
+        self._open = {uid: channel_id for uid, (channel_id, _) in (await db_async.load_voice_sessions()).items()}
+
+    async def on_update(self, user_id: str, before_id: Optional[int], after_id: Optional[int]):
+        """음성 상태 변경 처리. before_id/after_id 는 이전/이후 채널 ID (없으면 None)."""
+        if before_id == after_id:   # 음소거·카메라 등 채널 변화 없음
+            return
+        was_tracked = before_id in self.channel_ids
+        is_tracked = after_id in self.channel_ids
+        if is_tracked:
+            await self._start(user_id, after_id)   # 트래킹 채널 간 이동이면 시작 시각 유지
+        elif was_tracked:
+            await self._stop(user_id)
+
+    async def reconcile(self, present: dict[str, int], left_at: Optional[datetime] = None):
+        """봇 시작 시 실제 음성 채널 상태와 맞춥니다.
+
+        present: 지금 트래킹 채널에 있는 {user_id: channel_id}
+        left_at: 꺼져 있던 동안 나간 사람의 세션을 닫을 시각 (봇이 마지막으로 살아 있던 시각, 없으면 지금)
+        """
+        for uid in [uid for uid in self._open if uid not in present]:
+            await self._stop(uid, left_at)
+        for uid, channel_id in present.items():
+            if self._open.get(uid) != channel_id:
+                await self._start(uid, channel_id)
+
+    async def _start(self, user_id: str, channel_id: int):
+        await db_async.open_voice_session(user_id, channel_id, self._now())
+        self._open[user_id] = channel_id
+
+    async def _stop(self, user_id: str, at: Optional[datetime] = None):
+        if self._open.pop(user_id, None) is None:
+            return
+        at = at.replace(tzinfo=None) if at is not None else self._now()
+        for day, before, after, session_id in await db_async.close_voice_session(user_id, at):
+            if before < self.min_minutes <= after:
+                await self.on_credit(user_id, date.fromisoformat(day), f"{session_id}:{day}")